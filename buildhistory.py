@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# buildhistory - Keep track of how long resources (servers, images, database
+# instances) took to become ACTIVE, so that later runs can predict how long
+# to wait before they start polling.  When run as a script, print percentile
+# build times from that history.
+
+# Copyright 2013 Scott Gilbert
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+# Required Parameters:
+#   none
+#
+# Optional Parameters:
+#   -h, --help                show help message and exit
+#   --kind KIND               Only show history for this kind of resource
+#                             (server, image or database)
+#   --historyfile FILE        Build history file to read
+
+
+import os
+import time
+import json
+import math
+import argparse
+import threading
+
+HISTORY_FILE = os.path.expanduser("~/.rackspace_build_history")
+
+# number of most recent builds used when predicting the next one
+RECENT_BUILDS = 20
+
+_lock = threading.Lock()
+
+def client_region(obj):
+  """Given a pyrax client, manager or resource object, do our best to dig out
+  the region it talks to.  Return 'unknown' if we can't find one.
+  """
+  for path in (['region_name'], ['client', 'region_name'],
+               ['api', 'client', 'region_name'],
+               ['manager', 'api', 'client', 'region_name'],
+               ['manager', 'api', 'region_name']):
+    val = obj
+    try:
+      for attr in path:
+        val = getattr(val, attr)
+    except AttributeError:
+      continue
+    if isinstance(val, basestring):
+      return val
+  return 'unknown'
+
+def record_build(kind, flavor, image, region, seconds,
+                 historyFile=HISTORY_FILE):
+  """Append one build duration to the history file (one JSON document per
+  line).  A failure to write history never gets in the way of the build
+  itself.
+  """
+  entry = {"kind": kind, "flavor": str(flavor), "image": str(image),
+           "region": region, "seconds": round(seconds, 1),
+           "when": int(time.time())}
+  try:
+    with _lock:
+      with open(historyFile, 'a') as hist:
+        hist.write(json.dumps(entry) + "\n")
+  except IOError:
+    pass
+
+def load_history(historyFile=HISTORY_FILE):
+  """Return list of all recorded builds, oldest first."""
+  history = []
+  try:
+    with open(historyFile, 'r') as hist:
+      for line in hist:
+        try:
+          history.append(json.loads(line))
+        except ValueError:
+          # skip anything half written
+          continue
+  except IOError:
+    pass
+  return history
+
+def build_times(kind, flavor, image, region, historyFile=HISTORY_FILE):
+  """Return list of recorded build durations (seconds, oldest first) for
+  the specified kind of resource, flavor, image and region.
+  """
+  return [h['seconds'] for h in load_history(historyFile)
+          if h['kind'] == kind and h['flavor'] == str(flavor) and
+             h['image'] == str(image) and h['region'] == region]
+
+def percentile(values, pct):
+  """Return the pct percentile (0-100) of a list of numbers, using the
+  nearest-rank method.  Returns None for an empty list.
+  """
+  if not values:
+    return None
+  ordered = sorted(values)
+  rank = int(math.ceil(pct / 100.0 * len(ordered))) - 1
+  return ordered[max(0, min(rank, len(ordered) - 1))]
+
+def predict_build_time(kind, flavor, image, region, minSamples=3,
+                       historyFile=HISTORY_FILE):
+  """Predict how many seconds the next build of this kind/flavor/image/region
+  will take, based on the most recent builds.  We use a low percentile so
+  that we tend to start polling a little early rather than a little late.
+
+  Returns None if there is not enough history to go on.
+  """
+  times = build_times(kind, flavor, image, region, historyFile)[-RECENT_BUILDS:]
+  if len(times) < minSamples:
+    return None
+  return percentile(times, 25)
+
+def print_build_percentiles(history, kind=None):
+  """Print p50/p90/p99 build times for each kind/region/flavor/image
+  combination found in history.
+  """
+  groups = {}
+  for h in history:
+    if kind and h['kind'] != kind:
+      continue
+    key = (h['kind'], h['region'], h['flavor'], h['image'])
+    groups.setdefault(key, []).append(h['seconds'])
+
+  if not groups:
+    print "No build history recorded yet"
+    return
+
+  print "%-9s %-7s %-8s %-38s %5s %7s %7s %7s" % ('Kind', 'Region',
+          'Flavor', 'Image', 'Count', 'p50', 'p90', 'p99')
+  for key in sorted(groups):
+    times = groups[key]
+    print "%-9s %-7s %-8s %-38s %5d %7.0f %7.0f %7.0f" % (key + (len(times),
+            percentile(times, 50), percentile(times, 90),
+            percentile(times, 99)))
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--kind", default=None,
+                      help="Only show history for this kind of resource")
+  parser.add_argument("--historyfile", default=HISTORY_FILE,
+                      help="Build history file to read")
+  args = parser.parse_args()
+
+  print_build_percentiles(load_history(args.historyfile), args.kind)
+
+# vim: ts=2 sw=2 tw=78 expandtab
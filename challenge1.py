@@ -29,26 +29,132 @@
 #   --basename BASENAME       Base name to assign to new servers
 #   --numservers NUMSERVERS   Number of servers to create
 #   --region REGION           Region in which to create servers (DFW or ORD)
+#   --concurrency CONCURRENCY Number of server build requests to send at once
+#   --coroutines              Drive the builds as coroutines from one thread
+#                             (see provision)
 
 
 import os
 import sys
 import time
+import json
+import random
 import argparse
 import pyrax
+import session
+import waiter
+import buildhistory
+from multiprocessing.pool import ThreadPool
+
+# where the region catalog is cached, and for how long (seconds)
+REGION_CATALOG_FILE = os.path.expanduser("~/.rackspace_region_catalog")
+REGION_CATALOG_TTL = 24 * 60 * 60
+
+class RegionCatalog(object):
+  """Which services are offered in which regions, as sets, so checking a
+  region is a set lookup.
+  """
+  def __init__(self, services):
+    """services is a dict of service name -> regions it is offered in"""
+    self.services = dict((name, frozenset(regions))
+                         for name, regions in services.items())
+    self.regions = frozenset().union(*self.services.values())
+
+  @classmethod
+  def from_identity(cls, identity):
+    """Build the catalog from an authenticated pyrax identity.  Endpoints
+    for region ALL count for every region.
+    """
+    services = {}
+    for name, svc in identity.services.items():
+      if isinstance(svc, dict):
+        endpoints = svc.get('endpoints', {})
+      else:
+        endpoints = getattr(svc, 'endpoints', {})
+      services[name] = set(endpoints.keys())
+    everywhere = set().union(*services.values()) - set(['ALL'])
+    for regions in services.values():
+      if 'ALL' in regions:
+        regions.discard('ALL')
+        regions.update(everywhere)
+    return cls(services)
+
+  @classmethod
+  def load(cls, key, catalogFile=REGION_CATALOG_FILE, ttl=REGION_CATALOG_TTL):
+    """Return the catalog cached for the credentials identified by key, or
+    None if there isn't one or it is more than ttl seconds old.
+    """
+    try:
+      with open(catalogFile, 'r') as cache:
+        cached = json.load(cache)
+    except (IOError, ValueError):
+      return None
+    if cached.get('key') != key or cached.get('when', 0) + ttl < time.time():
+      return None
+    return cls(cached['services'])
+
+  def save(self, key, catalogFile=REGION_CATALOG_FILE):
+    """Cache the catalog for the credentials identified by key.  A failure
+    to write the cache never gets in the way.
+    """
+    entry = {"key": key, "when": int(time.time()),
+             "services": dict((name, sorted(regions))
+                              for name, regions in self.services.items())}
+    try:
+      with open(catalogFile, 'w') as cache:
+        json.dump(entry, cache)
+    except IOError:
+      pass
+
+  def regions_for(self, service):
+    """Return set of regions service is offered in"""
+    return self.services.get(service, frozenset())
+
+  def missing(self, region, services):
+    """Return list of the services not offered in region"""
+    return [name for name in services if region not in self.regions_for(name)]
+
+_catalog = None
+
+def region_catalog(credentialFile=session.CREDENTIAL_FILE):
+  """Return the RegionCatalog, worked out once per run.  It comes from
+  pyrax if we have authenticated already, otherwise from the cache on disk
+  - so a bad region can be turned down without touching the network.  If
+  neither has it, authenticate (see session.set_credential_file).  With no
+  credential file there is nothing to key the cache by, so authenticate
+  and let that report the problem.
+  """
+  global _catalog
+  if _catalog is None:
+    try:
+      key = session.credentials_key(credentialFile)
+    except OSError:
+      key = None
+    identity = pyrax.identity
+    if identity is None or not getattr(identity, 'authenticated', False):
+      if key is not None:
+        _catalog = RegionCatalog.load(key)
+        if _catalog is not None:
+          return _catalog
+      session.set_credential_file(credentialFile)
+    _catalog = RegionCatalog.from_identity(pyrax.identity)
+    if key is not None:
+      _catalog.save(key)
+  return _catalog
 
 def valid_regions(service):
   """Return list of valid regions"""
-  # This is the best I've been able to come up with to get a list of valid
-  # regions.  
-  return pyrax.identity.services[service]['endpoints'].keys()
+  return sorted(region_catalog().regions_for(service))
 
 def is_valid_region(region, service):
   """ Check validity of a region for a specified service """
-  if region in valid_regions(service):
-    return True
-  else:
-    return False
+  return region in region_catalog().regions_for(service)
+
+def missing_services(region, services):
+  """Return list of the services a script needs that are not offered in
+  region - empty if the region has all of them.
+  """
+  return region_catalog().missing(region, services)
 
 def is_valid_image(cs, image):
   """Check the validity of a CloudServer image uuid.
@@ -70,13 +176,77 @@ def is_valid_flavor(cs, flavor):
   except:
     return False
 
+def create_server(cs, name, image, flavor, insertFiles={}, nets={},
+                  retries=6):
+  """Request build of a single CloudServer.  If the API tells us we are over
+  our rate limit (HTTP 413 or 429) back off exponentially, with a little
+  jitter, and try again - up to retries times before giving up.
+  """
+  delay = 1
+  for attempt in xrange(retries):
+    try:
+      return cs.servers.create(name, image, flavor, files=insertFiles,
+                               nics=nets)
+    except Exception as err:
+      code = getattr(err, 'code', getattr(err, 'http_status', None))
+      if code not in (413, 429) or attempt == retries - 1:
+        raise
+      time.sleep(delay + random.uniform(0, delay / 2.0))
+      delay = min(delay * 2, 60)
+
+def build_servers_concurrently(cs, flavor, image, names, insertFiles={},
+                               nets={}, concurrency=4):
+  """Request build of a CloudServer for each name in names, sending up to
+  concurrency create requests at once.
+
+  Returns tuple (servers, failed) - servers is the array of server objects
+  in the same order as names, failed is a dict of name -> exception for any
+  build request that could not be made.
+  """
+  def build(name):
+    print "Requesting build for server %s" % name
+    try:
+      return (name, create_server(cs, name, image, flavor, insertFiles, nets))
+    except Exception as err:
+      return (name, err)
+
+  pool = ThreadPool(max(1, min(concurrency, len(names))))
+  try:
+    results = dict(pool.map(build, names))
+  finally:
+    pool.close()
+    pool.join()
+
+  servers = []
+  failed = {}
+  for name in names:
+    if isinstance(results[name], Exception):
+      failed[name] = results[name]
+    else:
+      servers.append(results[name])
+  return (servers, failed)
+
+def server_names(serverBaseName, numServers):
+  """Return list of the names build_some_servers gives numServers servers:
+  serverBaseName followed by a counter starting at 1, or just serverBaseName
+  if there is only one.
+  """
+  if numServers == 1:
+    return [serverBaseName]
+  return ["%s%d" % (serverBaseName, server_num)
+          for server_num in xrange(1, numServers + 1)]
+
 def build_some_servers(cs, flavor, image, serverBaseName, numServers,
-                     insertFiles={}, nets={}):
+                     insertFiles={}, nets={}, concurrency=1):
   """ Request build of CloudServers of specified flavor and image.
   Server hostnames are the combination of serverBaseName and a sequential
   counter, starting with 1 and ending with numServers - unless number of 
   servers is 1, then just the serverBaseName is used.
 
+  If concurrency is greater than 1, up to that many build requests are sent
+  at once.  Any servers that could not be requested are reported and left
+  out of the result.
+
   Returns array of server objects.
 
   Note: Function returns immediately, network info and server build are almost
@@ -84,52 +254,157 @@ def build_some_servers(cs, flavor, image, serverBaseName, numServers,
   """
     
   # Request build of new servers
-  servers=[]
-  if numServers == 1:
-    print "Requesting build for server %s" % serverBaseName
-    servers.append(cs.servers.create(serverBaseName, image, flavor,
-                    files=insertFiles, nics=nets))
-  else:
-    for server_num in xrange(1, numServers + 1):
-      print "Requesting build for server %s%d" % (serverBaseName, server_num)
-      servers.append(cs.servers.create("%s%d" % (serverBaseName, server_num), 
-                                      image, flavor, files=insertFiles,
-                                      nics=nets))
+  names = server_names(serverBaseName, numServers)
+
+  if concurrency <= 1:
+    servers=[]
+    for name in names:
+      print "Requesting build for server %s" % name
+      servers.append(cs.servers.create(name, image, flavor,
+                                       files=insertFiles, nics=nets))
+    return servers
+
+  servers, failed = build_servers_concurrently(cs, flavor, image, names,
+                                               insertFiles, nets,
+                                               concurrency)
+  for name in names:
+    if name in failed:
+      print "Build request for server %s failed: %s" % (name, failed[name])
   return servers
 
+def refresh_servers(servers, pageSize=1000, skipMissing=False):
+  """Given an array of pyrax server objects, refresh all of them in place
+  from the detailed server listing - one API call per page of servers rather
+  than one srv.get() per server.  Any server that does not show up in the
+  listing (it may have been deleted out from under us) is refreshed on its
+  own, which raises pyrax.exceptions.NotFound if it is gone - unless
+  skipMissing is True, in which case the servers that are gone are left
+  as they were and returned as a list.
+  """
+  if not servers:
+    return []
+  manager = servers[0].manager
+  wanted = dict((srv.id, srv) for srv in servers)
+  marker = None
+  while wanted:
+    search = {'limit': pageSize}
+    if marker:
+      search['marker'] = marker
+    page = manager.list(detailed=True, search_opts=search)
+    for detail in page:
+      srv = wanted.pop(detail.id, None)
+      if srv is not None:
+        # same thing srv.get() does, without the extra round trip.  Keeps
+        # attributes that only came back from create (ie: adminPass)
+        srv._add_details(detail._info)
+    if len(page) < pageSize:
+      break
+    marker = page[-1].id
+  missing = []
+  for srv in wanted.values():
+    try:
+      srv.get()
+    except pyrax.exceptions.NotFound:
+      if not skipMissing:
+        raise
+      missing.append(srv)
+  return missing
+
+def wait_for_servers(servers, is_done, hint=None, on_done=None):
+  """Given an array of pyrax server objects, wait until is_done(srv) is True
+  for every one of them.  Each pass refreshes the whole fleet with a single
+  listing (see refresh_servers) and only servers that are not done yet are
+  kept around for the next pass.  Print a little activity indicator to let
+  the user know that we are not stuck.
+
+  hint is the number of seconds we expect to wait (see waiter.intervals),
+  and on_done, if given, is called with each server as it finishes.
+  """
+  pending = dict((srv.id, srv) for srv in servers)
+
+  def check():
+    refresh_servers(pending.values())
+    for srvId, srv in pending.items():
+      if is_done(srv):
+        del pending[srvId]
+        if on_done is not None:
+          on_done(srv)
+    return not pending
+
+  def progress():
+    print '.',
+
+  if pending:
+    waiter.wait_until(check, progress=progress, maximum=15, hint=hint)
+
 def wait_for_server_networks(servers):  
   """Given an array of pyrax server objects, wait until all of the servers
   have network IPs assigned.  Print a little activity indicator to let the
   user know that we are not stuck.
   """
   print "\nWaiting for IP addresses to be assigned..."
-  networks_assigned = False
-  while not networks_assigned:
-    time.sleep(2)
-    print '.', 
-    networks_assigned = True
-    for srv in servers:
-      srv.get()
-      if srv.networks == {} and srv.status <> 'ERROR':  
-        networks_assigned = False
-        break
+  wait_for_servers(servers,
+                   lambda srv: srv.networks != {} or srv.status == 'ERROR')
 
-def wait_for_server_builds(servers):
+def iter_servers_with_networks(servers, has_networks=None):
+  """Given an array of pyrax server objects, yield each server as soon as it
+  has network IPs assigned, so that callers can start using the first
+  servers while the rest are still waiting.  Servers that go to ERROR are
+  never yielded.  has_networks(srv) decides when a server is ready; by
+  default that is as soon as it has a private address.
+  """
+  if has_networks is None:
+    has_networks = lambda srv: bool(srv.networks.get('private'))
+  pending = dict((srv.id, srv) for srv in servers)
+  for delay in waiter.intervals(maximum=15):
+    if not pending:
+      return
+    time.sleep(delay)
+    refresh_servers(pending.values())
+    for srvId in sorted(pending):
+      srv = pending[srvId]
+      if srv.status == 'ERROR':
+        print "\nServer %s went to status ERROR" % srv.name
+        del pending[srvId]
+      elif has_networks(srv):
+        del pending[srvId]
+        yield srv
+
+def wait_for_server_builds(servers, on_done=None):
   """Given an array of pyrax server objects, wait until all of the servers
   builds have completed.  Print a little activity indicator to let the user
   know that we are not stuck.
+
+  on_done, if given, is called with each server as soon as its build
+  finishes (it may have gone to ERROR), while the rest are still building.
   """
   print "\nWaiting for all server builds to complete..."
-  allBuildsComplete = False
-  while not allBuildsComplete:
-    time.sleep(2)
-    print '.',
-    allBuildsComplete = True
-    for srv in servers:
-      srv.get()
-      if srv.status not in ['ACTIVE','ERROR']:
-        allBuildsComplete = False
-        break
+  if not servers:
+    return
+
+  # Build times are measured from when we start waiting, which for all of
+  # our callers is right after the build requests went in.
+  started = time.time()
+  refresh_servers(servers)
+  region = buildhistory.client_region(servers[0])
+  # servers booted from a volume have no image ("" rather than a dict), so
+  # there is nothing to predict from or record against
+  image = servers[0].image and servers[0].image['id']
+  hint = None
+  if image:
+    hint = buildhistory.predict_build_time('server', servers[0].flavor['id'],
+                                           image, region)
+
+  def record(srv):
+    image = srv.image and srv.image['id']
+    if srv.status == 'ACTIVE' and image:
+      buildhistory.record_build('server', srv.flavor['id'], image, region,
+                                time.time() - started)
+    if on_done is not None:
+      on_done(srv)
+
+  wait_for_servers(servers, lambda srv: srv.status in ['ACTIVE','ERROR'],
+                   hint, record)
   
 def print_servers_info(servers):
   """Given an array of pyrax server objects, print basic information about
@@ -166,10 +441,15 @@ if __name__ == "__main__":
                       help="Number of servers to create")
   parser.add_argument("--region", default='DFW',
                       help="Region in which to create servers (DFW or ORD)")
+  parser.add_argument("--concurrency", default=4, type=int,
+                      help="Number of server build requests to send at once")
+  parser.add_argument("--coroutines", action="store_true",
+                      help="Drive the builds as coroutines from one thread "
+                           "(see provision)")
   args = parser.parse_args()
 
   credential_file=os.path.expanduser("~/.rackspace_cloud_credentials")
-  pyrax.set_credential_file(credential_file)
+  session.set_credential_file(credential_file)
 
   if is_valid_region(args.region, 'compute'):
     cs = pyrax.connect_to_cloudservers(region=args.region)
@@ -188,8 +468,19 @@ if __name__ == "__main__":
   # unbuffer stdout for pretty output
   sys.stdout = os.fdopen(sys.stdout.fileno(), 'w', 0)
 
+  if args.coroutines:
+    # provision builds on this module, so it can't be imported at the top
+    import provision
+    names = server_names(args.basename, args.numservers)
+    servers, failed = provision.run(lambda p: provision.build_servers(p, cs,
+            args.flavor, args.image, names), args.concurrency)
+    print_servers_info(servers)
+    for name in sorted(failed):
+      print "Server %s failed: %s" % (name, failed[name])
+    sys.exit(5 if failed else 0)
+
   servers = build_some_servers(cs, args.flavor, args.image, args.basename,
-                            args.numservers)
+                            args.numservers, concurrency=args.concurrency)
   wait_for_server_networks(servers)
   print_servers_info(servers)
 
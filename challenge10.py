@@ -37,6 +37,9 @@
 #   --lbname LBNAME           Name of Loadbalancer to create
 #   --container CONTAINER     Cloudfiles container to copy error page file to
 #   --region REGION           Region in which to create devices (DFW or ORD)
+#   --concurrency CONCURRENCY Number of server build requests to send at once
+#   --coroutines              Drive the builds as coroutines from one thread
+#                             (see provision)
 
 
 import sys
@@ -44,6 +47,11 @@ import os
 import time
 import argparse
 import pyrax
+import session
+import waiter
+import swiftapi
+import taskgraph
+import provision
 import challenge1 as c1
 import challenge4 as c4
 import challenge7 as c7
@@ -73,13 +81,106 @@ def wait_for_lb_build(lb):
       user know that we are not stuck.
   """
   print "\nWaiting for loadbalancer to become active..."
-  lb.get()
-  while lb.status != 'ACTIVE':
-    time.sleep(2)
+
+  def progress():
     print '.', 
-    lb.get()
-  print "Done!"
 
+  status = waiter.wait_for_status(lb, progress=progress, maximum=10)
+  if status == 'ACTIVE':
+    print "Done!"
+  else:
+    print "Loadbalancer went to status %s!" % status
+  return status
+
+
+def site_tasks(clb, dns, cf, servers, LBName, FQDN, errorPageFile,
+               container):
+  """Return the steps that turn freshly built servers into a website, as a
+  taskgraph: tuple (dict of step name -> callable, dict of step name ->
+  steps it has to wait for).
+
+  The loadbalancer is created as soon as the first server has an IP
+  address (vip), and the rest are added as they get theirs (nodes).  The
+  DNS record only needs the VIP.  The health monitor and error page are
+  loadbalancer changes, queued one after another through c7.change_lb.
+  The Cloud Files backup of the error page depends on none of that and
+  starts straight away.
+  """
+  serversUp = c1.iter_servers_with_networks(servers)
+  built = {}
+
+  def vip():
+    for srv in serversUp:
+      built['lb'] = c7.new_lb(clb, LBName, [c7.server_node(clb, srv)])
+      print "\nLoadbalancer %s is building with VIP %s" % (LBName,
+              built['lb'].virtual_ips[0].address)
+      return built['lb']
+    raise RuntimeError("none of the servers came up")
+
+  def nodes():
+    c7.add_servers_as_they_come_up(clb, built['lb'], serversUp)
+    print "All servers added to Loadbalancer %s" % LBName
+
+  def dns_record():
+    addr = built['lb'].virtual_ips[0].address
+    domain = c4.add_dns_record(dns, FQDN, addr, 'A')
+    print "DNS record %s A %s added to zone %s" % (FQDN, addr, domain.name)
+
+  def monitor():
+    c7.change_lb(built['lb'], built['lb'].add_health_monitor, type="CONNECT",
+                 delay=5, timeout=2, attemptsBeforeDeactivation=1)
+    print "Loadbalancer monitor added"
+
+  def error_page():
+    errorPage = open(errorPageFile, 'r').read()
+    c7.change_lb(built['lb'], built['lb'].set_error_page, errorPage)
+    print "Loadbalancer error page set"
+
+  def backup_container():
+    built['container'] = cf.create_container(container)
+
+  def backup_error_page():
+    # stream the backup from disk rather than sending the copy we read for
+    # the LB, so a big page is never held in memory twice
+    storageURL, token = swiftapi.storage_endpoint(cf)
+    swiftapi.put_file(storageURL, token, built['container'].name,
+                      os.path.basename(errorPageFile), errorPageFile)
+    print "Loadbalancer error page stored in CloudFiles container %s" % \
+          built['container'].name
+
+  tasks = {'vip': vip, 'nodes': nodes, 'dns': dns_record,
+           'monitor': monitor, 'errorpage': error_page,
+           'container': backup_container, 'backup': backup_error_page}
+  deps = {'nodes': ['vip'], 'dns': ['vip'], 'monitor': ['nodes'],
+          'errorpage': ['nodes'], 'backup': ['container']}
+  return (tasks, deps)
+
+def build_website(p, cs, clb, dns, cf, flavor, image, names, serverFiles,
+                  LBName, FQDN, errorPageFile, container):
+  """Coroutine: everything site_tasks does, driven by a Provisioner (see
+  provision) rather than a thread per step.  The servers, the loadbalancer
+  with its monitor and error page, and the DNS record come from
+  provision.build_site; the Cloud Files backup of the error page goes up
+  alongside all of that.
+
+  Returns tuple (servers, lb, failed) - failed is a dict of server name,
+  'loadbalancer', 'dns' or 'backup' -> exception.  Whatever was built is
+  returned even if something else failed.
+  """
+  errorPage = open(errorPageFile, 'r').read()
+  site = provision.spawn(provision.build_site(p, cs, flavor, image, names,
+                                              serverFiles, clb=clb,
+                                              LBName=LBName, monitor=True,
+                                              errorPage=errorPage, dns=dns,
+                                              FQDN=FQDN))
+  backup = provision.spawn(provision.store_file(p, cf, container,
+                                                errorPageFile))
+  servers, volumes, lb, failed = yield site
+  try:
+    yield backup
+  except Exception as err:
+    failed['backup'] = err
+  raise provision.Return((servers, lb, failed))
 
 if __name__ == "__main__":
   print "\nChallenge10 - Write an application that will:"
@@ -107,21 +208,25 @@ if __name__ == "__main__":
                       help="Cloudfiles container to copy error page file to")
   parser.add_argument("--region", default='DFW',
                       help="Region in which to create devices (DFW or ORD)")
+  parser.add_argument("--concurrency", default=4, type=int,
+                      help="Number of server build requests to send at once")
+  parser.add_argument("--coroutines", action="store_true",
+                      help="Drive the builds as coroutines from one thread "
+                           "(see provision)")
   args = parser.parse_args()
 
-  credential_file=os.path.expanduser("~/.rackspace_cloud_credentials")
-  pyrax.set_credential_file(credential_file)
-  if (c1.is_valid_region(args.region, 'compute') and
-      c1.is_valid_region(args.region, 'object_store') and
-      c1.is_valid_region(args.region, 'load_balancer')):
-    cs = pyrax.connect_to_cloudservers(region=args.region)
-    dns = pyrax.connect_to_cloud_dns(region=args.region)
-    clb = pyrax.connect_to_cloud_loadbalancers(region=args.region)
-    cf = pyrax.connect_to_cloudfiles(region=args.region)
-  else:
+  if c1.missing_services(args.region, ['compute', 'object_store',
+                                       'load_balancer']):
     print "The region you requested is not valid: %s" % args.region
     sys.exit(2)
 
+  credential_file=os.path.expanduser("~/.rackspace_cloud_credentials")
+  session.set_credential_file(credential_file)
+  cs = pyrax.connect_to_cloudservers(region=args.region)
+  dns = pyrax.connect_to_cloud_dns(region=args.region)
+  clb = pyrax.connect_to_cloud_loadbalancers(region=args.region)
+  cf = pyrax.connect_to_cloudfiles(region=args.region)
+
   # unbuffer stdout for pretty output
   sys.stdout = os.fdopen(sys.stdout.fileno(), 'w', 0)
 
@@ -143,41 +248,72 @@ if __name__ == "__main__":
     print "This does not appear to be a valid flavor-id: %s" % args.flavor
     sys.exit(6)
 
+  if not args.lbname:
+    LBName = '%s-LB' % args.FQDN
+  else:
+    LBName = args.lbname
+  if not args.container:
+    args.container = pyrax.utils.random_name(12, ascii_only=True)
+
   # Create Servers
   sshkey = open(sshkeyFile, 'r').read()
   authkeyFile = '/root/.ssh/authorized_keys'
   serverFiles = {authkeyFile: sshkey}
+  started = time.time()
+
+  if args.coroutines:
+    names = c1.server_names(args.FQDN, args.numservers)
+    servers, lb, failed = provision.run(lambda p: build_website(p, cs, clb,
+            dns, cf, args.flavor, args.image, names, serverFiles, LBName,
+            args.FQDN, errorPageFile, args.container), args.concurrency)
+    c1.print_servers_info(servers)
+    if lb is not None:
+      lb.get()
+      c7.print_lb_info(lb)
+    for name in sorted(failed):
+      print "%s failed: %s" % (name, failed[name])
+    print "Finished in %d seconds" % (time.time() - started)
+    sys.exit(8 if failed else 0)
+
   servers = c1.build_some_servers(cs, args.flavor, args.image, args.FQDN,
-                                  args.numservers, serverFiles)
-  c1.wait_for_server_networks(servers)
-  c1.print_servers_info(servers)
+                                  args.numservers, serverFiles,
+                                  concurrency=args.concurrency)
 
-  # Create Loadbalancer
-  if not args.lbname:
-    LBName = '%s-LB' % args.FQDN
-  else:
-    LBName = args.lbname
-  print "Creating Loadbalancer %s" % LBName
-  lb = c7.create_lb_and_add_servers(clb, LBName, servers)
-  wait_for_lb_build(lb)
+  tasks, deps = site_tasks(clb, dns, cf, servers, LBName, args.FQDN,
+                           errorPageFile, args.container)
+  durations = {}
 
-  # create DNS entries for the LB
-  c4.create_dns_record(dns, args.FQDN, lb.virtual_ips[0].address, 'A')
+  def timed(name, task):
+    def run():
+      taskStarted = time.time()
+      try:
+        return task()
+      finally:
+        durations[name] = time.time() - taskStarted
+    return run
 
-  print "Adding Loadbalancer monitor"
-  lb.add_health_monitor(type="CONNECT", delay=5, timeout=2,
-          attemptsBeforeDeactivation=1)
-  wait_for_lb_build(lb)
+  print "\nCreating Loadbalancer %s as the servers get IP addresses" % LBName
+  graphStarted = time.time()
+  results = taskgraph.run_tasks(dict((name, timed(name, task))
+                                     for name, task in tasks.items()),
+                                deps, len(tasks))
+  graphTime = time.time() - graphStarted
 
-  # add LB error page
-  errorPage = open(errorPageFile, 'r').read()
-  lb.set_error_page(errorPage)
+  failed = False
+  for name in taskgraph.topological_order(tasks, deps):
+    state, value = results[name]
+    if state == 'failed':
+      print "Step %s failed: %s" % (name, value)
+      failed = True
+    elif state == 'skipped':
+      print "Step %s skipped because %s failed" % (name, value)
+  if results['nodes'][0] == 'done':
+    c1.print_servers_info(servers)
 
-  # Upload error page to cloudfiles (container?)
-  if not args.container:
-    args.container = pyrax.utils.random_name(12, ascii_only=True)
-  cont = cf.create_container(args.container)
-  cf.store_object(cont, os.path.basename(errorPageFile), errorPage)
-  print "Loadbalancer error page stored in CloudFiles container %s" % cont.name
+  print "Finished in %d seconds (%d seconds saved by running steps at the" \
+        " same time)" % (time.time() - started,
+                        max(0, sum(durations.values()) - graphTime))
+  if failed:
+    sys.exit(8)
 
 # vim: ts=2 sw=2 tw=78 expandtab
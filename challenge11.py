@@ -42,17 +42,27 @@
 #   --sslkeyfile              file containing ssl private key
 #   --lbname LBNAME           Name of Loadbalancer to create
 #   --region REGION           Region in which to create devices (DFW or ORD)
+#   --concurrency CONCURRENCY Number of server build (and volume) requests to
+#                             send at once
+#   --coroutines              Drive the builds as coroutines from one thread
+#                             (see provision)
 
 
 import sys
 import os
+import Queue
 import argparse
+import threading
 import pyrax
+import session
+import waiter
+import provision
 import challenge1 as c1
 import challenge4 as c4
 import challenge7 as c7
 import challenge9 as c9
 import challenge10 as c10
+from multiprocessing.pool import ThreadPool
 
 try:
   from OpenSSL import crypto, SSL
@@ -89,6 +99,132 @@ def create_self_signed_cert(cn):
   ssKey = crypto.dump_privatekey(crypto.FILETYPE_PEM, pkey)
   return (ssCert, ssKey)
 
+def create_volume(cbs, name, size):
+  """Create a CBS volume and wait for it to become available.  Raises
+  RuntimeError if it goes to error instead.
+  """
+  vol = cbs.create(name=name, size=size, volume_type="SATA")
+  status = waiter.wait_for_status(vol, ready=('available',),
+                                  terminal=('error',), initial=2, maximum=10,
+                                  deadline=900)
+  if status != 'available':
+    raise RuntimeError("volume went to status %s" % status)
+  return vol
+
+def attach_volume(vol, srv):
+  """Attach a CBS volume to a server as /dev/xvdd and wait until it is in
+  use.
+  """
+  vol.attach_to_instance(srv, mountpoint='/dev/xvdd')
+  status = waiter.wait_for_status(vol, ready=('in-use',), terminal=('error',),
+                                  initial=2, maximum=10, deadline=900)
+  if status != 'in-use':
+    raise RuntimeError("volume went to status %s" % status)
+
+def build_servers_with_volumes(cbs, servers, size, concurrency=4):
+  """Give each server being built a CBS volume of size GB.
+
+  Volumes don't need their server, so they are all created straight away
+  while the servers are still building, and each is attached as soon as
+  both it and its own server are ready.  The creates and attaches run in a
+  pool of concurrency threads.  Waits for the server builds (see
+  c1.wait_for_server_builds) as part of the deal.
+
+  Returns tuple (dict of server name -> attached volume, dict of server
+  name -> why it has no volume).  One server failing does not stop the
+  others.
+  """
+  lock = threading.Lock()
+  builds = {}
+  volumes = {}
+  outcomes = Queue.Queue()
+  pool = ThreadPool(concurrency)
+
+  def attach(srv, vol):
+    try:
+      attach_volume(vol, srv)
+      print "\nVolume %s attached to server %s" % (vol.name, srv.name)
+      outcomes.put((srv, vol, None))
+    except Exception as err:
+      outcomes.put((srv, vol, "attaching volume %s failed: %s" % (vol.name,
+                                                                  err)))
+
+  def settle(srv):
+    # called (with lock held) as the server build and its volume each
+    # finish; once both have, attach or give up
+    if srv.id not in builds or srv.id not in volumes:
+      return
+    buildErr, (vol, volErr) = builds[srv.id], volumes[srv.id]
+    if buildErr or volErr:
+      outcomes.put((srv, vol, buildErr or volErr))
+    else:
+      pool.apply_async(attach, (srv, vol))
+
+  def create(srv):
+    name = "%s-vol" % srv.name
+    try:
+      vol = create_volume(cbs, name, size)
+      result = (vol, None)
+    except Exception as err:
+      result = (None, "creating volume %s failed: %s" % (name, err))
+    with lock:
+      volumes[srv.id] = result
+      settle(srv)
+
+  def built(srv):
+    with lock:
+      builds[srv.id] = (None if srv.status == 'ACTIVE' else
+                        "server went to status %s" % srv.status)
+      settle(srv)
+
+  print "Creating %d Block Storage Volumes of size %d" % (len(servers), size)
+  try:
+    for srv in servers:
+      pool.apply_async(create, (srv,))
+    c1.wait_for_server_builds(servers, on_done=built)
+
+    attached = {}
+    failed = {}
+    for i in xrange(len(servers)):
+      # wait (with timeout, so ctrl-c is still noticed) for the next server
+      # to be settled
+      while True:
+        try:
+          srv, vol, err = outcomes.get(True, 1)
+          break
+        except Queue.Empty:
+          pass
+      if err is None:
+        attached[srv.name] = vol
+      else:
+        failed[srv.name] = err
+  finally:
+    pool.close()
+    pool.join()
+  return (attached, failed)
+
+def build_stack(p, cs, cn, cbs, clb, dns, flavor, image, names, networkName,
+                cidr, volumeSize, LBName, cert, key, FQDN):
+  """Coroutine: everything the script builds, driven by a Provisioner (see
+  provision): the Cloud Network first, then the servers on it, each with a
+  CBS volume, behind an SSL terminated loadbalancer with a DNS record (see
+  provision.build_site).
+
+  Returns tuple (servers, volumes, lb, failed) - failed is a dict of server
+  or volume name -> exception.
+  """
+  network, nets = yield provision.spawn(provision.build_network(p, cn,
+                                                                networkName,
+                                                                cidr))
+  result = yield provision.spawn(provision.build_site(p, cs, flavor, image,
+                                                      names, nets=nets,
+                                                      cbs=cbs,
+                                                      volumeSize=volumeSize,
+                                                      clb=clb, LBName=LBName,
+                                                      cert=cert, key=key,
+                                                      dns=dns, FQDN=FQDN))
+  raise provision.Return(result)
+
 if __name__ == "__main__": 
   print "\nChallenge 11 - Write an application that will:"
   print " - Create an SSL terminated load balancer (Create self-signed",
@@ -126,22 +262,27 @@ if __name__ == "__main__":
                       help="Name of Loadbalancer to create")
   parser.add_argument("--region", default='DFW',
                       help="Region in which to create devices (DFW or ORD)")
+  parser.add_argument("--concurrency", default=4, type=int,
+                      help="Number of server build (and volume) requests to "
+                           "send at once")
+  parser.add_argument("--coroutines", action="store_true",
+                      help="Drive the builds as coroutines from one thread "
+                           "(see provision)")
   args = parser.parse_args()
 
-  credential_file=os.path.expanduser("~/.rackspace_cloud_credentials")
-  pyrax.set_credential_file(credential_file)
-  if (c1.is_valid_region(args.region, 'compute') and
-      c1.is_valid_region(args.region, 'load_balancer') and
-      c1.is_valid_region(args.region, 'volume')):
-    cs = pyrax.connect_to_cloudservers(region=args.region)
-    dns = pyrax.connect_to_cloud_dns(region=args.region)
-    clb = pyrax.connect_to_cloud_loadbalancers(region=args.region)
-    cn = pyrax.connect_to_cloud_networks(region=args.region)
-    cbs = pyrax.connect_to_cloud_blockstorage(region=args.region)
-  else:
+  if c1.missing_services(args.region, ['compute', 'load_balancer',
+                                       'volume']):
     print "The region you requested is not valid: %s" % args.region
     sys.exit(2)
 
+  credential_file=os.path.expanduser("~/.rackspace_cloud_credentials")
+  session.set_credential_file(credential_file)
+  cs = pyrax.connect_to_cloudservers(region=args.region)
+  dns = pyrax.connect_to_cloud_dns(region=args.region)
+  clb = pyrax.connect_to_cloud_loadbalancers(region=args.region)
+  cn = pyrax.connect_to_cloud_networks(region=args.region)
+  cbs = pyrax.connect_to_cloud_blockstorage(region=args.region)
+
   if not args.sslcertfile or not args.sslkeyfile:
     print "You didn't supply an SSL certificate and key.",
     print "No worries! We'll create one for you...\n"
@@ -171,9 +312,31 @@ if __name__ == "__main__":
   # unbuffer stdout for pretty output
   sys.stdout = os.fdopen(sys.stdout.fileno(), 'w', 0)
 
-  #Create new Cloud Network
   if not args.networkname: 
     args.networkname = '%s-net' % args.FQDN
+  if not args.lbname:
+    LBName = '%s-LB' % args.FQDN
+  else:
+    LBName = args.lbname
+
+  if args.coroutines:
+    names = c1.server_names(args.FQDN, args.numservers)
+    servers, volumes, lb, failed = provision.run(lambda p: build_stack(p, cs,
+            cn, cbs, clb, dns, args.flavor, args.image, names,
+            args.networkname, args.networknet, args.volumesize, LBName, cert,
+            key, args.FQDN), args.concurrency)
+    c1.print_servers_info(servers)
+    for vol in volumes:
+      print "Volume %s attached" % vol.name
+    for name in sorted(failed):
+      print "%s failed: %s" % (name, failed[name])
+    if lb is not None:
+      lb.get()
+      c7.print_lb_info(lb)
+    print "\nDone!\n"
+    sys.exit(7 if failed else 0)
+
+  #Create new Cloud Network
   print "Creating new CloudNetwork named %s using %s" % (args.networkname,
                                                          args.networknet)
   network = cn.create(args.networkname, cidr=args.networknet)
@@ -181,24 +344,17 @@ if __name__ == "__main__":
 
   #Create servers and attach to network
   servers = c1.build_some_servers(cs, args.flavor, args.image, args.FQDN,
-                                  args.numservers, {}, allnets)
-  c1.wait_for_server_builds(servers)
-  c1.print_servers_info(servers)
+                                  args.numservers, {}, allnets,
+                                  concurrency=args.concurrency)
 
-  #Create CBS volumes and attach to servers
-  for srv in servers:
-    volname = "%s-vol" % srv.name
-    print "Creating Block Storage Volume %s of size %d" % (volname, 
-                                                           args.volumesize)
-    vol = cbs.create(name=volname, size=args.volumesize, volume_type="SATA")
-    print "Attaching volume %s to server %s" % (volname, srv.name)
-    vol.attach_to_instance(srv, mountpoint='/dev/xvdd')
+  #Create CBS volumes while the servers build, and attach each to its server
+  attached, failed = build_servers_with_volumes(cbs, servers, args.volumesize,
+                                                args.concurrency)
+  c1.print_servers_info(servers)
+  for name in sorted(failed):
+    print "Server %s has no volume: %s" % (name, failed[name])
 
   #Create LB, with server nodes 
-  if not args.lbname:
-    LBName = '%s-LB' % args.FQDN
-  else:
-    LBName = args.lbname
   print "Creating Loadbalancer %s" % LBName
   lb = c7.create_lb_and_add_servers(clb, LBName, servers)
   c10.wait_for_lb_build(lb)
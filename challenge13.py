@@ -33,72 +33,438 @@
 #                             single region)
 #   --dryrun                  Do not actually delete anything, just print what
 #                             would be deleted.
+#   --concurrency CONCURRENCY Number of regions to clean up at once, each in
+#                             its own worker process
+#   --taskconcurrency N       Number of deletes to run at once within each
+#                             region
 
 
 import sys
 import os
+import re
 import time
+import urllib
 import argparse
+import multiprocessing
 import pyrax
+import session
+from multiprocessing.pool import ThreadPool
+import waiter
+import swiftapi
+import taskgraph
 import challenge1 as c1
 
+def  new_tally():
+  """Return a fresh count of deleted, failed and skipped resources"""
+  return {'deleted': 0, 'failed': 0, 'skipped': 0}
+
+def  delete_and_count(tally, what, delete):
+  """Call delete() (unless this is a dry run) and keep count in tally.  A
+  failed delete is reported and counted, but does not stop the clean up.
+
+  Returns True if something was actually deleted.
+  """
+  if dryrun:
+    tally['skipped'] += 1
+    return False
+  try:
+    delete()
+    tally['deleted'] += 1
+    return True
+  except Exception as err:
+    print "%s: Delete failed: %s" % (what, err)
+    tally['failed'] += 1
+    return False
+
+def  iter_pages(fetch, nextCursor, pageSize=100, prefetch=True):
+  """Lazily yield the items of a paged listing.  fetch(cursor, limit)
+  returns one page (cursor is None for the first one) and nextCursor(page,
+  cursor) works out the cursor for the page after it.  Listing stops at the
+  first page that is not exactly pageSize long.
+
+  With prefetch, the next page is requested in the background as soon as a
+  page arrives, so the caller can get on with (ie: deleting) one page while
+  the next is on its way.  The last item of each page is the marker for the
+  next request, so it is held back until that request has been answered.
+
+  Without prefetch, nextCursor is only called once the caller is done with
+  the current page - so an offset can allow for anything deleted from it.
+  """
+  pool = ThreadPool(1) if prefetch else None
+  try:
+    cursor = None
+    page = fetch(cursor, pageSize)
+    held = []
+    while True:
+      if len(page) != pageSize:
+        for item in held + list(page):
+          yield item
+        return
+      if prefetch:
+        nextCur = nextCursor(page, cursor)
+        if nextCur == cursor:
+          # the API ignored the marker and handed back the same page
+          for item in held:
+            yield item
+          return
+        pending = pool.apply_async(fetch, (nextCur, pageSize))
+        for item in held + list(page[:-1]):
+          yield item
+        held = list(page[-1:])
+        page = pending.get()
+      else:
+        for item in page:
+          yield item
+        nextCur = nextCursor(page, cursor)
+        page = fetch(nextCur, pageSize)
+      cursor = nextCur
+  finally:
+    if pool is not None:
+      pool.terminate()
+
+def  next_marker(page, marker):
+  """nextCursor for iter_pages when the API pages by marker (id of the last
+  item seen).
+  """
+  return page[-1].id
+
 def  clean_up_generic(cloud, prefix, type):
   """Generic Cloud Delete.  It will attempt to delete whatever cloud device
   type it is given, if the name of the device matches the specified prefix.
+
+  Returns tally of deleted, failed and skipped devices.
   """
-  for obj in cloud.list():
+  tally = new_tally()
+  for obj in iter_pages(lambda marker, limit: cloud.list(limit=limit,
+                                                         marker=marker),
+                        next_marker):
     if obj.name.startswith(prefix):
       if type != 'CloudNetworks' or obj.is_isolated:
        print "%s: Deleting %s" % (type, obj.name)
-       if not dryrun: obj.delete()
+       delete_and_count(tally, "%s %s" % (type, obj.name), obj.delete)
+      else:
+       tally['skipped'] += 1
+  return tally
 
-def  clean_up_files(cf, prefix):
+def  clean_up_files(cf, prefix, concurrency=4):
   """Delete all Cloudfiles containers (and contents) where the container
-  name starts with specified prefix
+  name starts with specified prefix.  Objects are removed with the
+  bulk-delete API, up to 10,000 per request, and up to concurrency
+  containers are emptied at once.
+
+  Returns tally of deleted, failed and skipped containers.
   """
-  for contName in cf.list_containers():
-    if contName.startswith(prefix):
-      print "CloudFiles: deleting container %s" % contName
-      cont = cf.get_container(contName)
-      if not dryrun:
-        cont.delete_all_objects()
-        cont.delete()
+  tally = new_tally()
+  storageURL, token = swiftapi.storage_endpoint(cf)
+  # the prefix is handled by the API, and deletes start as soon as the first
+  # container shows up in the listing
+  containers = (c['name'] for c in
+                swiftapi.iter_containers(storageURL, token, prefix))
+
+  def progress(contName, deleted, rate):
+    print "CloudFiles: %s - %d objects deleted (%.0f objects/sec)" % (
+            contName, deleted, rate)
+
+  def delete(contName):
+    print "CloudFiles: deleting container %s" % contName
+    if dryrun:
+      return ('skipped', 0)
+    try:
+      deleted, errors = swiftapi.delete_container_objects(storageURL, token,
+                                                          contName, progress)
+      if errors:
+        raise Exception("%d objects could not be deleted, first was %s" %
+                        (len(errors), errors[0]))
+      swiftapi.delete_container(storageURL, token, contName)
+      return ('deleted', deleted)
+    except Exception as err:
+      print "CloudFiles %s: Delete failed: %s" % (contName, err)
+      return ('failed', 0)
+
+  started = time.time()
+  objects = 0
+  pool = ThreadPool(max(1, concurrency))
+  try:
+    for outcome, deleted in pool.imap_unordered(delete, containers):
+      tally[outcome] += 1
+      objects += deleted
+  finally:
+    pool.close()
+    pool.join()
+  if objects:
+    print "CloudFiles: %d objects deleted in all (%.0f objects/sec)" % (
+            objects, objects / max(time.time() - started, 0.001))
+  return tally
 
 def  clean_up_dns(dns, prefix):
-  """Delete all DNS records and zones that start with specified prefix"""
-  for zone in dns.list():
+  """Delete all DNS records and zones that start with specified prefix
+
+  Returns tally of deleted, failed and skipped zones and records.
+  """
+  tally = new_tally()
+  # DNS pages by offset, so each following page starts after the zones (or
+  # records) we are keeping - the ones we deleted are no longer counted.
+  keptZones = [0]
+  zones = iter_pages(lambda offset, limit: dns.list(limit=limit,
+                                                    offset=offset),
+                     lambda page, offset: keptZones[0], prefetch=False)
+  for zone in zones:
     if zone.name.startswith(prefix):
       print "DNS: Deleting entire zone %s" % zone.name
-      if not dryrun: dns.delete(zone.id)
-    else:
-      for rcd in dns.list_records(zone.id):
-        if rcd.name.startswith(prefix):
-          print "DNS: Deleting %s %s %s" % (rcd.name, rcd.type, rcd.data)
-          if not dryrun: dns.delete_record(zone.id, rcd.id)
+      if not delete_and_count(tally, "DNS %s" % zone.name,
+                              lambda: dns.delete(zone.id)):
+        keptZones[0] += 1
+      continue
+    keptZones[0] += 1
+    keptRecords = [0]
+    records = iter_pages(lambda offset, limit: dns.list_records(zone,
+                                                    limit=limit,
+                                                    offset=offset),
+                         lambda page, offset: keptRecords[0], prefetch=False)
+    for rcd in records:
+      if rcd.name.startswith(prefix):
+        print "DNS: Deleting %s %s %s" % (rcd.name, rcd.type, rcd.data)
+        if delete_and_count(tally, "DNS %s" % rcd.name,
+                            lambda: dns.delete_record(zone.id, rcd.id)):
+          continue
+      keptRecords[0] += 1
+  return tally
+
+def  list_images(cs, marker, limit):
+  """Return one page of detailed cloudserver images.  images.list() only
+  knows about limit, so build the paged query ourselves.
+  """
+  query = {'limit': limit}
+  if marker:
+    query['marker'] = marker
+  return cs.images._list("/images/detail?%s" % urllib.urlencode(query),
+                         "images")
 
 def  clean_up_images(cs, prefix):
-  """Delete all cloudserver images whose names start with specified prefix"""
-  for img in cs.images.list():
+  """Delete all cloudserver images whose names start with specified prefix
+
+  Returns tally of deleted, failed and skipped images.
+  """
+  tally = new_tally()
+  for img in iter_pages(lambda marker, limit: list_images(cs, marker, limit),
+                        next_marker):
     if img.name.startswith(prefix) and img.metadata['image_type'] != 'base':
-      try:
-        if not dryrun: img.delete()
-        print "Images: Deleting %s" % img.name
-      except:
-        print "Images: Attempt to delete %s failed"  % img.name
-
-def  clean_up_blockstorage(cloud, prefix):
-  """Delete all block storage devices whose names start with specified prefix
+      print "Images: Deleting %s" % img.name
+      delete_and_count(tally, "Images %s" % img.name, img.delete)
+  return tally
+
+def  is_gone(obj):
+  """Refresh obj and return True once the API no longer knows about it (or
+  reports it as DELETED).
   """
-  for obj in cloud.list():
-    if obj.name.startswith(prefix):
-      print "Block Storage: Deleting %s" % (obj.name)
-      if not dryrun: 
-        # sometimes, if we just deleted a server using this storage, it takes a
-        # bit of time before the storage is freed up.  So, we'll wait until the
-        # stoage is in a "deleteable status".
-        pyrax.utils.wait_until(obj, "status", ['available', 'error'],
-                               interval=2, attempts=120)
-        obj.delete()
+  try:
+    obj.get()
+  except Exception as err:
+    if getattr(err, 'code', getattr(err, 'http_status', None)) == 404:
+      return True
+    raise
+  return getattr(obj, 'status', None) == 'DELETED'
+
+def  delete_server(srv):
+  """Delete a cloud server and wait until it is really gone, so anything
+  that was attached to it (volumes, networks) is free to be deleted.
+  """
+  print "CloudServer: Deleting %s" % srv.name
+  if not dryrun:
+    srv.delete()
+    waiter.wait_until(lambda: is_gone(srv), deadline=900, maximum=10)
+
+def  delete_volume(obj):
+  """Delete a block storage volume, once it is in a deleteable state."""
+  print "Block Storage: Deleting %s" % (obj.name)
+  if not dryrun: 
+    # sometimes, if we just deleted a server using this storage, it takes a
+    # bit of time before the storage is freed up.  So, we'll wait until the
+    # stoage is in a "deleteable status".
+    try:
+      waiter.wait_for_status(obj, ready=['available'], terminal=['error'],
+                             deadline=240, maximum=10)
+    except waiter.WaitTimeout:
+      print "Block Storage: %s is still busy, trying anyway" % obj.name
+    obj.delete()
+
+def  delete_simple(obj, type):
+  """Return a function that deletes obj (a loadbalancer or network)"""
+  def delete():
+    print "%s: Deleting %s" % (type, obj.name)
+    if not dryrun:
+      obj.delete()
+  return delete
+
+def  server_ips(srv):
+  """Return set of all IP addresses assigned to a cloud server"""
+  return set(ip for ips in srv.networks.values() for ip in ips)
+
+def  plan_region(region, args):
+  """Work out what has to be deleted from a single region and what each
+  delete has to wait for:
+    - a server waits for the loadbalancers that use it as a node
+    - a volume waits for the server it is attached to
+    - a network waits for the servers attached to it
+  Files, DNS, images and databases don't depend on anything, and are each
+  cleaned up by a single task.
+
+  Returns tuple (tasks, deps, labels, summary) - tasks and deps are ready
+  for taskgraph.run_tasks, labels is a dict of task -> (service, name) and
+  summary has the tallies for anything that was skipped while planning.
+  """
+  tasks = {}
+  deps = {}
+  labels = {}
+  summary = {}
+
+  def add(key, service, label, func, after=()):
+    tasks[key] = func
+    deps[key] = list(after)
+    labels[key] = (service, label)
+
+  servers = []
+  if not args.skipservers or not args.skipimages:
+    cs = pyrax.connect_to_cloudservers(region=region)
+  # Servers
+  if not args.skipservers:
+    # the API filters server names with a regular expression
+    search = {}
+    if args.prefix:
+      search['name'] = '^%s' % re.escape(args.prefix)
+    fetch = lambda marker, limit: cs.servers.list(
+              search_opts=dict(search, marker=marker, limit=limit))
+    servers = [srv for srv in iter_pages(fetch, next_marker)
+               if srv.name.startswith(args.prefix)]
+    for srv in servers:
+      add('server:%s' % srv.id, 'Servers', 'CloudServer %s' % srv.name,
+          lambda srv=srv: delete_server(srv))
+  # Loadbalancers
+  if not args.skiploadbalancers:
+    clb = pyrax.connect_to_cloud_loadbalancers(region=region)
+    for lb in clb.list():
+      if not lb.name.startswith(args.prefix):
+        continue
+      key = 'lb:%s' % lb.id
+      add(key, 'Loadbalancers', 'CloudLoadbalancer %s' % lb.name,
+          delete_simple(lb, 'CloudLoadbalancer'))
+      if servers:
+        # the listing does not include the nodes
+        lb.get()
+        nodes = set(n.address for n in getattr(lb, 'nodes', []))
+        for srv in servers:
+          if server_ips(srv) & nodes:
+            deps['server:%s' % srv.id].append(key)
+  # Block Storage
+  if not args.skipblockstorage:
+    cbs = pyrax.connect_to_cloud_blockstorage(region=region)
+    for vol in cbs.list():
+      if vol.name.startswith(args.prefix):
+        attached = ['server:%s' % a['server_id']
+                    for a in getattr(vol, 'attachments', [])]
+        add('volume:%s' % vol.id, 'Block Storage', 'Volume %s' % vol.name,
+            lambda vol=vol: delete_volume(vol), attached)
+  # Networks
+  if not args.skipnetworks: 
+    cn = pyrax.connect_to_cloud_networks(region=region)
+    summary['Networks'] = new_tally()
+    for net in cn.list():
+      if not net.name.startswith(args.prefix):
+        continue
+      if not net.is_isolated:
+        summary['Networks']['skipped'] += 1
+        continue
+      attached = ['server:%s' % srv.id for srv in servers
+                  if net.label in srv.networks]
+      add('network:%s' % net.id, 'Networks', 'CloudNetwork %s' % net.name,
+          delete_simple(net, 'CloudNetworks'), attached)
+  # Files
+  if not args.skipfiles:
+    cf = pyrax.connect_to_cloudfiles(region=region)
+    add('files', 'Files', 'CloudFiles containers',
+        lambda: clean_up_files(cf, args.prefix, args.taskconcurrency))
+  # DNS
+  if not args.skipdns:
+    dns = pyrax.connect_to_cloud_dns(region=region)
+    add('dns', 'DNS', 'DNS zones and records',
+        lambda: clean_up_dns(dns, args.prefix))
+  # Images
+  if not args.skipimages:
+    add('images', 'Images', 'Images', lambda: clean_up_images(cs, args.prefix))
+  # Databases
+  if not args.skipdatabases:
+    cdb = pyrax.connect_to_cloud_databases(region=region)
+    add('databases', 'Databases', 'CloudDatabases',
+        lambda: clean_up_generic(cdb, args.prefix, 'CloudDatabase'))
+
+  return (tasks, deps, labels, summary)
+
+def  clean_up_region(region, args):
+  """Delete everything matching args.prefix from a single region, honoring
+  the --skip* options.  Deletes run as soon as whatever they depend on is
+  gone (see plan_region), up to args.taskconcurrency at once.  On a dry run
+  the plan is printed as a graph first.
+
+  Returns dict of service name -> tally of deleted, failed and skipped.
+  """
+  print "\nLooking for Cloud objects in %s..." % region
+  tasks, deps, labels, summary = plan_region(region, args)
+
+  describe = lambda key: labels[key][1]
+  if dryrun:
+    print "\nDeletion plan for %s:" % region
+    taskgraph.print_plan(tasks, deps, describe)
+    print
+
+  results = taskgraph.run_tasks(tasks, deps, args.taskconcurrency)
+  for key in sorted(results):
+    state, value = results[key]
+    tally = summary.setdefault(labels[key][0], new_tally())
+    if state == 'done' and isinstance(value, dict):
+      # a whole-service task hands back its own tally
+      for count in tally:
+        tally[count] += value[count]
+    elif state == 'done':
+      tally['skipped' if dryrun else 'deleted'] += 1
+    elif state == 'failed':
+      print "%s: Delete failed: %s" % (describe(key), value)
+      tally['failed'] += 1
+    else:
+      print "%s: Not deleted, because %s could not be deleted" % (
+              describe(key), describe(value))
+      tally['skipped'] += 1
+  return summary
+
+def  clean_up_region_worker(work):
+  """multiprocessing.Pool entry point: work is tuple (region, args).
+  Returns tuple (region, summary).  Any error that escapes the clean up is
+  reported as a single failure for the region rather than taking down the
+  other regions.
+  """
+  region, args = work
+  try:
+    return (region, clean_up_region(region, args))
+  except Exception as err:
+    print "%s: Clean up failed: %s" % (region, err)
+    return (region, {'(region)': {'deleted': 0, 'failed': 1, 'skipped': 0}})
+
+def  print_summary(results):
+  """Given a list of (region, summary) tuples, print one combined table of
+  deleted, failed and skipped counts per service and region.
+  """
+  print "\nSummary%s:" % (" (dry run)" if dryrun else "")
+  print "%-7s %-15s %8s %8s %8s" % ('Region', 'Service', 'Deleted', 'Failed',
+                                     'Skipped')
+  totals = new_tally()
+  for region, summary in results:
+    for service in sorted(summary):
+      tally = summary[service]
+      print "%-7s %-15s %8d %8d %8d" % (region, service, tally['deleted'],
+                                         tally['failed'], tally['skipped'])
+      for key in totals:
+        totals[key] += tally[key]
+  print "%-7s %-15s %8d %8d %8d" % ('Total', '', totals['deleted'],
+                                     totals['failed'], totals['skipped'])
 
 if __name__ == "__main__": 
   print "Challenge 13: Write an application that nukes everything in your",
@@ -136,10 +502,14 @@ if __name__ == "__main__":
                       help="Skip the deletion of any DNS")
   parser.add_argument("--skiploadbalancers", action="store_true",
                       help="Skip the deletion of loadbalancers")
+  parser.add_argument("--concurrency", default=1, type=int,
+                      help="Number of regions to clean up at once")
+  parser.add_argument("--taskconcurrency", default=8, type=int,
+                      help="Number of deletes to run at once in each region")
   args = parser.parse_args()
 
   credential_file=os.path.expanduser("~/.rackspace_cloud_credentials")
-  pyrax.set_credential_file(credential_file)
+  session.set_credential_file(credential_file)
 
   if args.region != 'all' and not c1.is_valid_region(args.region,
                                                      'load_balancer'):
@@ -162,35 +532,22 @@ if __name__ == "__main__":
   dryrun = args.dryrun
   if args.all: args.prefix = ''
 
-  for region in deleteFromRegions:
-    print "\nLooking for Cloud objects in %s..." % region
+  if args.concurrency > 1 and len(deleteFromRegions) > 1:
+    # Each region gets its own worker process.  They are forked from this
+    # one, so they all share the token we already authenticated with.
+    pool = multiprocessing.Pool(min(args.concurrency, len(deleteFromRegions)))
+    try:
+      # map_async().get() rather than map() so that ctrl-c still works
+      results = pool.map_async(clean_up_region_worker,
+                               [(region, args) for region in
+                                deleteFromRegions]).get(sys.maxint)
+    finally:
+      pool.close()
+      pool.join()
+  else:
+    results = [clean_up_region_worker((region, args))
+               for region in deleteFromRegions]
 
-    cs = pyrax.connect_to_cloudservers(region=region)
-    dns = pyrax.connect_to_cloud_dns(region=region)
-    clb = pyrax.connect_to_cloud_loadbalancers(region=region)
-    cn = pyrax.connect_to_cloud_networks(region=region)
-    cbs = pyrax.connect_to_cloud_blockstorage(region=region)
-    cf = pyrax.connect_to_cloudfiles(region=region)
-    cdb = pyrax.connect_to_cloud_databases(region=region)
-  
-    # Servers
-    if not args.skipservers: clean_up_generic(cs, args.prefix, 'CloudServer')
-    # Files
-    if not args.skipfiles: clean_up_files(cf, args.prefix)
-    # DNS
-    if not args.skipdns: clean_up_dns(dns, args.prefix)
-    # Loadbalancers
-    if not args.skiploadbalancers:
-      clean_up_generic(clb, args.prefix, 'CloudLoadbalancer')
-    # Images
-    if not args.skipimages: clean_up_images(cs, args.prefix)
-    # Databases
-    if not args.skipdatabases:
-      clean_up_generic(cdb, args.prefix, 'CloudDatabase')
-    # Block Storage
-    if not args.skipblockstorage: clean_up_blockstorage(cbs, args.prefix)
-    # Networks
-    if not args.skipnetworks: 
-      clean_up_generic(cn, args.prefix, 'CloudNetworks')
+  print_summary(results)
 
 # vim: ts=2 sw=2 tw=78 expandtab
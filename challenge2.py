@@ -24,51 +24,136 @@
 # Optional Parameters:
 #   -h, --help                show help message and exit
 #   --region REGION           Region in which to create server (DFW or ORD)
+#   --maxage MAXAGE           Reuse an image of the server taken within this
+#                             many minutes, rather than taking a new one
+#   --clones CLONES           Number of clones to build from the image
+#   --concurrency CONCURRENCY Number of server build requests to send at once
 
 
 import sys
 import os
 import time
+import urllib
 import datetime
 import argparse
 import pyrax
+import session
+import waiter
+import buildhistory
 import challenge1 as c1
 
 
-def clone_server(cs, serverUUID):
-  """Create a clone of an existing CloudServer.
-
-  An image of the "source" CloudServer is created and then a new
-  CloudServer is created from that image.
-  The new CloudServer is give a hostname of the source CloudServer
-  with "-clone" appended.
-
-  Function returns as soon as network IPs are available for the new
-  CloudServer. The build of the CloudServer will not yet be complete.
+def find_recent_image(cs, source_server, maxAge):
+  """Return the newest ACTIVE snapshot image of source_server that is no
+  more than maxAge minutes old, or None if there isn't one.
+  """
+  query = {'server': source_server.id, 'type': 'SNAPSHOT', 'status': 'ACTIVE'}
+  images = cs.images._list("/images/detail?%s" % urllib.urlencode(query),
+                           "images")
+  oldest = datetime.datetime.utcnow() - datetime.timedelta(minutes=maxAge)
+  newest = None
+  for img in images:
+    # the server filter is only a hint on some clouds, so check for ourselves
+    server = getattr(img, 'server', None) or {}
+    metadata = getattr(img, 'metadata', None) or {}
+    if source_server.id not in (server.get('id'),
+                                metadata.get('instance_uuid')):
+      continue
+    if img.status != 'ACTIVE':
+      continue
+    created = datetime.datetime.strptime(img.created, "%Y-%m-%dT%H:%M:%SZ")
+    if created >= oldest and (newest is None or img.created > newest.created):
+      newest = img
+  return newest
+
+def image_server(cs, source_server):
+  """Take an image of source_server and wait for it to complete.  Returns
+  the new image's id.
   """
-  # get info about source server
-  source_server = cs.servers.get(serverUUID)
-
   # Request image of source server
   imageName='%s-%s' % (source_server.name,
             datetime.datetime.now().strftime("%Y-%m-%d-%H:%M:%S"))
   print "Requesting image of source server. Image will be named %s" % imageName
-  image_id = cs.servers.create_image(serverUUID, imageName)
+  started = time.time()
+  image_id = cs.servers.create_image(source_server.id, imageName)
 
   # Wait for image to complete
   print "Waiting for image build to complete (usually takes 30-90 minutes)..."
   newImage = cs.images.get(image_id)
-  while newImage.status <> 'ACTIVE':
-    time.sleep(60)
-    newImage.get()
+  region = buildhistory.client_region(cs)
+  # servers booted from a volume have no image, and so nothing to compare
+  # their build time with
+  sourceImage = source_server.image and source_server.image['id']
+  hint = None
+  if sourceImage:
+    hint = buildhistory.predict_build_time('image',
+                                           source_server.flavor['id'],
+                                           sourceImage, region)
+  if hint:
+    print "Previous images like this one took about %d minutes" % (hint / 60)
+
+  def progress():
     print "%s %d%%" % (newImage.status, newImage.progress)
 
-  # Create new server using image 
+  status = waiter.wait_for_status(newImage, progress=progress, initial=5,
+                                  maximum=30, hint=hint)
+  if status != 'ACTIVE':
+    print "Image build failed with status %s. Aborting..." % status
+    sys.exit(3)
+  if sourceImage:
+    buildhistory.record_build('image', source_server.flavor['id'],
+                              sourceImage, region, time.time() - started)
+  print "Image complete!"
+  return image_id
+
+def clone_image(cs, source_server, maxAge=0):
+  """Return the id of an image to clone source_server from: its newest
+  snapshot if that is no more than maxAge minutes old, otherwise a fresh
+  image (see image_server).
+  """
+  if maxAge > 0:
+    img = find_recent_image(cs, source_server, maxAge)
+    if img is not None:
+      print "Reusing image %s taken %s" % (img.name, img.created)
+      return img.id
+  return image_server(cs, source_server)
+
+def clone_server(cs, serverUUID, maxAge=0):
+  """Create a clone of an existing CloudServer.
+
+  An image of the "source" CloudServer is created (or a recent one reused -
+  see clone_image) and then a new CloudServer is created from that image.
+  The new CloudServer is give a hostname of the source CloudServer
+  with "-clone" appended.
+
+  Function returns as soon as network IPs are available for the new
+  CloudServer. The build of the CloudServer will not yet be complete.
+  """
+  newservers = clone_servers(cs, serverUUID, 1, maxAge)
+  if not newservers:
+    print "The clone could not be built. Aborting..."
+    sys.exit(4)
+  return newservers[0]
+
+def clone_servers(cs, serverUUID, clones, maxAge=0, concurrency=4):
+  """Create clones copies of an existing CloudServer, all from a single
+  image of it (see clone_image), sending up to concurrency build requests
+  at once.  Clones are named after the source CloudServer with "-clone"
+  appended, plus a counter if there is more than one.
+
+  Returns array of the new server objects; their builds will not yet be
+  complete.
+  """
+  # get info about source server
+  source_server = cs.servers.get(serverUUID)
+  image_id = clone_image(cs, source_server, maxAge)
+
+  # Create new servers using image
   newServerName = source_server.name + '-clone'
-  print "Image complete!\nBuilding new server named %s" % newServerName
-  newserver = cs.servers.create(newServerName, image_id,
-                                source_server.flavor['id'])
-  return newserver
+  print "Building %d new server%s named %s" % (clones,
+          "" if clones == 1 else "s", newServerName)
+  return c1.build_some_servers(cs, source_server.flavor['id'], image_id,
+                               newServerName, clones, concurrency=concurrency)
 
 if __name__ == "__main__":
   print "Challenge2 - Write a script that clones a server (takes an image and"
@@ -81,10 +166,16 @@ if __name__ == "__main__":
   parser.add_argument("SourceServer", help="UUID of the server to clone")
   parser.add_argument("--region", default='DFW',
                       help="Region in which to create servers (DFW or ORD)")
+  parser.add_argument("--maxage", default=0, type=int,
+                      help="Reuse an image taken within this many minutes")
+  parser.add_argument("--clones", default=1, type=int,
+                      help="Number of clones to build from the image")
+  parser.add_argument("--concurrency", default=4, type=int,
+                      help="Number of server build requests to send at once")
   args = parser.parse_args()
 
   credential_file=os.path.expanduser("~/.rackspace_cloud_credentials")
-  pyrax.set_credential_file(credential_file)
+  session.set_credential_file(credential_file)
   if c1.is_valid_region(args.region, 'compute'):
     cs = pyrax.connect_to_cloudservers(region=args.region)
   else:
@@ -100,10 +191,14 @@ if __name__ == "__main__":
     print "Aborting...."
     sys.exit(2)
 
-  newserver = clone_server(cs, args.SourceServer);
+  newservers = clone_servers(cs, args.SourceServer, args.clones, args.maxage,
+                             args.concurrency)
+  if not newservers:
+    print "None of the clones could be built. Aborting..."
+    sys.exit(4)
   # Wait for network info to become available
-  c1.wait_for_server_networks([newserver])
-  # Print info for new server
-  c1.print_servers_info([newserver])
+  c1.wait_for_server_networks(newservers)
+  # Print info for new servers
+  c1.print_servers_info(newservers)
 
 # vim: ts=2 sw=2 tw=78 expandtab
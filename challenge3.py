@@ -27,45 +27,376 @@
 # Optional Parameters:
 #   -h, --help                show help message and exit
 #   --region REGION           Region in which to create container (DFW or ORD)
+#   --concurrency CONCURRENCY Number of files to upload at once
+#   --manifest MANIFEST       File recording completed uploads, so that an
+#                             interrupted upload can pick up where it stopped
+#   --sync                    Only upload new or changed files
+#   --deleteorphans           With --sync, delete objects that no longer exist
+#                             in the directory
+#   --trace TRACE             Write timings for every object uploaded to this
+#                             file (one JSON document per line)
 
 
 import sys
 import os
 import time
+import json
+import hashlib
 import argparse
+import threading
 import pyrax
+import session
+import swiftapi
+import uploadmeter
 import challenge1 as c1
+from multiprocessing.pool import ThreadPool
 
 
-def upload_dir_to_container(cf, ULdirectory, ULContainer):
-  """ Upload contents of a local directory to a CloudFiles Container
+MANIFEST_DIR = os.path.expanduser("~/.rackspace_upload_manifests")
+ETAG_CACHE = os.path.join(MANIFEST_DIR, "etagcache")
 
-  If the specified CloudFiles container does not already exist, then it
-  is created.
+def walk_files(directory):
+  """Lazily walk directory, yielding tuple (path, object name) for each
+  file.  Object names are the path relative to directory, with "/"
+  separators - the same names pyrax's upload_folder uses.  They are
+  decoded from UTF-8, so they compare equal to the (unicode) names in a
+  container listing; a file whose name is not UTF-8 can't be stored under
+  its own name, so it is reported and skipped.
+  """
+  for dirpath, dirnames, filenames in os.walk(directory):
+    dirnames.sort()
+    for fname in sorted(filenames):
+      path = os.path.join(dirpath, fname)
+      objName = os.path.relpath(path, directory).replace(os.sep, '/')
+      try:
+        if not isinstance(objName, unicode):
+          objName = objName.decode('utf-8')
+      except UnicodeDecodeError:
+        print "\nSkipping %s: its name is not valid UTF-8" % path
+        continue
+      yield (path, objName)
 
-  A simple progress message is displayed every 2 seconds and function
-  does not return until upload completes.
+def manifest_file(ULdirectory, ULContainer):
+  """Return name of the manifest file recording what has already been
+  uploaded from ULdirectory to ULContainer.
   """
+  key = hashlib.md5("%s\n%s" % (os.path.abspath(ULdirectory),
+                                ULContainer)).hexdigest()
+  return os.path.join(MANIFEST_DIR, "%s-%s" % (ULContainer.replace('/', '_'),
+                                                key))
+
+def load_manifest(manifestFile):
+  """Return dict of object name -> manifest entry (path, size, mtime, etag)
+  for everything a previous run recorded as uploaded.
+  """
+  manifest = {}
+  try:
+    with open(manifestFile, 'r') as mf:
+      for line in mf:
+        try:
+          entry = json.loads(line)
+        except ValueError:
+          # the last line may be half written if we were interrupted
+          continue
+        manifest[entry['object']] = entry
+  except IOError:
+    pass
+  return manifest
+
+def already_uploaded(manifest, objName, st):
+  """True if the manifest says this exact file (same size and mtime) was
+  already uploaded as objName.
+  """
+  entry = manifest.get(objName)
+  return (entry is not None and entry['size'] == st.st_size and
+          entry['mtime'] == st.st_mtime)
+
+def upload_file(storageURL, token, container, path, objName, timings=None,
+                checkExisting=True):
+  """Upload a single file, streaming it from disk (in segments, as a Static
+  Large Object, if it is big).  Returns its etag.  Time spent reading,
+  hashing and PUTting is added to timings, if given.  checkExisting=False
+  says there is no object of that name yet (see swiftapi.put_file).
+  """
+  return swiftapi.put_file(storageURL, token, container, objName, path,
+                           timings=timings, checkExisting=checkExisting)
+
+def file_etag(path, st, cache):
+  """Return the etag the file will have once uploaded - its MD5, or for
+  a file big enough to go up in segments, the MD5 of the segments' MD5s.
+  cache is a dict keyed by device and inode; as long as the size and mtime
+  have not changed since the file was last hashed, the cached value is used
+  instead of reading the whole file again.
+  """
+  key = "%d:%d" % (st.st_dev, st.st_ino)
+  entry = cache.get(key)
+  if (entry is not None and entry['mtime'] == st.st_mtime and
+      entry['size'] == st.st_size):
+    return entry['etag']
+  etag = swiftapi.file_etag(path)
+  remember_etag(cache, st, etag)
+  return etag
+
+def remember_etag(cache, st, etag):
+  """Record the etag of the file described by st (an os.stat result)"""
+  cache["%d:%d" % (st.st_dev, st.st_ino)] = {"mtime": st.st_mtime,
+                                             "size": st.st_size, "etag": etag}
+
+def load_etag_cache(cacheFile=ETAG_CACHE):
+  """Return the etag cache saved by the last sync, or an empty one."""
+  try:
+    with open(cacheFile, 'r') as cf:
+      return json.load(cf)
+  except (IOError, ValueError):
+    return {}
+
+def save_etag_cache(cache, cacheFile=ETAG_CACHE):
+  """Save the etag cache for the next sync."""
+  if not os.path.isdir(os.path.dirname(cacheFile)):
+    os.makedirs(os.path.dirname(cacheFile))
+  with open(cacheFile + '.tmp', 'w') as cf:
+    json.dump(cache, cf)
+  os.rename(cacheFile + '.tmp', cacheFile)
 
-  # if container does not already exist, then create it!
+def get_or_create_container(cf, ULContainer):
+  """Return the named CloudFiles container, creating it if need be."""
   try:
     cont = cf.get_container(ULContainer)
     print "The container %s already exists. We'll use it!" % ULContainer
   except:
     print "The container %s did not yet exit - creating it now!" % ULContainer
     cont = cf.create_container(ULContainer)
+  return cont
+
+def upload_files(storageURL, token, container, work, concurrency=8,
+                 record=None, stats=None, traceFile=None, existing=None):
+  """Upload files to container using a pool of concurrency threads.  work
+  is an iterable of tuple (path, object name, os.stat result) and is only
+  read as fast as the uploads keep up with it.  record(path, objName, st,
+  etag), if given, is called (one at a time) after each successful upload;
+  if it raises, the file is counted as failed.  existing, if given, holds
+  the names of the objects already in container (ie: from a listing), so
+  new objects can skip the check for old segments to clean up.
+
+  Throughput, uploads in flight and read/hash/PUT latencies are shown on a
+  live status line (see uploadmeter), and written per object to traceFile
+  if given.  Returns dict of files and bytes uploaded, and files skipped
+  (counted by whoever produces work) and failed.
+  """
+  if stats is None:
+    stats = {}
+  for key in ('files', 'bytes', 'skipped', 'failed', 'inflight'):
+    stats.setdefault(key, 0)
+  # keep the producer from racing too far ahead of the uploads
+  slots = threading.BoundedSemaphore(concurrency * 2)
+  meter = uploadmeter.UploadMeter(traceFile)
+  # redraw often on a terminal, where the line is rewritten in place
+  interval = 0.5 if meter.live else 2
+
+  def upload(item):
+    path, objName, st = item
+    timings = {}
+    meter.begin()
+    started = time.time()
+    try:
+      etag = upload_file(storageURL, token, container, path, objName, timings,
+                         existing is None or objName in existing)
+      meter.end(objName, st.st_size, timings, time.time() - started)
+      return (item, etag, None)
+    except Exception as err:
+      meter.end(objName, st.st_size, timings, time.time() - started, err)
+      return (item, None, err)
+
+  # stats is updated from this thread and the pool's result thread
+  counting = threading.Lock()
+
+  def uploaded(result):
+    # runs in the pool's result thread, one result at a time.  Nothing may
+    # escape from here: an exception would kill that thread and leave us
+    # waiting on stats['inflight'] forever.
+    (path, objName, st), etag, err = result
+    try:
+      if err is None and record is not None:
+        record(path, objName, st, etag)
+    except Exception as recErr:
+      err = recErr
+    with counting:
+      stats['inflight'] -= 1
+      if err is None:
+        stats['files'] += 1
+        stats['bytes'] += st.st_size
+      else:
+        stats['failed'] += 1
+    slots.release()
+    if err is not None:
+      print "\nUpload of %s failed: %s" % (path, err)
+
+  def in_flight():
+    with counting:
+      return stats['inflight']
+
+  def report():
+    meter.show(" | %d unchanged %d failed" % (stats['skipped'],
+                                              stats['failed']))
+
+  pool = ThreadPool(concurrency)
+  lastReport = time.time()
+  try:
+    for item in work:
+      slots.acquire()
+      with counting:
+        stats['inflight'] += 1
+      pool.apply_async(upload, (item,), callback=uploaded)
+      if time.time() - lastReport >= interval:
+        report()
+        lastReport = time.time()
+    pool.close()
+    # wait for the stragglers, still reporting as we go
+    while in_flight():
+      time.sleep(0.2)
+      if time.time() - lastReport >= interval:
+        report()
+        lastReport = time.time()
+    pool.join()
+  except:
+    pool.terminate()
+    raise
+
+  report()
+  meter.finish()
+  print "%d unchanged, %d failed" % (stats['skipped'], stats['failed'])
+  return stats
+
+def upload_dir_to_container(cf, ULdirectory, ULContainer, concurrency=8,
+                            manifestFile=None, traceFile=None):
+  """ Upload contents of a local directory to a CloudFiles Container
+
+  If the specified CloudFiles container does not already exist, then it
+  is created.
+
+  Files are uploaded by a pool of concurrency threads while the directory
+  is still being walked.  Every completed upload is recorded (path, size,
+  mtime, etag) in a manifest file, so if the upload is interrupted the next
+  run skips whatever already made it.
+
+  Progress is shown as it goes (see upload_files) and function does not
+  return until upload completes.
+  """
+  if not os.path.isdir(ULdirectory):
+    raise pyrax.exceptions.FolderNotFound("No such folder: '%s'" %
+                                          ULdirectory)
+
+  cont = get_or_create_container(cf, ULContainer)
 
   print "\nUploading the contents of %s to CloudFiles container %s:" % \
     (ULdirectory, ULContainer)
-  upload_key, total_bytes = cf.upload_folder(ULdirectory, cont)
+  storageURL, token = swiftapi.storage_endpoint(cf)
+  if manifestFile is None:
+    manifestFile = manifest_file(ULdirectory, ULContainer)
+  if not os.path.isdir(os.path.dirname(manifestFile)):
+    os.makedirs(os.path.dirname(manifestFile))
+  manifest = load_manifest(manifestFile)
+  if manifest:
+    print "Resuming: %d files were uploaded by an earlier run" % len(manifest)
+
+  # one listing up front saves a HEAD per file: only objects that are
+  # already there can be Static Large Objects with segments to clean up
+  existing = set(obj['name'] for obj in
+                 swiftapi.iter_objects(storageURL, token, cont.name))
+
+  stats = {'skipped': 0}
+
+  def pending():
+    for path, objName in walk_files(ULdirectory):
+      st = os.stat(path)
+      if already_uploaded(manifest, objName, st):
+        stats['skipped'] += 1
+        continue
+      yield (path, objName, st)
+
+  def record(path, objName, st, etag):
+    mf.write(json.dumps({"object": objName, "path": path,
+                         "size": st.st_size, "mtime": st.st_mtime,
+                         "etag": etag}) + "\n")
+    mf.flush()
+
+  with open(manifestFile, 'a') as mf:
+    upload_files(storageURL, token, cont.name, pending(), concurrency, record,
+                 stats, traceFile, existing)
+
+  if stats['failed']:
+    print "Some files failed to upload. Run again to retry just those files."
+  else:
+    print "Done!"
+
+def sync_dir_to_container(cf, ULdirectory, ULContainer, concurrency=8,
+                          deleteOrphans=False, traceFile=None):
+  """Make a CloudFiles container match a local directory, uploading only
+  the files that are new or have changed.
+
+  The container is listed once and compared with a scan of the directory:
+  a file is uploaded if there is no object of that name, or the sizes
+  differ, or the object's etag does not match the file (see file_etag).
+  Etags are cached by inode and mtime, so unchanged files are not read
+  again on the next sync.
+
+  Objects with no matching local file are deleted if deleteOrphans is True,
+  otherwise they are just counted.
+  """
+  if not os.path.isdir(ULdirectory):
+    raise pyrax.exceptions.FolderNotFound("No such folder: '%s'" %
+                                          ULdirectory)
+
+  cont = get_or_create_container(cf, ULContainer)
+  storageURL, token = swiftapi.storage_endpoint(cf)
+
+  print "\nSyncing the contents of %s to CloudFiles container %s:" % \
+    (ULdirectory, ULContainer)
+  remote = dict((obj['name'], obj) for obj in
+                swiftapi.iter_objects(storageURL, token, cont.name))
+  print "The container currently holds %d objects" % len(remote)
+
+  cache = load_etag_cache()
+  local = set()
+  stats = {'skipped': 0}
 
-  uploaded = 0
-  while uploaded < total_bytes:
-    time.sleep(2)
-    uploaded = cf.get_uploaded(upload_key)
-    print "Progress: %4.2f%%" % ((uploaded * 100.0) / total_bytes)
+  def changed():
+    for path, objName in walk_files(ULdirectory):
+      st = os.stat(path)
+      local.add(objName)
+      obj = remote.get(objName)
+      if (obj is not None and obj['bytes'] == st.st_size and
+          obj['hash'].strip('"') == file_etag(path, st, cache)):
+        stats['skipped'] += 1
+        continue
+      yield (path, objName, st)
 
-  print "Done!"
+  def record(path, objName, st, etag):
+    remember_etag(cache, st, etag)
+
+  try:
+    upload_files(storageURL, token, cont.name, changed(), concurrency, record,
+                 stats, traceFile, remote)
+  finally:
+    save_etag_cache(cache)
+
+  orphans = sorted(name for name in remote if name not in local)
+  if orphans and deleteOrphans:
+    print "Deleting %d objects that no longer exist locally" % len(orphans)
+    for first in xrange(0, len(orphans), swiftapi.BULK_DELETE_MAX):
+      batch = orphans[first:first + swiftapi.BULK_DELETE_MAX]
+      deleted, notFound, errors = swiftapi.bulk_delete(storageURL, token,
+          ["%s/%s" % (cont.name, name) for name in batch])
+      for path, status in errors:
+        print "Delete of %s failed: %s" % (path, status)
+  elif orphans:
+    print "%d objects no longer exist locally" % len(orphans),
+    print "(use --deleteorphans to remove them)"
+
+  if stats['failed']:
+    print "Some files failed to upload. Run again to retry just those files."
+  else:
+    print "Done!"
 
 if __name__ == "__main__":
   print "\nChallenge3 - Write a script that accepts a directory as an argument"
@@ -81,11 +412,21 @@ if __name__ == "__main__":
                       help="CloudFiles container")
   parser.add_argument("--region", default='DFW',
                       help="Region in which to create container (DFW or ORD)")
+  parser.add_argument("--concurrency", default=8, type=int,
+                      help="Number of files to upload at once")
+  parser.add_argument("--manifest", default=None,
+                      help="File recording completed uploads")
+  parser.add_argument("--sync", action="store_true",
+                      help="Only upload new or changed files")
+  parser.add_argument("--deleteorphans", action="store_true",
+                      help="With --sync, delete objects not in the directory")
+  parser.add_argument("--trace", default=None,
+                      help="Write per-object upload timings to this file")
 
   args = parser.parse_args()
 
   credential_file=os.path.expanduser("~/.rackspace_cloud_credentials")
-  pyrax.set_credential_file(credential_file)
+  session.set_credential_file(credential_file)
   if c1.is_valid_region(args.region, 'object_store'):
     cf = pyrax.connect_to_cloudfiles(region=args.region)
   else:
@@ -99,7 +440,12 @@ if __name__ == "__main__":
   # for "read permissions" before calling pyrax
   if os.access(ULDir, os.R_OK):
     try:
-      upload_dir_to_container(cf, ULDir, ULContainer)
+      if args.sync:
+        sync_dir_to_container(cf, ULDir, ULContainer, args.concurrency,
+                              args.deleteorphans, args.trace)
+      else:
+        upload_dir_to_container(cf, ULDir, ULContainer, args.concurrency,
+                                args.manifest, args.trace)
     except pyrax.exceptions.FolderNotFound: 
       print 'The specified directory "%s" does not exist' % ULDir
   else:
@@ -28,58 +28,507 @@
 # Optional Parameters:
 #   -h, --help                show help message and exit
 #   --region REGION           Region (DFW or ORD)
+#   --file FILE               Create all the records listed in FILE (CSV lines
+#                             of fqdn,ip[,type[,ttl]] or JSON) instead of FQDN
+#                             and IP
+#   --stdin                   Read the list of records from stdin
+#   --reconcile FILE          Make a zone match the records listed in FILE
+#                             (YAML or JSON), changing only what differs
+#   --concurrency CONCURRENCY Number of DNS requests to make at once
+#   --validate FILE           Just check the host names and addresses listed
+#                             in FILE (lines of fqdn[,ip], "-" for stdin)
+#   --processes PROCESSES     Number of processes to validate with
 
 
 import sys
 import os
 import re
+import csv
+import time
+import json
 import socket
 import argparse
+import StringIO
+import threading
+import multiprocessing
 import pyrax
+import session
 import challenge1 as c1
+from multiprocessing.pool import ThreadPool
+
+try:
+  import yaml
+  canDoYAML = True
+except:
+  canDoYAML = False
+
+# most records sent to Cloud DNS in one add_records request
+MAX_RECORDS_PER_REQUEST = 100
+
+# seconds a loaded list of zones is trusted before it is fetched again
+ZONE_CACHE_TTL = 300
+
+# record types the DNS service manages itself, which --reconcile leaves alone
+SKIP_RECORD_TYPES = ('NS', 'SOA')
+
+# a valid label of a host name
+HOSTNAME_LABEL = re.compile("(?!-)[A-Z\d-]{1,63}(?<!-)$", re.IGNORECASE)
+
+# lines checked at a time by each validate_lines worker
+VALIDATE_CHUNK = 10000
+
+class ZoneIndex(object):
+  """In-memory index of the zones in a CloudDNS account, for finding the
+  zone a name belongs in without a round trip per guess.
+
+  Zone names are stored in a trie keyed by their labels in reverse order
+  (com -> example -> www), so the zone for a name is found by walking down
+  its reversed labels and keeping the deepest zone passed on the way - the
+  longest matching suffix, at any depth.
+
+  The zone list is fetched the first time it is needed and again once it
+  is more than ttl seconds old, or after invalidate().
+  """
+  def __init__(self, dns, ttl=ZONE_CACHE_TTL):
+    self.dns = dns
+    self.ttl = ttl
+    self.lock = threading.Lock()
+    self.root = None
+    self.loaded = 0
+
+  @staticmethod
+  def _labels(name):
+    return reversed(name.lower().rstrip('.').split('.'))
+
+  def _insert(self, domain):
+    node = self.root
+    for label in self._labels(domain.name):
+      node = node.setdefault(label, {})
+    # labels are never empty, so '' can't clash with a child
+    node[''] = domain
+
+  def _current(self):
+    """Return the trie, fetching the zone list first if need be"""
+    with self.lock:
+      if self.root is None or time.time() - self.loaded > self.ttl:
+        self.root = {}
+        for domain in self.dns.get_domain_iterator():
+          self._insert(domain)
+        self.loaded = time.time()
+      return self.root
+
+  def invalidate(self):
+    """Forget the zone list, so that it is fetched again on next use"""
+    with self.lock:
+      self.root = None
+
+  def add(self, domain):
+    """Add a zone that has just been created to the index"""
+    with self.lock:
+      if self.root is not None:
+        self._insert(domain)
+
+  def lookup(self, name):
+    """Return the domain with the longest name that name falls within
+    (ie: "example.com" for "a.b.c.example.com"), or None if there is none.
+    """
+    node = self._current()
+    found = None
+    for label in self._labels(name):
+      node = node.get(label)
+      if node is None:
+        break
+      found = node.get('', found)
+    return found
+
+_zone_indexes = {}
+
+def zone_index(dns):
+  """Return the ZoneIndex for a CloudDNS client, shared by every call that
+  uses the same client.
+  """
+  key = id(dns)
+  if key not in _zone_indexes or _zone_indexes[key].dns is not dns:
+    _zone_indexes[key] = ZoneIndex(dns)
+  return _zone_indexes[key]
+
+def find_zone(dns, FQDN, index=None):
+  """Return the CloudDNS domain that records for FQDN belong in: the
+  existing zone whose name is the longest suffix of FQDN (see ZoneIndex),
+  or if there is none, a new zone for the specified name.  Raises
+  pyrax.exceptions.DomainCreationFailed if that can not be created.
+
+  index defaults to the shared ZoneIndex for dns; a zone we create is
+  added to it.
+  """
+  if index is None:
+    index = zone_index(dns)
+  domain = index.lookup(FQDN)
+  if domain is not None:
+    return domain
+
+  domain = dns.create(name=FQDN, ttl=300, emailAddress='dnsmaster@%s' % FQDN)
+  index.add(domain)
+  return domain
+
+def add_dns_record(dns, FQDN, data, RcdType, ttl=300):
+  """Add a DNS record to the zone found (or created) by find_zone, and
+  return the zone.  Raises pyrax.exceptions.DomainCreationFailed if there
+  is no zone and one can not be created.
+  """
+  domain = find_zone(dns, FQDN)
+  domain.add_record({"type": RcdType, "name": FQDN, "data": data,
+                     "ttl": ttl})
+  return domain
 
 def create_dns_record(dns, FQDN, IPAddr, RcdType):
   """ Create specified DNS record in CloudDNS
-  
-  First attempt to add record to zone matching specified name.
 
-  If that fails, next try to add record to zone of specified name with
-  first element removed (ie: if "www.example.com" is specified, try adding
-  to "example.com" zone.
+  The record is added to the zone found (or created) by find_zone.  If the
+  zone does not exist and can not be created, then give up and report
+  error.
+  """
+  try:
+    domain = add_dns_record(dns, FQDN, IPAddr, RcdType)
+  except pyrax.exceptions.DomainCreationFailed as err:
+    print "Domain does not exist, and attempt to create it",
+    print "failed with:" 
+    print err
+    sys.exit(5)
+
+  print "DNS record %s %s %s added to zone %s" % (FQDN, RcdType, IPAddr, 
+	domain.name)
+
+def record_type(IPAddr):
+  """Return the record type for an address: "A" for IPv4, "AAAA" for IPv6,
+  None if it is neither.
+  """
+  if is_valid_ipv4_address(IPAddr):
+    return 'A'
+  if is_valid_ipv6_address(IPAddr):
+    return 'AAAA'
+  return None
+
+def read_records(source):
+  """Read DNS records from source (an open file) and return a list of tuple
+  (FQDN, data, type, ttl).  type and ttl may be None, meaning work out the
+  type from the address and use the default TTL.  Nothing is checked here:
+  bad rows (ie: a TTL that is not a number) are reported by
+  create_dns_records along with the rest.
+
+  The file may be JSON - a list of objects with keys fqdn (or name), ip (or
+  data), and optionally type and ttl, or a list of lists - or CSV with one
+  record per line: fqdn,ip[,type[,ttl]].  Blank lines, comments (#) and a
+  "fqdn,..." header line are skipped in CSV.
+  """
+  text = source.read()
+  if text.lstrip()[:1] in ('[', '{'):
+    entries = json.loads(text)
+    if isinstance(entries, dict):
+      entries = entries.get('records', [])
+    records = []
+    for entry in entries:
+      if isinstance(entry, dict):
+        entry = (entry.get('fqdn', entry.get('name')),
+                 entry.get('ip', entry.get('data')),
+                 entry.get('type'), entry.get('ttl'))
+      entry = list(entry) + [None] * (4 - len(entry))
+      records.append(tuple(entry[:4]))
+    return records
+
+  records = []
+  for row in csv.reader(StringIO.StringIO(text)):
+    row = [field.strip() for field in row]
+    if not row or not row[0] or row[0].startswith('#') or \
+       row[0].lower() == 'fqdn':
+      continue
+    row = row + [''] * (4 - len(row))
+    records.append((row[0], row[1], row[2] or None, row[3] or None))
+  return records
 
-  If that also fails, next try creating a new zone for the specified name.
+def create_dns_records(dns, records, concurrency=4):
+  """Create many DNS records in CloudDNS.  records is an iterable of tuple
+  (FQDN, data, type, ttl), where type and ttl may be None (see
+  read_records).
 
-  If that also fails, then give up and report error.
+  Zones are found in the shared ZoneIndex, so the account's zone list is
+  fetched at most once, and any zone that has to be created is created
+  only once (see find_zone).  Records
+  are grouped by zone and each group is added with one add_records request
+  per MAX_RECORDS_PER_REQUEST records; requests for different zones run
+  concurrently, so their async DNS jobs are polled at the same time.
+
+  Returns tuple (number of records added, list of (FQDN, reason) for each
+  record that could not be added).
   """
+  failed = []
+  index = zone_index(dns)
+  groups = {}
+  byID = {}
+  for FQDN, data, rtype, ttl in records:
+    rtype = (rtype or (data and record_type(data)) or '').upper()
+    if not FQDN or not is_valid_hostname(FQDN):
+      failed.append((FQDN, "not a valid host name"))
+      continue
+    if not data or not rtype:
+      failed.append((FQDN, 'the address "%s" is not valid' % data))
+      continue
+    if rtype in ('A', 'AAAA') and record_type(data) != rtype:
+      # one bad record would fail the whole add_records request
+      failed.append((FQDN, 'the address "%s" is not valid for a %s record'
+                           % (data, rtype)))
+      continue
+    if ttl is not None:
+      try:
+        ttl = int(ttl)
+      except (TypeError, ValueError):
+        failed.append((FQDN, 'the TTL "%s" is not valid' % ttl))
+        continue
+    try:
+      domain = find_zone(dns, FQDN, index)
+    except pyrax.exceptions.DomainCreationFailed as err:
+      failed.append((FQDN, "no zone, and creating one failed: %s" % err))
+      continue
+    byID[domain.id] = domain
+    groups.setdefault(domain.id, []).append({"type": rtype, "name": FQDN,
+                                             "data": data,
+                                             "ttl": ttl or 300})
+
+  batches = []
+  for zoneID in sorted(groups):
+    recs = groups[zoneID]
+    for first in xrange(0, len(recs), MAX_RECORDS_PER_REQUEST):
+      batches.append((byID[zoneID], recs[first:first +
+                                           MAX_RECORDS_PER_REQUEST]))
+
+  def add(batch):
+    domain, recs = batch
+    try:
+      domain.add_records(recs)
+      return (domain, recs, None)
+    except Exception as err:
+      return (domain, recs, err)
 
-  # if FQDN exists as a domain, add record to that domain
-  # elif stripping off the first part results in a domain that exists, add to
-  #   that domain
-  # else
-  #     create new domain of FQDN
-  #     add rcd to that domain
-  dns_rec = {"type": RcdType,
-            "name": FQDN,
-            "data": IPAddr,
-            "ttl": 300}
+  added = 0
+  pool = ThreadPool(max(1, min(concurrency, len(batches))))
   try:
-    domain = dns.find(name=FQDN)
-  except pyrax.exceptions.NotFound:
+    for domain, recs, err in pool.imap_unordered(add, batches):
+      if err is not None:
+        failed.extend((rec['name'], "adding to zone %s failed: %s" %
+                                    (domain.name, err)) for rec in recs)
+        continue
+      added += len(recs)
+      print "Added %d records to zone %s" % (len(recs), domain.name)
+  finally:
+    pool.close()
+    pool.join()
+  return (added, failed)
+
+def read_zone_file(path):
+  """Read the desired record set for a zone from a YAML (if PyYAML is
+  installed) or JSON file of the form:
+
+    zone: example.com
+    records:
+      - {name: www, type: A, data: 192.0.2.10, ttl: 300}
+      - {name: "@", type: MX, data: mail.example.com, priority: 10}
+
+  Names are relative to the zone ("@" is the zone itself) unless they
+  already end with it.  Returns tuple (zone name, list of record dicts).
+  Raises ValueError if the file or any of its records is not valid (see
+  check_zone_records).
+  """
+  with open(path, 'r') as zf:
+    text = zf.read()
+  if canDoYAML:
     try:
-      domain = dns.find(name=FQDN.split('.',1)[1])
-    except pyrax.exceptions.NotFound:
-      try:
-        domain = dns.create(name=FQDN, ttl=300,
-                            emailAddress='dnsmaster@%s' % FQDN)
-      except pyrax.exceptions.DomainCreationFailed as err:
-        print "Domain does not exist, and attempt to create it",
-        print "failed with:" 
-        print err
-        sys.exit(5)
-
-  rec = domain.add_record(dns_rec)
-  print "DNS record %s %s %s added to zone %s" % (FQDN, RcdType, IPAddr, 
-	domain.name)
+      spec = yaml.safe_load(text)
+    except yaml.YAMLError as err:
+      raise ValueError("%s is not valid YAML: %s" % (path, err))
+  else:
+    try:
+      spec = json.loads(text)
+    except ValueError:
+      raise ValueError("%s is not JSON (install PyYAML to read YAML)" % path)
+  if not isinstance(spec, dict) or not spec.get('zone'):
+    raise ValueError("%s does not name a zone" % path)
+  records = spec.get('records') or []
+  try:
+    check_zone_records(records)
+  except ValueError as err:
+    raise ValueError("%s: %s" % (path, err))
+  return (spec['zone'], records)
+
+def check_zone_records(records):
+  """Make sure every desired record (see zone_diff) has a name, type and
+  data, and that ttl and priority, if given, are numbers.  Raises
+  ValueError naming the first record that is not valid.
+  """
+  if not isinstance(records, list):
+    raise ValueError("records is not a list")
+  for num, rec in enumerate(records, 1):
+    if not isinstance(rec, dict):
+      raise ValueError("record %d is not a mapping: %r" % (num, rec))
+    for field in ('name', 'type', 'data'):
+      if rec.get(field) in (None, ''):
+        raise ValueError("record %d has no %s: %r" % (num, field, rec))
+    for field in ('ttl', 'priority'):
+      if rec.get(field) is not None:
+        try:
+          int(rec[field])
+        except (TypeError, ValueError):
+          raise ValueError("record %d has a %s that is not a number: %r" %
+                           (num, field, rec))
+
+def record_key(name, rtype, data):
+  """Return the (name, type, data) key records are matched up by"""
+  return (name.lower().rstrip('.'), rtype.upper(), str(data).rstrip('.'))
+
+def zone_diff(zone, current, desired):
+  """Work out the fewest changes that turn the records of a zone into the
+  desired set.  current is a list of CloudDNS record objects, desired a
+  list of dicts (name, type, data, and optionally ttl and priority).  NS and
+  SOA records are left alone.
+
+  Records are matched by (name, type, data).  A desired record with no
+  match is added, a current one with no match is deleted - except that
+  where a name and type has both, the pair becomes a single update of the
+  data.  Matched records are updated only if their ttl or priority differ.
+
+  Returns tuple (adds, updates, deletes): a list of record dicts, a list of
+  (record, dict of changes) and a list of records.  Raises ValueError,
+  before anything is compared, if a desired record is not valid (see
+  check_zone_records).
+  """
+  check_zone_records(desired)
+  zone = zone.lower().rstrip('.')
+  wanted = {}
+  for rec in desired:
+    name = str(rec['name']).lower().rstrip('.')
+    if name in ('@', ''):
+      name = zone
+    elif name != zone and not name.endswith('.' + zone):
+      name = "%s.%s" % (name, zone)
+    rec = dict(rec, name=name, type=rec['type'].upper(),
+               ttl=int(rec.get('ttl') or 300))
+    if rec['type'] in SKIP_RECORD_TYPES:
+      continue
+    wanted[record_key(name, rec['type'], rec['data'])] = rec
+
+  have = {}
+  deletes = []
+  for rec in current:
+    if rec.type.upper() in SKIP_RECORD_TYPES:
+      continue
+    key = record_key(rec.name, rec.type, rec.data)
+    if key in have:
+      # a duplicate of a record we already have
+      deletes.append(rec)
+    else:
+      have[key] = rec
+
+  updates = []
+  for key in sorted(set(wanted) & set(have)):
+    rec, want = have[key], wanted[key]
+    changes = {}
+    if int(rec.ttl or 0) != want['ttl']:
+      changes['ttl'] = want['ttl']
+    if want.get('priority') is not None and \
+       int(getattr(rec, 'priority', None) or 0) != int(want['priority']):
+      changes['priority'] = int(want['priority'])
+    if changes:
+      updates.append((rec, changes))
+
+  # pair up leftovers with the same name and type as data changes
+  adding = {}
+  for key in sorted(set(wanted) - set(have)):
+    adding.setdefault(key[:2], []).append(wanted[key])
+  removing = {}
+  for key in sorted(set(have) - set(wanted)):
+    removing.setdefault(key[:2], []).append(have[key])
+  adds = []
+  for nameType in sorted(set(adding) | set(removing)):
+    toAdd = adding.get(nameType, [])
+    toRemove = removing.get(nameType, [])
+    for rec, want in zip(toRemove, toAdd):
+      changes = {'data': want['data']}
+      if int(rec.ttl or 0) != want['ttl']:
+        changes['ttl'] = want['ttl']
+      if want.get('priority') is not None:
+        changes['priority'] = int(want['priority'])
+      updates.append((rec, changes))
+    adds.extend(toAdd[len(toRemove):])
+    deletes.extend(toRemove[len(toAdd):])
+  return (adds, updates, deletes)
+
+def reconcile_zone(dns, zone, desired, concurrency=4):
+  """Make the records of a CloudDNS zone match desired (see zone_diff),
+  creating the zone if it does not exist.  The zone's records are fetched
+  once; adds go out in add_records requests of up to
+  MAX_RECORDS_PER_REQUEST records, updates and deletes run concurrently.
+  A zone already matching desired costs no writes at all.
+
+  Returns tuple (adds, updates, deletes, list of failure messages).
+  """
+  index = zone_index(dns)
+  domain = index.lookup(zone)
+  if domain is None or domain.name.lower() != zone.lower().rstrip('.'):
+    domain = dns.create(name=zone, ttl=300,
+                        emailAddress='dnsmaster@%s' % zone)
+    index.add(domain)
+    current = []
+  else:
+    current = list(dns.get_record_iterator(domain))
+
+  adds, updates, deletes = zone_diff(domain.name, current, desired)
+  print "Zone %s: %d records, %d to add, %d to update, %d to delete" % (
+          domain.name, len(current), len(adds), len(updates), len(deletes))
+
+  def add(recs):
+    domain.add_records(recs)
+    return "Added %d records" % len(recs)
+
+  def update(change):
+    rec, changes = change
+    dns.update_record(domain, rec, **changes)
+    return "Updated %s %s %s: %s" % (rec.name, rec.type, rec.data,
+            ", ".join("%s=%s" % kv for kv in sorted(changes.items())))
+
+  def delete(rec):
+    dns.delete_record(domain, rec)
+    return "Deleted %s %s %s" % (rec.name, rec.type, rec.data)
+
+  def attempt(job):
+    func, arg = job
+    try:
+      return (True, func(arg))
+    except Exception as err:
+      return (False, "%s failed: %s" % (func.__name__, err))
+
+  newRecords = []
+  for rec in adds:
+    new = {"name": rec['name'], "type": rec['type'], "data": rec['data'],
+           "ttl": rec['ttl']}
+    if rec.get('priority') is not None:
+      new['priority'] = int(rec['priority'])
+    newRecords.append(new)
+  work = [(add, newRecords[first:first + MAX_RECORDS_PER_REQUEST])
+          for first in xrange(0, len(newRecords), MAX_RECORDS_PER_REQUEST)]
+  work.extend((update, change) for change in updates)
+  work.extend((delete, rec) for rec in deletes)
+
+  failed = []
+  if work:
+    pool = ThreadPool(max(1, min(concurrency, len(work))))
+    try:
+      for ok, message in pool.imap_unordered(attempt, work):
+        print "  " + message
+        if not ok:
+          failed.append(message)
+    finally:
+      pool.close()
+      pool.join()
+  return (adds, updates, deletes, failed)
 
 def is_valid_ipv4_address(address):
   """Return True if parameter is a valid IPv4 address, otherwise return
@@ -115,28 +564,184 @@ def is_valid_hostname(hostname):
     return False
   if hostname[-1:] == ".":
     hostname = hostname[:-1] # strip exactly one dot from the right, if present
-  allowed = re.compile("(?!-)[A-Z\d-]{1,63}(?<!-)$", re.IGNORECASE)
-  return all(allowed.match(x) for x in hostname.split("."))
+  return all(HOSTNAME_LABEL.match(x) for x in hostname.split("."))
+
+def classify_address(address):
+  """Return "ipv4" or "ipv6" according to what kind of address parameter
+  is, or None if it is not a valid address at all.
+  """
+  # only an IPv6 address can contain a colon, so one check decides it
+  if ':' in address:
+    return 'ipv6' if is_valid_ipv6_address(address) else None
+  return 'ipv4' if is_valid_ipv4_address(address) else None
+
+def _validate_chunk(chunk):
+  """Validate one chunk of lines - see validate_lines.  chunk is tuple (line
+  number of first line, list of lines).  Returns tuple (counts, errors).
+  """
+  firstLine, lines = chunk
+  counts = {'lines': 0, 'hostnames': 0, 'ipv4': 0, 'ipv6': 0}
+  errors = []
+  for lineNo, line in enumerate(lines, firstLine):
+    # parsed the way read_records does, but a line at a time, so that an
+    # unbalanced quote can't swallow the lines after it
+    fields = [field.strip() for field in next(csv.reader([line]), [])]
+    if not fields or not fields[0] or fields[0].startswith('#') or \
+       fields[0].lower() == 'fqdn':
+      continue
+    counts['lines'] += 1
+    if is_valid_hostname(fields[0]):
+      counts['hostnames'] += 1
+    else:
+      errors.append((lineNo, fields[0], "not a valid host name"))
+    if len(fields) > 1 and fields[1]:
+      kind = classify_address(fields[1])
+      if kind is None:
+        errors.append((lineNo, fields[1], "not a valid IPv4 or IPv6 address"))
+      else:
+        counts[kind] += 1
+  return (counts, errors)
+
+def _chunks(lines, size):
+  """Split an iterable of lines into tuples (first line number, list of up
+  to size lines), reading lines only as they are needed.
+  """
+  chunk = []
+  first = 1
+  for line in lines:
+    chunk.append(line.rstrip("\r\n"))
+    if len(chunk) == size:
+      yield (first, chunk)
+      first += size
+      chunk = []
+  if chunk:
+    yield (first, chunk)
+
+def validate_lines(lines, processes=1, chunkSize=VALIDATE_CHUNK):
+  """Validate an inventory of host names and addresses - an iterable of
+  lines (ie: an open file) of the form fqdn[,ip[,...]], the same as --file
+  takes.  Blank lines, comments (#) and a "fqdn,..." header line are
+  skipped.
+
+  Lines are checked chunkSize at a time; with processes > 1, chunks are
+  spread over a pool of that many worker processes.
+
+  Returns tuple (counts, errors): counts is a dict of lines, hostnames,
+  ipv4 and ipv6 seen, errors a list of (line number, value, reason) in line
+  order.
+  """
+  counts = {'lines': 0, 'hostnames': 0, 'ipv4': 0, 'ipv6': 0}
+  errors = []
+  if processes > 1:
+    pool = multiprocessing.Pool(processes)
+    results = pool.imap(_validate_chunk, _chunks(lines, chunkSize))
+  else:
+    pool = None
+    results = (_validate_chunk(chunk) for chunk in _chunks(lines, chunkSize))
+  try:
+    for chunkCounts, chunkErrors in results:
+      for key in counts:
+        counts[key] += chunkCounts[key]
+      errors.extend(chunkErrors)
+  finally:
+    if pool is not None:
+      pool.close()
+      pool.join()
+  return (counts, errors)
 
 if __name__ == "__main__":
   print "\nChallenge4 - Write a script that uses Cloud DNS to create a new A"
   print "record when passed a FQDN and IP address as arguments.\n\n"
 
   parser = argparse.ArgumentParser()
-  parser.add_argument("FQDN",  help="Fully Qualified Domain Name")
-  parser.add_argument("IP", help="IP address (IPv4 or IPv6)")
+  parser.add_argument("FQDN", nargs='?', help="Fully Qualified Domain Name")
+  parser.add_argument("IP", nargs='?', help="IP address (IPv4 or IPv6)")
   parser.add_argument("--region", default='DFW',
                       help="Region (DFW or ORD)")
+  parser.add_argument("--file", default=None,
+                      help="File listing records to create (CSV or JSON)")
+  parser.add_argument("--stdin", action="store_true",
+                      help="Read the list of records to create from stdin")
+  parser.add_argument("--reconcile", default=None, metavar="FILE",
+                      help="Make a zone match the records listed in FILE")
+  parser.add_argument("--concurrency", default=4, type=int,
+                      help="Number of DNS requests to make at once")
+  parser.add_argument("--validate", default=None, metavar="FILE",
+                      help="Check the host names and addresses in FILE")
+  parser.add_argument("--processes", default=multiprocessing.cpu_count(),
+                      type=int, help="Number of processes to validate with")
   args = parser.parse_args()
 
+  if not (args.file or args.stdin or args.reconcile or args.validate or
+          (args.FQDN and args.IP)):
+    parser.error("either FQDN and IP, --file, --stdin, --reconcile or "
+                 "--validate is required")
+
+  if args.validate:
+    try:
+      if args.validate == '-':
+        counts, errors = validate_lines(sys.stdin, args.processes)
+      else:
+        with open(os.path.expanduser(args.validate), 'r') as inventory:
+          counts, errors = validate_lines(inventory, args.processes)
+    except IOError as err:
+      print "Unable to read %s: %s" % (args.validate, err.strerror)
+      sys.exit(6)
+    for lineNo, value, reason in errors:
+      print "line %d: %s: %s" % (lineNo, reason, value)
+    print "%d lines: %d host names, %d IPv4 and %d IPv6 addresses," % (
+            counts['lines'], counts['hostnames'], counts['ipv4'],
+            counts['ipv6']),
+    print "%d errors" % len(errors)
+    sys.exit(8 if errors else 0)
+
+  if args.reconcile:
+    try:
+      zone, desired = read_zone_file(os.path.expanduser(args.reconcile))
+    except IOError as err:
+      print "Unable to read %s: %s" % (args.reconcile, err.strerror)
+      sys.exit(6)
+    except ValueError as err:
+      print err
+      sys.exit(6)
+
+  records = None
+  if args.stdin:
+    records = read_records(sys.stdin)
+  elif args.file:
+    try:
+      with open(os.path.expanduser(args.file), 'r') as source:
+        records = read_records(source)
+    except IOError as err:
+      print "Unable to read %s: %s" % (args.file, err.strerror)
+      sys.exit(6)
+
   credential_file=os.path.expanduser("~/.rackspace_cloud_credentials")
-  pyrax.set_credential_file(credential_file)
+  session.set_credential_file(credential_file)
   if c1.is_valid_region(args.region, 'compute'):
     dns = pyrax.connect_to_cloud_dns(region=args.region)
   else:
     print "The region you requested is not valid: %s" % args.region
     sys.exit(2)
 
+  if args.reconcile:
+    adds, updates, deletes, failed = reconcile_zone(dns, zone, desired,
+                                                    args.concurrency)
+    if failed:
+      print "%d changes could not be made" % len(failed)
+      sys.exit(7)
+    sys.exit(0)
+
+  if records is not None:
+    added, failed = create_dns_records(dns, records, args.concurrency)
+    print "%d DNS records added" % added
+    for FQDN, reason in failed:
+      print "%s: %s" % (FQDN, reason)
+    if failed:
+      print "%d records could not be added" % len(failed)
+      sys.exit(7)
+    sys.exit(0)
+
   if not is_valid_hostname(args.FQDN):
     print "This does not appear to be a valid host name: %s" % args.FQDN
     sys.exit(3)
@@ -146,7 +751,7 @@ if __name__ == "__main__":
   elif is_valid_ipv6_address(args.IP):
     create_dns_record(dns, args.FQDN, args.IP, 'AAAA')
   else:
-    print 'The specified IP address "%s" is not valid' % IPAddr
+    print 'The specified IP address "%s" is not valid' % args.IP
     sys.exit(4)
 
 # vim: ts=2 sw=2 tw=78 expandtab
@@ -36,6 +36,9 @@ import os
 import time
 import argparse
 import pyrax
+import session
+import waiter
+import buildhistory
 import challenge1 as c1
 
 def create_a_database(cdb, InstanceName, InstanceFlavor, VolumeSize, 
@@ -47,16 +50,28 @@ def create_a_database(cdb, InstanceName, InstanceFlavor, VolumeSize,
   """
   # Create database instance
   print "Creating database instance %s" % InstanceName
+  started = time.time()
   dbi = cdb.create(InstanceName, flavor=cdb.get_flavor(InstanceFlavor), 
                     volume=VolumeSize)
 
   # Wait for new database instance to become active
   print "Waiting for database instance build to complete..."
-  while dbi.status <> 'ACTIVE':
-    time.sleep(5)
-    dbi.get()
+  region = buildhistory.client_region(cdb)
+  volume = '%dGB' % VolumeSize
+  hint = buildhistory.predict_build_time('database', InstanceFlavor, volume,
+                                         region)
+
+  def progress():
     print '.',
 
+  status = waiter.wait_for_status(dbi, progress=progress, maximum=15,
+                                  hint=hint)
+  if status != 'ACTIVE':
+    print "\nDatabase instance build failed with status %s" % status
+    sys.exit(5)
+  buildhistory.record_build('database', InstanceFlavor, volume, region,
+                            time.time() - started)
+
   # Create database schema
   dbs = dbi.create_database(DBName)
   
@@ -98,7 +113,7 @@ if __name__ == "__main__":
   args = parser.parse_args()
 
   credential_file = os.path.expanduser("~/.rackspace_cloud_credentials")
-  pyrax.set_credential_file(credential_file)
+  session.set_credential_file(credential_file)
   if c1.is_valid_region(args.region, 'database'):
     cdb = pyrax.connect_to_cloud_databases(region=args.region)
   else:
@@ -29,41 +29,244 @@
 #   --numservers NUMSERVERS   Number of servers to create
 #   --region REGION           Region in which to create servers (DFW or ORD)
 #   --lbname                  Name for created Cloud Loadbalancer 
+#   --concurrency CONCURRENCY Number of server build requests to send at once
+#   --lbid LBID               Add the servers to this existing Loadbalancer
+#                             (new Loadbalancers take any that do not fit)
+#   --maxnodes MAXNODES       Most nodes to put on each Loadbalancer
+#   --coroutines              Drive the builds as coroutines from one thread
+#                             (see provision)
 
 import os
 import sys
 import argparse
+import threading
 import pyrax
+import session
+import waiter
 import challenge1 as c1
+from multiprocessing.pool import ThreadPool
 
-def create_lb_and_add_servers(clb, LBName, servers):
-  """Create a new CloudLoadbalancer instance and add CloudServers to
-  loadbalancing pool.
+# most nodes a Cloud Load Balancer may have (the default account limit)
+MAX_NODES_PER_LB = 25
+
+# most nodes sent in one create or add_nodes request
+NODES_PER_REQUEST = 10
+
+# statuses a load balancer is not coming back from on its own
+LB_FAILED_STATUSES = ('ERROR', 'SUSPENDED', 'PENDING_DELETE', 'DELETED')
+
+def server_node(clb, server, port=80):
+  """Return a loadbalancer Node for a CloudServer's private address"""
+  return clb.Node(address=server.networks['private'][0], port=port,
+                  condition="ENABLED")
+
+def wait_for_lb_active(lb, deadline=900):
+  """Wait for a loadbalancer to be ACTIVE again - after a create or update
+  it refuses any other change until it is.  Raises RuntimeError if it goes
+  to a status it is not coming back from.
   """
+  status = waiter.wait_for_status(lb, terminal=LB_FAILED_STATUSES,
+                                  initial=1, maximum=10, deadline=deadline)
+  if status != 'ACTIVE':
+    raise RuntimeError("Loadbalancer %s went to status %s" % (lb.name,
+                                                              status))
 
-  #create "nodes" for each cloudServer
-  node = []
-  for s in servers:
-    node.append(clb.Node(address=s.networks['private'][0], port=80))
+_lb_locks = {}
+_lb_locks_lock = threading.Lock()
 
-  # create the VIP
-  vip = clb.VirtualIP(type="PUBLIC")
+def _lb_lock(lb):
+  """Return the lock changes to lb queue up on"""
+  with _lb_locks_lock:
+    return _lb_locks.setdefault(lb.id, threading.Lock())
+
+def change_lb(lb, change, *args, **kwargs):
+  """Make a change to a loadbalancer, ie:
+
+    change_lb(lb, lb.add_health_monitor, type="CONNECT", ...)
+
+  A loadbalancer takes one change at a time, so changes made through
+  change_lb from several threads queue up behind each other (per
+  loadbalancer), and each one waits for it to be ACTIVE before it goes in.
+  Returns whatever change returned.
+  """
+  with _lb_lock(lb):
+    wait_for_lb_active(lb)
+    return change(*args, **kwargs)
 
-  # Create the LB itself
-  lb = clb.create(LBName, port=80, protocol="HTTP",
-          nodes=node, virtual_ips=[vip], algorithm='ROUND_ROBIN')
-  print "\nNew Loadbalancer %s:" % lb.name 
+def try_change_lb(lb, change, *args, **kwargs):
+  """Make a change to a loadbalancer only if it will take it right now: no
+  other change_lb is under way and it is ACTIVE.  Returns True if the
+  change was made, False if the loadbalancer was busy - including when it
+  turned the change down because something else got in first (HTTP 422).
+  """
+  lock = _lb_lock(lb)
+  if not lock.acquire(False):
+    return False
+  try:
+    lb.get()
+    if lb.status != 'ACTIVE':
+      return False
+    try:
+      change(*args, **kwargs)
+    except Exception as err:
+      if getattr(err, 'code', getattr(err, 'http_status', None)) != 422:
+        raise
+      return False
+    return True
+  finally:
+    lock.release()
+
+def add_nodes_in_chunks(lb, nodes, chunkSize=NODES_PER_REQUEST):
+  """Add nodes to an existing loadbalancer chunkSize at a time, waiting for
+  it to be ACTIVE before each request.  Nodes the loadbalancer already has
+  (same address and port) are skipped.  Returns number of nodes added.
+  """
+  wait_for_lb_active(lb)
+  have = set((n.address, int(n.port)) for n in lb.nodes)
+  nodes = [n for n in nodes if (n.address, int(n.port)) not in have]
+  for first in xrange(0, len(nodes), chunkSize):
+    change_lb(lb, lb.add_nodes, nodes[first:first + chunkSize])
+  if nodes:
+    wait_for_lb_active(lb)
+  return len(nodes)
+
+def print_lb_info(lb, title="Loadbalancer"):
+  """Print the VIP, protocol, port and nodes of a loadbalancer"""
+  print "\n%s %s:" % (title, lb.name)
   print " VIP: %s" % lb.virtual_ips[0].address
   print " protocol: %s" % lb.protocol
   print " port: %s" % lb.port
   print " Nodes:"
   for n in lb.nodes:
-    print "   addr: %s  port: %s  status: %s" % (n.address, n.port, 
+    print "   addr: %s  port: %s  status: %s" % (n.address, n.port,
                                                  n.condition)
   print "\n"
 
+def new_lb(clb, LBName, nodes):
+  """Send the request to create an HTTP CloudLoadbalancer with a public VIP
+  and the given nodes.  Returns at once, while it is still building.
+  """
+  vip = clb.VirtualIP(type="PUBLIC")
+  return clb.create(LBName, port=80, protocol="HTTP",
+          nodes=nodes, virtual_ips=[vip], algorithm='ROUND_ROBIN')
+
+def create_lb_with_nodes(clb, LBName, nodes, chunkSize=NODES_PER_REQUEST):
+  """Create a new CloudLoadbalancer with the first chunkSize nodes, then add
+  the rest chunkSize at a time once it is ACTIVE.
+  """
+  lb = new_lb(clb, LBName, nodes[:chunkSize])
+  add_nodes_in_chunks(lb, nodes[chunkSize:], chunkSize)
   return lb
 
+def add_servers_as_they_come_up(clb, lb, servers, chunkSize=NODES_PER_REQUEST):
+  """Add servers to a loadbalancer as they become usable.  servers is an
+  iterable that yields each server once it has a private IP (see
+  c1.iter_servers_with_networks).  Servers are added as they arrive
+  whenever the loadbalancer will take them right then (see try_change_lb),
+  and whatever is left once the last one has arrived is added in chunks.  Returns once the loadbalancer is
+  ACTIVE with every node.
+  """
+  pending = []
+  for srv in servers:
+    pending.append(server_node(clb, srv))
+    # add what we have so far, if the loadbalancer will take it right now
+    if try_change_lb(lb, lb.add_nodes, pending[:chunkSize]):
+      del pending[:chunkSize]
+  add_nodes_in_chunks(lb, pending, chunkSize)
+
+def create_lb_as_servers_come_up(clb, LBName, servers, on_vip=None,
+                                 chunkSize=NODES_PER_REQUEST):
+  """Create a new CloudLoadbalancer from servers as they become usable,
+  rather than after all of them are.  servers is an iterable that yields
+  each server once it has a private IP (see c1.iter_servers_with_networks).
+
+  The loadbalancer is created with the first server as its only node, and
+  on_vip(lb), if given, is called as soon as that returns - the VIP exists
+  from then on, so the caller can start on DNS.  The other servers are
+  added as they arrive (see add_servers_as_they_come_up).
+
+  Returns the ACTIVE loadbalancer, or None if no server ever came up.
+  """
+  servers = iter(servers)
+  for srv in servers:
+    lb = new_lb(clb, LBName, [server_node(clb, srv)])
+    print "\nLoadbalancer %s is building with VIP %s" % (lb.name,
+            lb.virtual_ips[0].address)
+    if on_vip is not None:
+      on_vip(lb)
+    add_servers_as_they_come_up(clb, lb, servers, chunkSize)
+    return lb
+  return None
+
+def create_lb_and_add_servers(clb, LBName, servers):
+  """Create a new CloudLoadbalancer instance and add CloudServers to
+  loadbalancing pool.
+  """
+  lb = create_lb_with_nodes(clb, LBName, [server_node(clb, s)
+                                          for s in servers])
+  lb.get()
+  print_lb_info(lb, "New Loadbalancer")
+  return lb
+
+def build_lb_fleet(clb, LBName, servers, lbID=None,
+                   maxNodes=MAX_NODES_PER_LB, chunkSize=NODES_PER_REQUEST,
+                   concurrency=4):
+  """Put a pool of CloudServers (hundreds, if need be) behind loadbalancers.
+
+  If lbID is given, servers are first added to that existing loadbalancer
+  until it holds maxNodes nodes.  The rest are spread over new loadbalancers
+  of up to maxNodes nodes each, named LBName-1, LBName-2... (or just LBName
+  if one is enough).  Nodes go in chunkSize per request, waiting for each
+  loadbalancer to be ACTIVE between requests; up to concurrency
+  loadbalancers are worked on at once.
+
+  Returns tuple (list of loadbalancers, dict of loadbalancer name -> error
+  for any that failed).
+  """
+  nodes = [server_node(clb, s) for s in servers]
+  jobs = []
+  if lbID:
+    lb = clb.get(lbID)
+    have = set((n.address, int(n.port)) for n in lb.nodes)
+    nodes = [n for n in nodes if (n.address, int(n.port)) not in have]
+    room = max(0, maxNodes - len(lb.nodes))
+    jobs.append((lb, nodes[:room]))
+    nodes = nodes[room:]
+  groups = [nodes[first:first + maxNodes]
+            for first in xrange(0, len(nodes), maxNodes)]
+  for i, group in enumerate(groups):
+    if len(groups) == 1 and not lbID:
+      jobs.append((LBName, group))
+    else:
+      jobs.append(("%s-%d" % (LBName, i + 1), group))
+
+  def run(job):
+    # job is (existing loadbalancer, nodes) or (name of new one, nodes)
+    lb, group = job
+    name = getattr(lb, 'name', lb)
+    try:
+      if isinstance(lb, basestring):
+        lb = create_lb_with_nodes(clb, lb, group, chunkSize)
+      else:
+        add_nodes_in_chunks(lb, group, chunkSize)
+      return (name, lb, None)
+    except Exception as err:
+      return (name, None, err)
+
+  lbs = []
+  failed = {}
+  pool = ThreadPool(max(1, min(concurrency, len(jobs))))
+  try:
+    for name, lb, err in pool.imap(run, jobs):
+      if err is not None:
+        failed[name] = err
+      elif lb is not None:
+        lbs.append(lb)
+  finally:
+    pool.close()
+    pool.join()
+  return (lbs, failed)
+
 if __name__ == "__main__":
   print "\nChallenge7 - Write a script that will create 2 Cloud Servers and"
   print "add them as nodes to a new Cloud Load Balancer.\n\n"
@@ -82,18 +285,31 @@ if __name__ == "__main__":
   parser.add_argument("--region", default='DFW',
                       help="Region in which to create devices (DFW or ORD)")
 
+  parser.add_argument("--concurrency", default=4, type=int,
+                      help="Number of server build requests to send at once")
+  parser.add_argument("--lbid", default=None,
+                      help="Add the servers to this existing Loadbalancer")
+  parser.add_argument("--maxnodes", default=MAX_NODES_PER_LB, type=int,
+                      help="Most nodes to put on each Loadbalancer")
+  parser.add_argument("--coroutines", action="store_true",
+                      help="Drive the builds as coroutines from one thread "
+                           "(see provision)")
   args = parser.parse_args()
+
+  if args.coroutines and (args.lbid or args.numservers > args.maxnodes):
+    print "--coroutines builds a single new Loadbalancer;",
+    print "it can't be used with --lbid or more than --maxnodes servers"
+    sys.exit(1)
              
-  credential_file=os.path.expanduser("~/.rackspace_cloud_credentials")
-  pyrax.set_credential_file(credential_file)
-  if (c1.is_valid_region(args.region, 'compute') and
-      c1.is_valid_region(args.region, 'load_balancer')):
-    cs = pyrax.connect_to_cloudservers(region=args.region)
-    clb = pyrax.connect_to_cloud_loadbalancers(region=args.region)
-  else:
+  if c1.missing_services(args.region, ['compute', 'load_balancer']):
     print "The region you requested is not valid: %s" % args.region
     sys.exit(2)
 
+  credential_file=os.path.expanduser("~/.rackspace_cloud_credentials")
+  session.set_credential_file(credential_file)
+  cs = pyrax.connect_to_cloudservers(region=args.region)
+  clb = pyrax.connect_to_cloud_loadbalancers(region=args.region)
+
   if not c1.is_valid_image(cs, args.image):
     print "This does not appear to be a valid image-uuid: %s" % args.image
     sys.exit(3)
@@ -105,11 +321,58 @@ if __name__ == "__main__":
   # unbuffer stdout for pretty output
   sys.stdout = os.fdopen(sys.stdout.fileno(), 'w', 0)
 
+  if args.coroutines:
+    # provision builds on this module, so it can't be imported at the top
+    import provision
+    names = c1.server_names(args.basename, args.numservers)
+    servers, volumes, lb, failed = provision.run(lambda p:
+            provision.build_site(p, cs, args.flavor, args.image, names,
+                                 clb=clb, LBName=args.lbname),
+            args.concurrency)
+    c1.print_servers_info(servers)
+    for name in sorted(failed):
+      print "%s failed: %s" % (name, failed[name])
+    if lb is None:
+      if 'loadbalancer' not in failed:
+        print "None of the servers came up, so no Loadbalancer was built"
+      sys.exit(5)
+    lb.get()
+    print_lb_info(lb, "New Loadbalancer")
+    sys.exit(5 if 'loadbalancer' in failed else 0)
+
   servers = c1.build_some_servers(cs, args.flavor, args.image, args.basename,
-                                args.numservers)
+                                args.numservers,
+                                concurrency=args.concurrency)
+
+  if not args.lbid and len(servers) <= args.maxnodes:
+    # one new LB will do, so start building it with the first server to get
+    # an IP instead of waiting for all of them
+    print "\nWaiting for IP addresses to be assigned..."
+    lb = create_lb_as_servers_come_up(clb, args.lbname,
+                                      c1.iter_servers_with_networks(servers))
+    c1.print_servers_info(servers)
+    if lb is None:
+      print "None of the servers came up, so no Loadbalancer was built"
+      sys.exit(5)
+    lb.get()
+    print_lb_info(lb, "New Loadbalancer")
+    sys.exit(0)
+
   c1.wait_for_server_networks(servers)
   c1.print_servers_info(servers)
 
-  lb = create_lb_and_add_servers(clb, args.lbname, servers)
+  try:
+    lbs, failed = build_lb_fleet(clb, args.lbname, servers, args.lbid,
+                                 args.maxnodes)
+  except pyrax.exceptions.NotFound:
+    print "There is no Loadbalancer with id %s" % args.lbid
+    sys.exit(6)
+  for lb in lbs:
+    lb.get()
+    print_lb_info(lb)
+  for name, err in sorted(failed.items()):
+    print "Loadbalancer %s failed: %s" % (name, err)
+  if failed:
+    sys.exit(5)
 
 # vim: ts=2 sw=2 tw=78 expandtab
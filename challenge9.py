@@ -34,6 +34,7 @@ import sys
 import os
 import argparse
 import pyrax
+import session
 import challenge1 as c1
 import challenge4 as c4
 
@@ -75,7 +76,7 @@ if __name__ == "__main__":
   args = parser.parse_args()
 
   credential_file=os.path.expanduser("~/.rackspace_cloud_credentials")
-  pyrax.set_credential_file(credential_file)
+  session.set_credential_file(credential_file)
   if c1.is_valid_region(args.region, 'compute'):
     cs = pyrax.connect_to_cloudservers(region=args.region)
     dns = pyrax.connect_to_cloud_dns(region=args.region)
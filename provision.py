@@ -0,0 +1,772 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# provision - Drive lots of resource builds (servers, volumes, networks,
+# loadbalancers, databases, DNS records, Cloud Files uploads) from one
+# process without a thread sleeping on each of them.  Blocking API calls go
+# through a small thread pool and come back as Futures; every wait on a
+# resource status is handled by one poller thread, which refreshes all the
+# servers it is watching with a single listing.  Build steps are written as
+# generator coroutines that yield Futures.  Challenges 1, 7, 10 and 11 build
+# this way when given --coroutines.  When run as a script, build servers,
+# optionally with a CBS volume each, behind a loadbalancer with a DNS
+# record for its VIP, all as coroutines.
+
+# Copyright 2013 Scott Gilbert
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+# Required Parameters:
+#  none
+#
+# Optional Parameters:
+#   -h, --help                show help message and exit
+#   --flavor FLAVOR           Flavor of servers to create
+#   --image IMAGE             Image from which to create servers
+#   --basename BASENAME       Base name to assign to new servers
+#   --numservers NUMSERVERS   Number of servers to create
+#   --region REGION           Region in which to create devices (DFW or ORD)
+#   --volumesize GB           Give each server a CBS volume of this size
+#   --lbname LBNAME           Put the servers behind a new loadbalancer
+#   --fqdn FQDN               Add a DNS A record for the loadbalancer VIP
+#   --concurrency CONCURRENCY Number of API calls to have going at once
+
+
+import os
+import sys
+import time
+import argparse
+import threading
+import pyrax
+import session
+import waiter
+import swiftapi
+import buildhistory
+import challenge1 as c1
+import challenge4 as c4
+import challenge7 as c7
+from multiprocessing.pool import ThreadPool
+
+class Return(Exception):
+  """Raise Return(value) to finish a coroutine with a value (a generator
+  can't return one in python 2).
+  """
+  def __init__(self, value=None):
+    Exception.__init__(self)
+    self.value = value
+
+class Future(object):
+  """The result of something that has not finished yet.  Set once, with
+  set_result or set_exception; callbacks added with add_done_callback are
+  called (with the Future) as soon as it is.
+  """
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._done = threading.Event()
+    self._callbacks = []
+    self._result = None
+    self._error = None
+
+  def _finish(self, result, error):
+    with self._lock:
+      if self._done.is_set():
+        return
+      self._result = result
+      self._error = error
+      self._done.set()
+      callbacks, self._callbacks = self._callbacks, []
+    for callback in callbacks:
+      callback(self)
+
+  def set_result(self, result):
+    self._finish(result, None)
+
+  def set_exception(self, error):
+    self._finish(None, error)
+
+  def done(self):
+    return self._done.is_set()
+
+  def add_done_callback(self, callback):
+    with self._lock:
+      if not self._done.is_set():
+        self._callbacks.append(callback)
+        return
+    callback(self)
+
+  def exception(self, timeout=None):
+    """Wait for the Future and return the exception it failed with, if
+    any.  Raises waiter.WaitTimeout if timeout seconds go by first.
+    """
+    started = time.time()
+    # wait a second at a time, so ctrl-c is still noticed
+    while not self._done.wait(1):
+      if timeout is not None and time.time() - started >= timeout:
+        raise waiter.WaitTimeout("Still waiting after %d seconds" % timeout)
+    return self._error
+
+  def result(self, timeout=None):
+    """Wait for the Future and return its result, or raise the exception it
+    failed with.
+    """
+    error = self.exception(timeout)
+    if error is not None:
+      raise error
+    return self._result
+
+def gather(futures, returnExceptions=False):
+  """Return a Future for the list of results of futures, in order, once all
+  of them are done.  It fails with the first exception among them, unless
+  returnExceptions is True - then exceptions take their place in the list.
+  """
+  futures = list(futures)
+  gathered = Future()
+  remaining = [len(futures)]
+  lock = threading.Lock()
+
+  def one_done(future):
+    with lock:
+      remaining[0] -= 1
+      if remaining[0]:
+        return
+    results = []
+    for f in futures:
+      if f._error is not None and not returnExceptions:
+        gathered.set_exception(f._error)
+        return
+      results.append(f._error if f._error is not None else f._result)
+    gathered.set_result(results)
+
+  if not futures:
+    gathered.set_result([])
+  for future in futures:
+    future.add_done_callback(one_done)
+  return gathered
+
+def as_completed(futures):
+  """Return a list of Futures, one for each of futures: the first is set
+  to whichever of futures is done first, the second to the next one, and
+  so on.  Yield them in turn to take futures as they finish.
+  """
+  futures = list(futures)
+  arrivals = [Future() for f in futures]
+  count = [0]
+  lock = threading.Lock()
+
+  def one_done(future):
+    with lock:
+      arrival = arrivals[count[0]]
+      count[0] += 1
+    arrival.set_result(future)
+
+  for future in futures:
+    future.add_done_callback(one_done)
+  return arrivals
+
+def _step(gen, future, send=None, error=None):
+  """Run coroutine gen until it yields a Future that is not done yet, and
+  arrange for it to carry on from there once that Future is.
+  """
+  while True:
+    try:
+      if error is not None:
+        yielded = gen.throw(error)
+      else:
+        yielded = gen.send(send)
+    except Return as ret:
+      future.set_result(ret.value)
+      return
+    except StopIteration:
+      future.set_result(None)
+      return
+    except Exception as err:
+      future.set_exception(err)
+      return
+
+    if isinstance(yielded, (list, tuple)):
+      yielded = gather(yielded)
+    if not isinstance(yielded, Future):
+      send, error = None, TypeError("coroutine yielded %r, not a Future" %
+                                    (yielded,))
+      continue
+    if not yielded.done():
+      yielded.add_done_callback(lambda f: _step(gen, future, f._result,
+                                                f._error))
+      return
+    send, error = yielded._result, yielded._error
+
+def spawn(gen):
+  """Start coroutine gen - a generator that yields Futures (or lists of
+  them) and gets each one's result back, or has its exception raised, when
+  it is done.  Returns a Future for the coroutine's own result.
+
+  A coroutine must not block: anything slow goes through Provisioner.call.
+  """
+  future = Future()
+  _step(gen, future)
+  return future
+
+class _Watch(object):
+  """One thing the poller is waiting on: test() is called after obj is
+  refreshed, until it returns something true.
+  """
+  def __init__(self, future, test, obj, batch, deadline, **kwargs):
+    self.future = future
+    self.test = test
+    self.obj = obj
+    self.batch = batch
+    self.deadline = deadline
+    self.started = time.time()
+    self.delays = waiter.intervals(**kwargs)
+    self.due = self.started + next(self.delays)
+
+class Provisioner(object):
+  """Runs blocking API calls in a pool of concurrency threads (call) and
+  waits on resources from a single poller thread (wait_for_status,
+  wait_until), handing back Futures.  Use it from coroutines (see spawn
+  and run).  Call close() when done.
+  """
+  def __init__(self, concurrency=16, refreshConcurrency=8):
+    self.pool = ThreadPool(max(1, concurrency))
+    self.refreshPool = ThreadPool(max(1, refreshConcurrency))
+    self.lock = threading.Lock()
+    self.wake = threading.Event()
+    self.watches = []
+    self.closing = False
+    self.thread = threading.Thread(target=self.poll)
+    self.thread.daemon = True
+    self.thread.start()
+
+  def call(self, fn, *args, **kwargs):
+    """Call fn(*args, **kwargs) in the thread pool.  Returns a Future for
+    what it returns.
+    """
+    future = Future()
+
+    def run():
+      try:
+        future.set_result(fn(*args, **kwargs))
+      except Exception as err:
+        future.set_exception(err)
+
+    self.pool.apply_async(run)
+    return future
+
+  def _watch(self, watch):
+    with self.lock:
+      if self.closing:
+        raise RuntimeError("Provisioner is closed")
+      self.watches.append(watch)
+    self.wake.set()
+    return watch.future
+
+  def wait_for_status(self, obj, ready=('ACTIVE',), terminal=('ERROR',),
+                      attr='status', batch=False, deadline=None, **kwargs):
+    """Return a Future for obj's status once it is in ready or terminal
+    (see waiter.wait_for_status).  Fails with waiter.WaitTimeout after
+    deadline seconds.  batch=True is for pyrax servers: all of those being
+    watched are refreshed together with one listing (see
+    challenge1.refresh_servers) rather than with a call each.  Other
+    keyword arguments are passed on to waiter.intervals.
+    """
+    def test():
+      status = getattr(obj, attr)
+      if status in ready or status in terminal:
+        return status
+      return None
+    return self._watch(_Watch(Future(), test, obj, batch, deadline,
+                              **kwargs))
+
+  def wait_until(self, check, obj=None, batch=False, deadline=None,
+                 **kwargs):
+    """Return a Future for check()'s result once it returns something true,
+    calling it on the poller's schedule (see waiter.wait_until).  If obj is
+    given it is refreshed before each check, batched with other servers if
+    batch is True (see wait_for_status).
+    """
+    return self._watch(_Watch(Future(), check, obj, batch, deadline,
+                              **kwargs))
+
+  def _check_group(self, group):
+    """Refresh the objects a group of watches are waiting on, and test
+    each watch.  Returns list of (watch, result, error).  A server deleted
+    out from under a batch only fails its own watch.
+    """
+    missing = []
+    try:
+      if group[0].batch:
+        missing = c1.refresh_servers([w.obj for w in group],
+                                     skipMissing=True)
+      elif group[0].obj is not None:
+        group[0].obj.get()
+    except Exception as err:
+      return [(w, None, err) for w in group]
+    gone = set(id(srv) for srv in missing)
+    results = []
+    for w in group:
+      if id(w.obj) in gone:
+        results.append((w, None, RuntimeError("Server %s was deleted" %
+                                              w.obj.id)))
+        continue
+      try:
+        results.append((w, w.test(), None))
+      except Exception as err:
+        results.append((w, None, err))
+    return results
+
+  def poll(self):
+    """The poller thread: check every watch that is due, resolve the ones
+    that are done and schedule the next check of the rest.
+    """
+    while True:
+      now = time.time()
+      with self.lock:
+        if self.closing:
+          return
+        due = [w for w in self.watches if w.due <= now]
+        later = [w.due for w in self.watches if w.due > now]
+      if not due:
+        self.wake.wait(min(later) - now if later else None)
+        self.wake.clear()
+        continue
+
+      groups = {}
+      for w in due:
+        key = id(w.obj.manager) if w.batch else id(w)
+        groups.setdefault(key, []).append(w)
+      finished = []
+      for results in self.refreshPool.map(self._check_group,
+                                          groups.values()):
+        for w, result, error in results:
+          if error is None and not result and w.deadline is not None and \
+             time.time() - w.started >= w.deadline:
+            error = waiter.WaitTimeout("Still waiting after %d seconds" %
+                                       w.deadline)
+          if error is not None or result:
+            finished.append((w, result, error))
+          else:
+            w.due = time.time() + next(w.delays)
+      with self.lock:
+        for w, result, error in finished:
+          self.watches.remove(w)
+      for w, result, error in finished:
+        if error is not None:
+          w.future.set_exception(error)
+        else:
+          w.future.set_result(result)
+
+  def close(self):
+    """Stop the poller and the thread pools.  Anything still being waited
+    on fails with RuntimeError.
+    """
+    with self.lock:
+      self.closing = True
+      watches, self.watches = self.watches, []
+    self.wake.set()
+    self.thread.join()
+    for w in watches:
+      w.future.set_exception(RuntimeError("Provisioner is closed"))
+    self.pool.close()
+    self.pool.join()
+    self.refreshPool.close()
+    self.refreshPool.join()
+
+def run(gen, concurrency=16):
+  """Run coroutine gen to the end with a new Provisioner and return its
+  result.  gen is a function taking the Provisioner, ie:
+
+    servers, failed = run(lambda p: build_servers(p, cs, ...))
+  """
+  p = Provisioner(concurrency)
+  try:
+    return spawn(gen(p)).result()
+  finally:
+    p.close()
+
+def wait_for_network(p, srv):
+  """Coroutine: wait for a server that is building to have a private IP
+  (see challenge1.iter_servers_with_networks).  Returns the server.
+  Raises RuntimeError if it goes to ERROR first.
+  """
+  yield p.wait_until(lambda: srv.status == 'ERROR' or
+                             bool(srv.networks.get('private')),
+                     obj=srv, batch=True, maximum=15)
+  if srv.status == 'ERROR':
+    raise RuntimeError("Server %s went to status ERROR" % srv.name)
+  raise Return(srv)
+
+def build_server(p, cs, name, image, flavor, insertFiles={}, nets={},
+                 networked=None):
+  """Coroutine: request a server (see challenge1.create_server) and wait
+  for its build to finish.  Returns the server.  Raises RuntimeError if it
+  goes to ERROR.
+
+  networked, if given, is a Future that is set to the server as soon as
+  it has a private IP - usually well before it is ACTIVE - or fails with
+  the server.
+  """
+  try:
+    srv = yield p.call(c1.create_server, cs, name, image, flavor,
+                       insertFiles, nets)
+    print "Requested build for server %s" % name
+    if networked is not None:
+      spawn(wait_for_network(p, srv)).add_done_callback(
+          lambda f: networked._finish(f._result, f._error))
+    started = time.time()
+    region = buildhistory.client_region(srv)
+    hint = buildhistory.predict_build_time('server', flavor, image, region)
+    status = yield p.wait_for_status(srv, batch=True, maximum=15, hint=hint)
+    if status != 'ACTIVE':
+      raise RuntimeError("Server %s went to status %s" % (name, status))
+  except Exception as err:
+    if networked is not None:
+      networked.set_exception(err)
+    raise
+  buildhistory.record_build('server', flavor, image, region,
+                            time.time() - started)
+  raise Return(srv)
+
+def build_servers(p, cs, flavor, image, names, insertFiles={}, nets={}):
+  """Coroutine: build a server for each name in names, all at once.
+  Returns tuple (servers, failed) - servers is the list of ACTIVE servers,
+  failed is a dict of name -> exception for the rest.
+  """
+  results = yield gather([spawn(build_server(p, cs, name, image, flavor,
+                                             insertFiles, nets))
+                          for name in names], True)
+  servers = []
+  failed = {}
+  for name, result in zip(names, results):
+    if isinstance(result, Exception):
+      failed[name] = result
+    else:
+      servers.append(result)
+  raise Return((servers, failed))
+
+def wait_for_lb(p, lb):
+  """Coroutine: wait for a loadbalancer to be ACTIVE (see
+  challenge7.wait_for_lb_active).
+  """
+  status = yield p.wait_for_status(lb, terminal=c7.LB_FAILED_STATUSES,
+                                   maximum=10, deadline=900)
+  if status != 'ACTIVE':
+    raise RuntimeError("Loadbalancer %s went to status %s" % (lb.name,
+                                                              status))
+
+def build_lb(p, clb, LBName, servers, created=None,
+             chunkSize=c7.NODES_PER_REQUEST):
+  """Coroutine: create an HTTP loadbalancer from servers as they become
+  usable, rather than after all of them are (see
+  challenge7.create_lb_as_servers_come_up).  servers is a list of Futures
+  that are each set to a server once it has a private IP (see
+  build_server); those that fail are left out.
+
+  The loadbalancer is created with the first server to come up as its only
+  node, and Future created, if given, is set to it straight away - the VIP
+  exists from then on - or to None if no server comes up.  The others are
+  added whenever the loadbalancer is ACTIVE as they arrive, and whatever is
+  left once the last one has arrived is added in chunks.  Nothing else
+  changes the loadbalancer until this is done.
+
+  Returns the loadbalancer once it is ACTIVE with every node, or None.
+  """
+  lb = None
+  pending = []
+  try:
+    for arrival in as_completed(servers):
+      done = yield arrival
+      if done._error is not None:
+        continue
+      node = c7.server_node(clb, done._result)
+      if lb is None:
+        lb = yield p.call(c7.new_lb, clb, LBName, [node])
+        print "Loadbalancer %s is building with VIP %s" % (lb.name,
+                lb.virtual_ips[0].address)
+        if created is not None:
+          created.set_result(lb)
+        continue
+      pending.append(node)
+      # add what we have so far, if the loadbalancer will take it right now
+      yield p.call(lb.get)
+      if lb.status == 'ACTIVE':
+        yield p.call(lb.add_nodes, pending[:chunkSize])
+        del pending[:chunkSize]
+  except Exception as err:
+    if created is not None:
+      created.set_exception(err)
+    raise
+  if created is not None:
+    created.set_result(None)
+  if lb is None:
+    raise Return(None)
+  while pending:
+    yield spawn(wait_for_lb(p, lb))
+    yield p.call(lb.add_nodes, pending[:chunkSize])
+    del pending[:chunkSize]
+  yield spawn(wait_for_lb(p, lb))
+  raise Return(lb)
+
+def add_lb_record(p, dns, FQDN, created):
+  """Coroutine: add DNS A record FQDN for the VIP of the loadbalancer
+  coming from Future created (see build_lb), as soon as it exists.  Returns
+  the VIP, or None if there is no loadbalancer.
+  """
+  lb = yield created
+  if lb is None:
+    raise Return(None)
+  addr = lb.virtual_ips[0].address
+  yield p.call(c4.add_dns_record, dns, FQDN, addr, 'A')
+  print "DNS record %s A %s added" % (FQDN, addr)
+  raise Return(addr)
+
+def change_lb(p, lb, change, *args, **kwargs):
+  """Coroutine: make a change to a loadbalancer, ie:
+
+    yield spawn(change_lb(p, lb, lb.add_health_monitor, type="CONNECT"))
+
+  once it is ACTIVE, and wait for it to be ACTIVE again (see
+  challenge7.change_lb).  A loadbalancer takes one change at a time, so
+  yield each change before starting the next.  Returns whatever change
+  returned.
+  """
+  yield spawn(wait_for_lb(p, lb))
+  result = yield p.call(change, *args, **kwargs)
+  yield spawn(wait_for_lb(p, lb))
+  raise Return(result)
+
+def build_volume(p, cbs, name, size, server):
+  """Coroutine: create a CBS volume of size GB and attach it to the server
+  coming from Future server (see challenge11).  The volume is created
+  straight away, without waiting for the server; if the server then fails
+  to build, the volume is deleted again.  Returns the volume.
+  """
+  vol = yield p.call(cbs.create, name=name, size=size, volume_type="SATA")
+  status = yield p.wait_for_status(vol, ready=('available',),
+                                   terminal=('error',), initial=2,
+                                   maximum=10, deadline=900)
+  if status != 'available':
+    raise RuntimeError("Volume %s went to status %s" % (name, status))
+  try:
+    srv = yield server
+  except Exception as err:
+    # nothing to attach it to, so don't leave it behind
+    try:
+      yield p.call(vol.delete)
+      print "Volume %s deleted, as its server failed" % name
+    except Exception as delErr:
+      print "Could not delete volume %s: %s" % (name, delErr)
+    raise err
+  yield p.call(vol.attach_to_instance, srv, mountpoint='/dev/xvdd')
+  status = yield p.wait_for_status(vol, ready=('in-use',),
+                                   terminal=('error',), initial=2,
+                                   maximum=10, deadline=900)
+  if status != 'in-use':
+    raise RuntimeError("Volume %s went to status %s" % (name, status))
+  raise Return(vol)
+
+def build_network(p, cn, name, cidr):
+  """Coroutine: create an isolated Cloud Network (see challenge11).
+  Returns tuple (network, nets) - nets is what to give servers built on it
+  (see build_servers): the public and private networks and this one.
+  """
+  network = yield p.call(cn.create, name, cidr=cidr)
+  print "Cloud Network %s created on %s" % (name, cidr)
+  raise Return((network, network.get_server_networks(public=True,
+                                                     private=True)))
+
+def store_file(p, cf, container, path, name=None):
+  """Coroutine: upload the file path to a Cloud Files container, created
+  if need be (see challenge10's backup of the error page).  The object is
+  named after the file unless name is given.  Returns its etag.
+  """
+  cont = yield p.call(cf.create_container, container)
+  storageURL, token = swiftapi.storage_endpoint(cf)
+  etag = yield p.call(swiftapi.put_file, storageURL, token, cont.name,
+                      name or os.path.basename(path), path)
+  print "%s stored in Cloud Files container %s" % (path, cont.name)
+  raise Return(etag)
+
+def build_database(p, cdb, name, flavor, volumeSize, dbName=None,
+                   userName=None):
+  """Coroutine: create a Cloud Databases instance (see challenge5) and wait
+  for it to be ACTIVE, then create database dbName on it and user userName
+  with a random password and access to dbName, if those are given.
+  Returns tuple (instance, password - None if no user was created).
+  Raises RuntimeError if the instance build fails.
+  """
+  region = buildhistory.client_region(cdb)
+  volume = '%dGB' % volumeSize
+  hint = buildhistory.predict_build_time('database', flavor, volume, region)
+  dbi = yield p.call(lambda: cdb.create(name, flavor=cdb.get_flavor(flavor),
+                                        volume=volumeSize))
+  print "Requested build for database instance %s" % name
+  started = time.time()
+  status = yield p.wait_for_status(dbi, maximum=15, hint=hint)
+  if status != 'ACTIVE':
+    raise RuntimeError("Database instance %s went to status %s" % (name,
+                                                                   status))
+  buildhistory.record_build('database', flavor, volume, region,
+                            time.time() - started)
+  if dbName:
+    yield p.call(dbi.create_database, dbName)
+  password = None
+  if userName:
+    password = pyrax.utils.random_name(10, ascii_only=True)
+    yield p.call(dbi.create_user, userName, password, database_names=dbName)
+  raise Return((dbi, password))
+
+def build_site(p, cs, flavor, image, names, insertFiles={}, nets={},
+               cbs=None, volumeSize=0, clb=None, LBName=None, monitor=False,
+               errorPage=None, cert=None, key=None, dns=None, FQDN=None):
+  """Coroutine: build a server for each name (with insertFiles and nets,
+  see build_servers), each with a CBS volume if volumeSize is given, all
+  at the same time.  If LBName is given, a new loadbalancer is built from
+  the servers as they get their private IPs (see build_lb), with a DNS A
+  record FQDN for its VIP as soon as there is one, if FQDN is given.  Once
+  it has every server, it gets a CONNECT health monitor if monitor is
+  True, the custom error page errorPage (html) if given, and SSL
+  termination with cert and key if given - one change after another.
+
+  That is challenge7, and challenge11 once its network is built (see
+  build_network); challenge10 also backs its error page up with
+  store_file alongside this.
+
+  Returns tuple (servers, volumes, lb, failed) - failed is a dict of
+  server or volume name, 'loadbalancer' or 'dns' -> exception.  Whatever
+  was built is returned even if something else failed.
+  """
+  networked = [Future() for name in names]
+  serverFutures = [spawn(build_server(p, cs, name, image, flavor,
+                                      insertFiles, nets, ready))
+                   for name, ready in zip(names, networked)]
+  lbFuture = record = None
+  if LBName:
+    created = Future()
+    lbFuture = spawn(build_lb(p, clb, LBName, networked, created))
+    if FQDN:
+      record = spawn(add_lb_record(p, dns, FQDN, created))
+  volumeFutures = []
+  if volumeSize:
+    volumeFutures = [spawn(build_volume(p, cbs, "%s-vol" % name, volumeSize,
+                                        server))
+                     for name, server in zip(names, serverFutures)]
+  results = yield gather(serverFutures + volumeFutures, True)
+
+  failed = {}
+  servers = []
+  volumes = []
+  for name, result in zip(names + ["%s-vol" % n for n in names], results):
+    if isinstance(result, Exception):
+      failed[name] = result
+    elif name in names:
+      servers.append(result)
+    else:
+      volumes.append(result)
+
+  lb = None
+  if lbFuture is not None:
+    try:
+      lb = yield lbFuture
+      if lb is not None and monitor:
+        yield spawn(change_lb(p, lb, lb.add_health_monitor, type="CONNECT",
+                              delay=5, timeout=2,
+                              attemptsBeforeDeactivation=1))
+        print "Loadbalancer monitor added"
+      if lb is not None and errorPage:
+        yield spawn(change_lb(p, lb, lb.set_error_page, errorPage))
+        print "Loadbalancer error page set"
+      if lb is not None and cert:
+        yield spawn(change_lb(p, lb, lb.add_ssl_termination, securePort=443,
+                              enabled=True, secureTrafficOnly=False,
+                              certificate=cert, privatekey=key))
+        print "Loadbalancer SSL termination added"
+    except Exception as err:
+      failed['loadbalancer'] = err
+      if lb is None and created.done() and created._error is None:
+        lb = created._result
+  if record is not None:
+    try:
+      yield record
+    except Exception as err:
+      failed['dns'] = err
+  raise Return((servers, volumes, lb, failed))
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--flavor", default=2,
+                      help="Flavor of servers to create")
+  parser.add_argument("--image", help="Image from which to create servers",
+                      default='c195ef3b-9195-4474-b6f7-16e5bd86acd0')
+  parser.add_argument("--basename", default='web',
+                      help="Base name to assign to new servers")
+  parser.add_argument("--numservers", default=3, type=int,
+                      help="Number of servers to create")
+  parser.add_argument("--region", default='DFW',
+                      help="Region in which to create devices (DFW or ORD)")
+  parser.add_argument("--volumesize", default=0, type=int,
+                      help="Give each server a CBS volume of this many GB")
+  parser.add_argument("--lbname", default=None,
+                      help="Put the servers behind a new loadbalancer")
+  parser.add_argument("--fqdn", default=None,
+                      help="Add a DNS A record for the loadbalancer VIP")
+  parser.add_argument("--concurrency", default=16, type=int,
+                      help="Number of API calls to have going at once")
+  args = parser.parse_args()
+
+  if args.fqdn and not args.lbname:
+    print "--fqdn needs a loadbalancer (--lbname)"
+    sys.exit(1)
+  if args.volumesize and not 100 <= args.volumesize <= 1024:
+    print 'The specified volume size is not valid: %s' % args.volumesize
+    sys.exit(1)
+
+  credential_file=os.path.expanduser("~/.rackspace_cloud_credentials")
+  session.set_credential_file(credential_file)
+
+  if not c1.is_valid_region(args.region, 'compute'):
+    print "The region you requested is not valid: %s" % args.region
+    sys.exit(2)
+  cs = pyrax.connect_to_cloudservers(region=args.region)
+  cbs = pyrax.connect_to_cloud_blockstorage(region=args.region)
+  clb = pyrax.connect_to_cloud_loadbalancers(region=args.region)
+  dns = pyrax.connect_to_cloud_dns(region=args.region)
+
+  if not c1.is_valid_image(cs, args.image):
+    print "This does not appear to be a valid image-uuid: %s" % args.image
+    sys.exit(3)
+
+  if not c1.is_valid_flavor(cs, args.flavor):
+    print "This does not appear to be a valid flavor-id: %s" % args.flavor
+    sys.exit(4)
+
+  # unbuffer stdout for pretty output
+  sys.stdout = os.fdopen(sys.stdout.fileno(), 'w', 0)
+
+  started = time.time()
+  names = c1.server_names(args.basename, args.numservers)
+  servers, volumes, lb, failed = run(lambda p: build_site(p, cs, args.flavor,
+          args.image, names, cbs=cbs, volumeSize=args.volumesize, clb=clb,
+          LBName=args.lbname, dns=dns, FQDN=args.fqdn), args.concurrency)
+
+  c1.print_servers_info(servers)
+  for vol in volumes:
+    print "Volume %s attached" % vol.name
+  if lb is not None:
+    c7.print_lb_info(lb)
+  for name in sorted(failed):
+    print "%s failed: %s" % (name, failed[name])
+  print "Finished in %.0f seconds" % (time.time() - started)
+  if failed:
+    sys.exit(5)
+
+# vim: ts=2 sw=2 tw=78 expandtab
@@ -0,0 +1,386 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# serverpool - Keep a few ACTIVE Cloud Servers of a given flavor and image
+# built ahead of time under placeholder names, so that a request for servers
+# (ie: challenge1, called by the challenge12 mail route) can be answered by
+# renaming servers that are already up instead of waiting for new builds.
+# The pool is topped back up in the background as servers are handed out.
+# When run as a script, hand out servers from the pool the way challenge1
+# builds them.
+
+# Copyright 2013 Scott Gilbert
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+# Required Parameters:
+#  none
+#
+# Optional Parameters:
+#   -h, --help                show help message and exit
+#   --flavor FLAVOR           Flavor of servers to create
+#   --image IMAGE             Image from which to create servers
+#   --basename BASENAME       Base name to assign to new servers
+#   --numservers NUMSERVERS   Number of servers to hand out
+#   --region REGION           Region in which to create servers (DFW or ORD)
+#   --poolsize POOLSIZE       Number of servers to keep ready in the pool
+#   --ttl MINUTES             Servers left in the pool longer than this are
+#                             deleted and replaced (0 means never)
+#   --concurrency CONCURRENCY Number of server build requests to send at once
+#   --drain                   Delete every server in the pool and exit
+
+
+import os
+import sys
+import time
+import random
+import string
+import calendar
+import argparse
+import threading
+import collections
+import pyrax
+import session
+import challenge1 as c1
+import buildhistory
+
+# servers waiting in the pool are named this, followed by a build stamp
+POOL_PREFIX = "pool-"
+
+# seconds a server may wait in the pool before it is replaced
+DEFAULT_TTL = 24 * 60 * 60
+
+# seconds between checks on the servers the pool is building
+POLL_INTERVAL = 10
+
+# number of most recent requests the time-to-serve percentiles come from
+RECENT_REQUESTS = 1000
+
+def created_time(srv):
+  """Return when srv was created, in seconds since the epoch, or None if
+  its created timestamp can't be read.
+  """
+  try:
+    return calendar.timegm(time.strptime(srv.created, "%Y-%m-%dT%H:%M:%SZ"))
+  except (AttributeError, TypeError, ValueError):
+    return None
+
+def random_password(length=16):
+  """Return a random password of letters and digits"""
+  rand = random.SystemRandom()
+  return "".join(rand.choice(string.ascii_letters + string.digits)
+                 for i in xrange(length))
+
+class ServerPool(object):
+  """A pool of size ready-built servers of one flavor and image.  Call
+  start() to have a background thread watch the builds and keep the pool
+  full, and get() to take a server out of it.
+  """
+  def __init__(self, cs, flavor, image, size, ttl=DEFAULT_TTL,
+               concurrency=4, prefix=POOL_PREFIX):
+    self.cs = cs
+    self.flavor = flavor
+    self.image = image
+    self.size = size
+    self.ttl = ttl
+    self.concurrency = concurrency
+    self.prefix = prefix
+    self.ready = collections.deque()   # (time it went ACTIVE, server)
+    self.building = {}                 # server id -> server
+    self.waiting = 0
+    self.cond = threading.Condition()
+    self.refilling = threading.Lock()
+    self.wake = threading.Event()
+    self.stopping = threading.Event()
+    self.thread = None
+    self.requests = 0
+    self.hits = 0
+    self.serveTimes = collections.deque(maxlen=RECENT_REQUESTS)
+
+  def is_pool_server(self, srv):
+    """True if srv is a placeholder server of our flavor and image"""
+    # a server booted from a volume has no image ("" rather than a dict)
+    image = srv.image and srv.image['id']
+    return (srv.name.startswith(self.prefix) and bool(image) and
+            str(srv.flavor['id']) == str(self.flavor) and
+            str(image) == str(self.image))
+
+  def adopt(self):
+    """Take over placeholder servers left behind by an earlier run.  As far
+    as ttl goes, the ready ones have been in the pool since they were
+    created.  Returns how many were found.
+    """
+    found = [srv for srv in self.cs.servers.list()
+             if self.is_pool_server(srv)]
+    now = time.time()
+    failed = []
+    with self.cond:
+      for srv in found:
+        if srv.status == 'ACTIVE':
+          self.ready.append((min(created_time(srv) or now, now), srv))
+        elif srv.status == 'ERROR':
+          failed.append(srv)
+        else:
+          self.building[srv.id] = srv
+      # oldest first, the order check() expires them in
+      self.ready = collections.deque(sorted(self.ready, key=lambda r: r[0]))
+      self.cond.notify_all()
+    for srv in failed:
+      self.discard(srv)
+    return len(found) - len(failed)
+
+  def refill(self):
+    """Request builds for however many servers it takes to get the pool
+    (ready plus building) back up to size, plus one for each request
+    waiting on an empty pool.  Returns list of the servers requested.
+    """
+    with self.refilling:
+      with self.cond:
+        needed = (self.size + self.waiting - len(self.ready) -
+                  len(self.building))
+      if needed <= 0:
+        return []
+      baseName = "%s%x" % (self.prefix, int(time.time() * 1000))
+      if needed > 1:
+        baseName += "-"
+      servers = c1.build_some_servers(self.cs, self.flavor, self.image,
+                                      baseName, needed,
+                                      concurrency=self.concurrency)
+      with self.cond:
+        for srv in servers:
+          self.building[srv.id] = srv
+      return servers
+
+  def check(self):
+    """Refresh the servers still building: move the ACTIVE ones into the
+    pool and throw away any that went to ERROR.  Servers that have been
+    ready for longer than ttl are thrown away too, and any that have been
+    deleted behind the pool's back are forgotten.
+    """
+    with self.cond:
+      building = self.building.values()
+    gone = c1.refresh_servers(building, skipMissing=True)
+    now = time.time()
+    unwanted = []
+    with self.cond:
+      for srv in gone:
+        print "Pool server %s no longer exists" % srv.name
+        self.building.pop(srv.id, None)
+      for srv in building:
+        if srv in gone:
+          continue
+        if srv.status == 'ACTIVE':
+          del self.building[srv.id]
+          self.ready.append((now, srv))
+        elif srv.status == 'ERROR':
+          print "Pool server %s went to status ERROR" % srv.name
+          del self.building[srv.id]
+          unwanted.append(srv)
+      while self.ttl and self.ready and now - self.ready[0][0] > self.ttl:
+        unwanted.append(self.ready.popleft()[1])
+      self.cond.notify_all()
+    for srv in unwanted:
+      self.discard(srv)
+
+  def discard(self, srv):
+    """Delete a server we no longer want in the pool"""
+    try:
+      srv.delete()
+    except Exception as err:
+      print "Could not delete pool server %s: %s" % (srv.name, err)
+
+  def maintain(self):
+    """Keep the pool full until stop() is called.  Runs in the background
+    thread; get() wakes it up early whenever a server is taken.
+    """
+    while not self.stopping.is_set():
+      try:
+        self.check()
+        self.refill()
+      except Exception as err:
+        print "Server pool: %s" % err
+      self.wake.wait(POLL_INTERVAL)
+      self.wake.clear()
+
+  def start(self):
+    """Start keeping the pool full in a background thread"""
+    self.thread = threading.Thread(target=self.maintain)
+    self.thread.daemon = True
+    self.thread.start()
+
+  def stop(self, drain=False):
+    """Stop the background thread.  If drain is True, also delete every
+    server in the pool, ready or still building.
+    """
+    self.stopping.set()
+    self.wake.set()
+    if self.thread is not None:
+      self.thread.join()
+      self.thread = None
+    if drain:
+      with self.cond:
+        servers = ([srv for since, srv in self.ready] +
+                   self.building.values())
+        self.ready.clear()
+        self.building.clear()
+      for srv in servers:
+        print "Deleting pool server %s" % srv.name
+        self.discard(srv)
+
+  def get(self, name, timeout=None):
+    """Take a server out of the pool, waiting for one to finish building if
+    the pool is empty, and rename it to name.  Servers adopted from an
+    earlier run have their root password reset, so every server handed out
+    has an adminPass.  Servers deleted behind the pool's back are skipped.
+
+    Returns the server, or None if timeout seconds went by without one
+    becoming ready.
+    """
+    started = time.time()
+    with self.cond:
+      self.requests += 1
+      if self.ready:
+        self.hits += 1
+
+    while True:
+      taken = self._take(started, timeout)
+      if taken is None:
+        return None
+      since, srv = taken
+      self.wake.set()
+      try:
+        srv.update(name=name)
+        if not getattr(srv, 'adminPass', None):
+          password = random_password()
+          srv.change_password(password)
+          srv.adminPass = password
+        break
+      except pyrax.exceptions.NotFound:
+        # deleted behind the pool's back; try the next one
+        print "Pool server %s no longer exists" % srv.name
+      except Exception:
+        with self.cond:
+          self.ready.appendleft((since, srv))
+          self.cond.notify_all()
+        raise
+    srv.name = name
+    with self.cond:
+      self.serveTimes.append(time.time() - started)
+    return srv
+
+  def _take(self, started, timeout):
+    """Take the oldest ready server out of the pool, waiting for one if need
+    be.  Returns tuple (time it went ACTIVE, server), or None once timeout
+    seconds have gone by since started.
+    """
+    with self.cond:
+      if not self.ready:
+        self.waiting += 1
+        self.wake.set()
+        try:
+          while not self.ready:
+            if timeout is not None and time.time() - started >= timeout:
+              return None
+            # wait with a timeout, so ctrl-c is still noticed
+            self.cond.wait(1)
+        finally:
+          self.waiting -= 1
+      return self.ready.popleft()
+
+  def stats(self):
+    """Return dict of how the pool has done so far: requests, hits,
+    hitRate, p50 and p95 time-to-serve (seconds), ready and building.
+    """
+    with self.cond:
+      times = list(self.serveTimes)
+      return {"requests": self.requests, "hits": self.hits,
+              "hitRate": float(self.hits) / self.requests
+                         if self.requests else 0.0,
+              "p50": buildhistory.percentile(times, 50) or 0.0,
+              "p95": buildhistory.percentile(times, 95) or 0.0,
+              "ready": len(self.ready), "building": len(self.building)}
+
+  def print_stats(self):
+    """Print a one line summary of stats()"""
+    stats = self.stats()
+    print ("Pool: %(requests)d requests, %(hits)d served from the pool "
+           "(%(hitRate).0f%%), time to serve p50 %(p50).1fs "
+           "p95 %(p95).1fs; %(ready)d ready, %(building)d building" %
+           dict(stats, hitRate=stats['hitRate'] * 100))
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--flavor", default=2,
+                      help="Flavor of servers to create")
+  parser.add_argument("--image", help="Image from which to create servers",
+                      default='c195ef3b-9195-4474-b6f7-16e5bd86acd0')
+  parser.add_argument("--basename", default='web',
+                      help="Base name to assign to new servers")
+  parser.add_argument("--numservers", default=3, type=int,
+                      help="Number of servers to hand out")
+  parser.add_argument("--region", default='DFW',
+                      help="Region in which to create servers (DFW or ORD)")
+  parser.add_argument("--poolsize", default=3, type=int,
+                      help="Number of servers to keep ready in the pool")
+  parser.add_argument("--ttl", default=DEFAULT_TTL / 60, type=int,
+                      help="Servers left in the pool longer than this many "
+                      "minutes are deleted and replaced (0 means never)")
+  parser.add_argument("--concurrency", default=4, type=int,
+                      help="Number of server build requests to send at once")
+  parser.add_argument("--drain", action="store_true",
+                      help="Delete every server in the pool and exit")
+  args = parser.parse_args()
+
+  credential_file=os.path.expanduser("~/.rackspace_cloud_credentials")
+  session.set_credential_file(credential_file)
+
+  if c1.is_valid_region(args.region, 'compute'):
+    cs = pyrax.connect_to_cloudservers(region=args.region)
+  else:
+    print "The region you requested is not valid: %s" % args.region
+    sys.exit(2)
+
+  if not c1.is_valid_image(cs, args.image):
+    print "This does not appear to be a valid image-uuid: %s" % args.image
+    sys.exit(3)
+
+  if not c1.is_valid_flavor(cs, args.flavor):
+    print "This does not appear to be a valid flavor-id: %s" % args.flavor
+    sys.exit(4)
+
+  # unbuffer stdout for pretty output
+  sys.stdout = os.fdopen(sys.stdout.fileno(), 'w', 0)
+
+  pool = ServerPool(cs, args.flavor, args.image, args.poolsize,
+                    args.ttl * 60, args.concurrency)
+  print "Found %d servers already in the pool" % pool.adopt()
+  if args.drain:
+    pool.stop(drain=True)
+    sys.exit(0)
+
+  pool.start()
+  servers = []
+  for name in c1.server_names(args.basename, args.numservers):
+    srv = pool.get(name)
+    print "Handing out %s as %s" % (srv.id, name)
+    servers.append(srv)
+  c1.wait_for_server_networks(servers)
+  c1.print_servers_info(servers)
+
+  # Make sure the pool is being topped back up before we go; the builds
+  # carry on without us and the next run adopts them.
+  pool.refill()
+  pool.stop()
+  pool.print_stats()
+
+# vim: ts=2 sw=2 tw=78 expandtab
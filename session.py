@@ -0,0 +1,306 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# session - Authenticate once and share it: the token and service catalog
+# from the last authentication are cached on disk until shortly before the
+# token expires, so back to back script runs skip the identity round trip,
+# and pyrax's HTTP calls go through one requests.Session per process, so
+# connections to each endpoint are kept alive and reused.  If a cached token
+# is refused (revoked, say) we authenticate again and retry.  When run as a
+# script, show what is cached, authenticating first if need be.
+
+# Copyright 2013 Scott Gilbert
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+# Required Parameters:
+#   none
+#
+# Optional Parameters:
+#   -h, --help                show help message and exit
+#   --clear                   Forget the cached session
+#   --cachefile FILE          Session cache file to use
+
+
+import os
+import re
+import time
+import json
+import calendar
+import argparse
+import threading
+import requests
+import pyrax
+
+CREDENTIAL_FILE = os.path.expanduser("~/.rackspace_cloud_credentials")
+
+SESSION_CACHE = os.path.expanduser("~/.rackspace_session")
+
+# a cached token is not used if it expires within this many seconds
+EXPIRY_MARGIN = 300
+
+# connections kept open to each host - enough for our biggest thread pools
+POOL_SIZE = 32
+
+# how many times we really authenticated, in this process
+authCalls = 0
+
+_lock = threading.Lock()
+_sessions = {}
+
+# pid -> what a token restored from the cache came from, in case it is
+# refused and we need to authenticate after all (see _reauthenticate)
+_restored = {}
+_reauthLock = threading.RLock()
+
+# a token's expiry time, as Identity gives it: 2013-08-14T17:34:39.000-05:00
+_EXPIRES = re.compile(r"(\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d)(?:\.\d+)?"
+                      r"(Z|[+-]\d\d:?\d\d)?$")
+
+def http_session():
+  """Return the requests.Session for this process.  Sessions are not shared
+  across a fork (ie: challenge13's per-region worker processes), since the
+  open connections would be.
+  """
+  pid = os.getpid()
+  with _lock:
+    if pid not in _sessions:
+      http = requests.Session()
+      adapter = requests.adapters.HTTPAdapter(pool_connections=POOL_SIZE,
+                                              pool_maxsize=POOL_SIZE)
+      http.mount('https://', adapter)
+      http.mount('http://', adapter)
+      _sessions[pid] = http
+    return _sessions[pid]
+
+def connection_stats():
+  """Return tuple (connections opened, requests made) over this process's
+  session, for seeing how well connections are being reused.
+  """
+  opened = made = 0
+  # the same adapter is mounted for http and https
+  adapters = dict((id(a), a) for a in http_session().adapters.values())
+  for adapter in adapters.values():
+    for key in adapter.poolmanager.pools.keys():
+      pool = adapter.poolmanager.pools[key]
+      opened += pool.num_connections
+      made += pool.num_requests
+  return (opened, made)
+
+def share_http_session():
+  """Route pyrax's own HTTP calls through http_session() rather than a new
+  connection per request.  Quietly does nothing with a pyrax that does not
+  make its calls through pyrax.http.
+  """
+  try:
+    import pyrax.http
+    methods = pyrax.http.req_methods
+  except (ImportError, AttributeError):
+    return
+
+  def through_session(method):
+    def request(*args, **kwargs):
+      resp = http_session().request(method, *args, **kwargs)
+      if resp.status_code == 401:
+        headers = kwargs.get('headers') or {}
+        token = _reauthenticate(headers.get('X-Auth-Token'))
+        if token is not None:
+          kwargs['headers'] = dict(headers, **{'X-Auth-Token': token})
+          resp = http_session().request(method, *args, **kwargs)
+      return resp
+    return request
+
+  for method in methods.keys():
+    methods[method] = through_session(method)
+
+def credentials_key(credentialFile):
+  """Identify the credentials something cached belongs to: the credential
+  file and when it last changed.
+  """
+  return "%s:%d" % (os.path.abspath(credentialFile),
+                    os.path.getmtime(credentialFile))
+
+def expiry_time(expires):
+  """Turn a token's expiry time as Identity gives it, ie:
+  2013-08-14T17:34:39.000-05:00 or 2013-08-14T22:34:39Z, into seconds since
+  the epoch.  One with no UTC offset is taken to be UTC.  Returns None if
+  expires is not in that form.
+  """
+  match = _EXPIRES.match(expires if isinstance(expires, basestring) else "")
+  if match is None:
+    return None
+  when = calendar.timegm(time.strptime(match.group(1), "%Y-%m-%dT%H:%M:%S"))
+  offset = match.group(2)
+  if offset and offset != 'Z':
+    digits = offset[1:].replace(':', '')
+    seconds = int(digits[:2]) * 3600 + int(digits[2:]) * 60
+    when -= seconds if offset[0] == '+' else -seconds
+  return when
+
+def token_expires(auth):
+  """Return the expiry time string from an authentication response, or None
+  if it has none.
+  """
+  try:
+    return auth['access']['token']['expires']
+  except (KeyError, TypeError):
+    return None
+
+def load_cached_auth(credentialFile, cacheFile=SESSION_CACHE):
+  """Return the cached authentication response for credentialFile, or None
+  if there is none, it is for other credentials or its token is about to
+  expire.
+  """
+  try:
+    with open(cacheFile, 'r') as cache:
+      cached = json.load(cache)
+    if cached.get('key') != credentials_key(credentialFile):
+      return None
+  except (IOError, OSError, ValueError):
+    return None
+  expires = expiry_time(cached.get('expires'))
+  if expires is None or expires - EXPIRY_MARGIN < time.time():
+    return None
+  return cached.get('auth')
+
+def save_cached_auth(credentialFile, auth, expires, cacheFile=SESSION_CACHE):
+  """Cache an authentication response, with the expiry time of its token as
+  Identity gave it (see expiry_time).  It holds a token, so only we can read
+  the file.  A failure to write the cache never gets in the way.
+  """
+  try:
+    entry = {"key": credentials_key(credentialFile), "expires": expires,
+             "auth": auth}
+    fd = os.open(cacheFile, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0600)
+    with os.fdopen(fd, 'w') as cache:
+      json.dump(entry, cache)
+  except (IOError, OSError):
+    pass
+
+def clear_cached_auth(cacheFile=SESSION_CACHE):
+  """Forget the cached session, if there is one"""
+  try:
+    os.remove(cacheFile)
+  except OSError:
+    pass
+
+def _identity():
+  """Return pyrax's identity object, creating it if need be"""
+  if pyrax.identity is None:
+    pyrax._create_identity()
+  return pyrax.identity
+
+def _restore(auth, credentialFile, region):
+  """Set pyrax up from a cached authentication response, the way
+  pyrax.set_credential_file would after authenticating.
+  """
+  identity = _identity()
+  identity.set_credential_file(credentialFile, region=region)
+  identity._parse_response(auth)
+  identity.authenticated = True
+  pyrax.regions = tuple(identity.regions)
+  pyrax.services = tuple(identity.services.keys())
+  pyrax.connect_to_services(region=region)
+
+def _authenticate(credentialFile, region, cacheFile):
+  """Authenticate with pyrax.set_credential_file and cache the result"""
+  global authCalls
+  # keep hold of the raw response pyrax parses, that is what we cache
+  identity = _identity()
+  captured = {}
+  parse = identity._parse_response
+
+  def capture(resp):
+    captured['auth'] = resp
+    return parse(resp)
+
+  identity._parse_response = capture
+  try:
+    pyrax.set_credential_file(credentialFile, region=region)
+  finally:
+    del identity._parse_response
+  authCalls += 1
+  expires = token_expires(captured.get('auth'))
+  if expiry_time(expires) is not None:
+    save_cached_auth(credentialFile, captured['auth'], expires, cacheFile)
+
+def _reauthenticate(token):
+  """A request made with token was refused.  If that is the token restored
+  from the cache, it was no good after all (revoked, or the credentials
+  changed without the file doing so): forget the cache, authenticate and
+  return the new token to retry with.  Otherwise return None - the refusal
+  stands.  Requests that all fail with the cached token at once share the
+  one authentication.
+  """
+  if token is None:
+    return None
+  with _reauthLock:
+    restored = _restored.get(os.getpid())
+    if restored is None or token != restored['token']:
+      return None
+    if not restored['renewed']:
+      clear_cached_auth(restored['cacheFile'])
+      _authenticate(restored['credentialFile'], restored['region'],
+                    restored['cacheFile'])
+      restored['renewed'] = True
+    return _identity().token
+
+def set_credential_file(credentialFile, region=None, cacheFile=SESSION_CACHE):
+  """Use in place of pyrax.set_credential_file.  Sets pyrax up from the
+  cached session when there is a good one, otherwise authenticates and
+  caches the result.  Either way, pyrax's HTTP calls share this process's
+  connections (see share_http_session), and if the cached token turns out
+  to be refused, the first call it fails re-authenticates and is retried.
+  """
+  share_http_session()
+  auth = load_cached_auth(credentialFile, cacheFile)
+  if auth is not None:
+    try:
+      _restore(auth, credentialFile, region)
+      with _reauthLock:
+        _restored[os.getpid()] = {"token": _identity().token,
+                                  "credentialFile": credentialFile,
+                                  "region": region, "cacheFile": cacheFile,
+                                  "renewed": False}
+      return
+    except Exception:
+      # cache from a different pyrax, or otherwise unusable: authenticate
+      pass
+  with _reauthLock:
+    _restored.pop(os.getpid(), None)
+  _authenticate(credentialFile, region, cacheFile)
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--clear", action="store_true",
+                      help="Forget the cached session")
+  parser.add_argument("--cachefile", default=SESSION_CACHE,
+                      help="Session cache file to use")
+  args = parser.parse_args()
+
+  if args.clear:
+    clear_cached_auth(args.cachefile)
+    print "Cached session cleared"
+  else:
+    started = time.time()
+    set_credential_file(CREDENTIAL_FILE, cacheFile=args.cachefile)
+    opened, made = connection_stats()
+    print "Ready in %.2f seconds, with %d identity call%s" % (
+            time.time() - started, authCalls, "" if authCalls == 1 else "s")
+    print "%d connection%s opened for %d request%s" % (opened,
+            "" if opened == 1 else "s", made, "" if made == 1 else "s")
+    print "Token expires: %s" % pyrax.identity.expires
+    print "Regions: %s" % ", ".join(sorted(pyrax.regions))
+    print "Services: %s" % ", ".join(sorted(pyrax.services))
+
+# vim: ts=2 sw=2 tw=78 expandtab
@@ -0,0 +1,391 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# swiftapi - A few CloudFiles (Swift) calls made directly against the storage
+# URL, for the things pyrax does one request at a time or not at all: paging
+# through big listings, deleting objects in bulk, uploading objects from
+# many threads at once and streaming big files up in segments.
+
+# Copyright 2013 Scott Gilbert
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+import os
+import time
+import json
+import urllib
+import hashlib
+import requests
+import session
+from multiprocessing.pool import ThreadPool
+
+# most paths the bulk-delete middleware accepts in one request
+BULK_DELETE_MAX = 10000
+
+# most names Swift hands back in one listing
+LISTING_LIMIT = 10000
+
+# files bigger than this are uploaded as a Static Large Object, in segments
+# of this size
+SEGMENT_SIZE = 100 * 1024 * 1024
+
+# most segments a Static Large Object manifest may list
+SLO_MAX_SEGMENTS = 1000
+
+# how much of a segment is read from disk at a time
+READ_SIZE = 64 * 1024
+
+def storage_endpoint(cf):
+  """Given a pyrax CloudFiles client, return tuple (storage_url, token)"""
+  return (cf.connection.url, cf.connection.token)
+
+def quote(name):
+  """URL quote a container or object name (which may be unicode)"""
+  if isinstance(name, unicode):
+    name = name.encode('utf-8')
+  return urllib.quote(name)
+
+def _request(method, url, token, **kwargs):
+  """Make a request against the storage URL and raise requests.HTTPError if
+  it did not work out.
+  """
+  headers = kwargs.pop('headers', {})
+  headers['X-Auth-Token'] = token
+  resp = session.http_session().request(method, url, headers=headers,
+                                        **kwargs)
+  resp.raise_for_status()
+  return resp
+
+def _iter_listing(url, token, prefix, limit, key):
+  """Page through a JSON listing with limit/marker, yielding entries as
+  each page arrives.
+  """
+  marker = None
+  while True:
+    params = {'format': 'json', 'limit': limit}
+    if prefix:
+      params['prefix'] = prefix
+    if marker is not None:
+      params['marker'] = marker
+    resp = _request('GET', url, token, params=params)
+    page = json.loads(resp.text) if resp.status_code != 204 else []
+    for entry in page:
+      yield entry
+    if len(page) < limit:
+      return
+    marker = page[-1][key]
+
+def iter_containers(storageURL, token, prefix=None, limit=LISTING_LIMIT):
+  """Yield a dict (name, count, bytes) for each container in the account,
+  optionally only those whose names start with prefix.
+  """
+  return _iter_listing(storageURL, token, prefix, limit, 'name')
+
+def iter_objects(storageURL, token, container, prefix=None,
+                 limit=LISTING_LIMIT):
+  """Yield a dict (name, hash, bytes, last_modified, content_type) for each
+  object in container, optionally only those whose names start with prefix.
+  """
+  return _iter_listing("%s/%s" % (storageURL, quote(container)), token,
+                       prefix, limit, 'name')
+
+def bulk_delete(storageURL, token, paths):
+  """Delete up to BULK_DELETE_MAX objects (or empty containers) in a single
+  request using the bulk-delete middleware.  paths are "container/object"
+  or "container".
+
+  Returns tuple (deleted, notFound, errors) where errors is a list of
+  [path, status] pairs.
+  """
+  if len(paths) > BULK_DELETE_MAX:
+    raise ValueError("At most %d paths per bulk delete" % BULK_DELETE_MAX)
+  body = "\n".join(quote("/" + p.lstrip("/")) for p in paths)
+  resp = _request('POST', storageURL + "?bulk-delete", token, data=body,
+                  headers={'Content-Type': 'text/plain',
+                           'Accept': 'application/json'})
+  result = json.loads(resp.text)
+  return (result.get('Number Deleted', 0), result.get('Number Not Found', 0),
+          result.get('Errors', []))
+
+def delete_container_objects(storageURL, token, container, progress=None,
+                             batch=BULK_DELETE_MAX):
+  """Delete every object in container, batch objects per request.  Listing
+  pages are fetched with a marker, so each page picks up after the names
+  we just deleted.  progress, if given, is called with (container, deleted
+  so far, objects per second) after every batch.
+
+  Returns tuple (deleted, errors).
+  """
+  started = time.time()
+  deleted = 0
+  errors = []
+  names = []
+
+  def flush():
+    gone, notFound, failed = bulk_delete(storageURL, token,
+                                         ["%s/%s" % (container, n)
+                                          for n in names])
+    del names[:]
+    errors.extend(failed)
+    if progress is not None:
+      progress(container, deleted + gone + notFound,
+               (deleted + gone + notFound) /
+               max(time.time() - started, 0.001))
+    return gone + notFound
+
+  for obj in iter_objects(storageURL, token, container, limit=batch):
+    names.append(obj['name'])
+    if len(names) == batch:
+      deleted += flush()
+  if names:
+    deleted += flush()
+  return (deleted, errors)
+
+def put_object(storageURL, token, container, name, data, headers={}):
+  """Upload data (a string or a file-like object, which is streamed) as
+  object name in container.  Returns the etag Swift reports for it.
+  """
+  resp = _request('PUT', "%s/%s/%s" % (storageURL, quote(container),
+                                       quote(name)),
+                  token, data=data, headers=dict(headers))
+  return resp.headers.get('etag', '').strip('"')
+
+def segment_size_for(size, segmentSize=SEGMENT_SIZE):
+  """Return the segment size to use for a file of size bytes - segmentSize,
+  unless that would take more than SLO_MAX_SEGMENTS segments.
+  """
+  return max(segmentSize, -(-size // SLO_MAX_SEGMENTS))
+
+class _SegmentReader(object):
+  """File-like view of length bytes of a file starting at offset, read
+  READ_SIZE bytes at a time so a segment is never held in memory.  Keeps
+  the MD5 of everything read so far, and how long was spent reading from
+  disk (readTime) and hashing (hashTime).
+  """
+  def __init__(self, path, offset, length):
+    self.fh = open(path, 'rb')
+    self.fh.seek(offset)
+    self.remaining = length
+    self.md5 = hashlib.md5()
+    self.readTime = 0.0
+    self.hashTime = 0.0
+
+  def read(self, size=-1):
+    if size < 0 or size > self.remaining:
+      size = self.remaining
+    started = time.time()
+    data = self.fh.read(min(size, READ_SIZE))
+    read = time.time()
+    self.md5.update(data)
+    self.hashTime += time.time() - read
+    self.readTime += read - started
+    self.remaining -= len(data)
+    return data
+
+  def __iter__(self):
+    while True:
+      data = self.read(READ_SIZE)
+      if not data:
+        return
+      yield data
+
+  def __len__(self):
+    return self.remaining
+
+  def close(self):
+    self.fh.close()
+
+def _add_timings(timings, read, hashed, put):
+  """Add phase durations (seconds) to a timings dict, if there is one"""
+  if timings is not None:
+    for phase, seconds in (('read', read), ('hash', hashed), ('put', put)):
+      timings[phase] = timings.get(phase, 0.0) + seconds
+
+def _put_range(storageURL, token, container, name, path, offset, length,
+               timings=None):
+  """Stream length bytes of path, starting at offset, up as object name in
+  container, checking the etag Swift reports against our own MD5.  Returns
+  the etag.  Time spent reading, hashing and waiting on the PUT itself is
+  added to timings (a dict), if given.
+  """
+  segment = _SegmentReader(path, offset, length)
+  started = time.time()
+  try:
+    etag = put_object(storageURL, token, container, name, segment,
+                      {'Content-Length': str(length)})
+  finally:
+    segment.close()
+  _add_timings(timings, segment.readTime, segment.hashTime,
+               time.time() - started - segment.readTime - segment.hashTime)
+  if etag != segment.md5.hexdigest():
+    raise IOError("%s was corrupted in transit" % name)
+  return etag
+
+def _md5_of(path, offset, length):
+  """Return hex MD5 of length bytes of path starting at offset"""
+  segment = _SegmentReader(path, offset, length)
+  try:
+    for data in segment:
+      pass
+  finally:
+    segment.close()
+  return segment.md5.hexdigest()
+
+def file_etag(path, segmentSize=SEGMENT_SIZE):
+  """Return the etag Swift will report for path once it is uploaded with
+  put_file: the file's MD5, or for a Static Large Object the MD5 of its
+  segments' MD5s.
+  """
+  size = os.path.getsize(path)
+  if size <= segmentSize:
+    return _md5_of(path, 0, size)
+  segmentSize = segment_size_for(size, segmentSize)
+  return hashlib.md5("".join(_md5_of(path, offset,
+                                     min(segmentSize, size - offset))
+                             for offset in xrange(0, size, segmentSize))
+                    ).hexdigest()
+
+def _unicode(name):
+  """Return name (a UTF-8 string or unicode) as unicode"""
+  if isinstance(name, unicode):
+    return name
+  return name.decode('utf-8')
+
+def slo_segments(storageURL, token, container, name):
+  """Return list of the segments ("container/object") of the Static Large
+  Object name in container - an empty list if there is no such object or
+  it is not a Static Large Object.
+  """
+  url = "%s/%s/%s" % (storageURL, quote(container), quote(name))
+  try:
+    resp = _request('HEAD', url, token)
+  except requests.HTTPError as err:
+    if err.response is not None and err.response.status_code == 404:
+      return []
+    raise
+  if resp.headers.get('x-static-large-object', '').lower() != 'true':
+    return []
+  resp = _request('GET', url, token, params={'multipart-manifest': 'get'})
+  return [_unicode(segment['name']).lstrip('/')
+          for segment in json.loads(resp.text)]
+
+def delete_stale_segments(storageURL, token, old, keep=()):
+  """Bulk delete the segments in old (see slo_segments) that are not in
+  keep, once the manifest that listed them has been replaced.  A segment
+  that can't be deleted is only left taking up space, so failures are
+  reported rather than raised.
+  """
+  keep = set(_unicode(path).lstrip('/') for path in keep)
+  stale = [path for path in old if path not in keep]
+  for first in xrange(0, len(stale), BULK_DELETE_MAX):
+    batch = stale[first:first + BULK_DELETE_MAX]
+    try:
+      deleted, notFound, errors = bulk_delete(storageURL, token, batch)
+    except (requests.RequestException, ValueError) as err:
+      print "Could not delete %d old segments: %s" % (len(batch), err)
+      continue
+    for path, status in errors:
+      print "Could not delete old segment %s: %s" % (path, status)
+
+def put_large_object(storageURL, token, container, name, path,
+                     segmentSize=SEGMENT_SIZE, concurrency=4, timings=None,
+                     checkExisting=True):
+  """Upload the file path as a Static Large Object: segments of segmentSize
+  bytes are streamed from disk by a pool of concurrency threads into
+  container_segments (as name/00000000, name/00000001...), then a manifest
+  listing them is written as object name in container.  Memory use stays
+  at a few READ_SIZE buffers per thread however big the file is.
+
+  If the object being replaced was a Static Large Object too, any of its
+  segments the new manifest does not reuse are deleted once the new
+  manifest is in place.  checkExisting=False skips looking, for when the
+  caller knows there is no such object.
+
+  Returns the manifest's etag.  Time spent in each phase, summed over the
+  segments, is added to timings (see _put_range).
+  """
+  old = []
+  if checkExisting:
+    old = slo_segments(storageURL, token, container, name)
+  size = os.path.getsize(path)
+  segmentSize = segment_size_for(size, segmentSize)
+  segContainer = container + "_segments"
+  _request('PUT', "%s/%s" % (storageURL, quote(segContainer)), token)
+
+  def put_segment(index):
+    offset = index * segmentSize
+    length = min(segmentSize, size - offset)
+    segName = "%s/%08d" % (name, index)
+    segTimings = {}
+    etag = _put_range(storageURL, token, segContainer, segName, path, offset,
+                      length, segTimings)
+    return ({'path': "/%s/%s" % (segContainer, segName), 'etag': etag,
+             'size_bytes': length}, segTimings)
+
+  pool = ThreadPool(concurrency)
+  try:
+    results = pool.map(put_segment, xrange(-(-size // segmentSize)))
+  finally:
+    pool.close()
+    pool.join()
+  segments = [segment for segment, segTimings in results]
+  for segment, segTimings in results:
+    _add_timings(timings, segTimings['read'], segTimings['hash'],
+                 segTimings['put'])
+
+  started = time.time()
+  resp = _request('PUT', "%s/%s/%s" % (storageURL, quote(container),
+                                       quote(name)),
+                  token, params={'multipart-manifest': 'put'},
+                  data=json.dumps(segments),
+                  headers={'Content-Type': 'application/json'})
+  _add_timings(timings, 0, 0, time.time() - started)
+  if old:
+    delete_stale_segments(storageURL, token, old,
+                          [segment['path'] for segment in segments])
+  return resp.headers.get('etag', '').strip('"')
+
+def put_file(storageURL, token, container, name, path,
+             segmentSize=SEGMENT_SIZE, concurrency=4, timings=None,
+             checkExisting=True):
+  """Upload the file path as object name in container, streaming it from
+  disk.  Files bigger than segmentSize become a Static Large Object (see
+  put_large_object).  Returns the object's etag.
+
+  When a Static Large Object is replaced, its old segments are deleted
+  after the new object is written.  That takes a HEAD request first;
+  checkExisting=False skips it, for when the caller knows (ie: from a
+  listing) that there is no object of that name yet.
+
+  timings, if given, is a dict to which the seconds spent reading the file,
+  hashing it and on the PUT requests are added (keys read, hash and put).
+  """
+  size = os.path.getsize(path)
+  if size > segmentSize:
+    return put_large_object(storageURL, token, container, name, path,
+                            segmentSize, concurrency, timings, checkExisting)
+  old = []
+  if checkExisting:
+    old = slo_segments(storageURL, token, container, name)
+  etag = _put_range(storageURL, token, container, name, path, 0, size,
+                    timings)
+  if old:
+    delete_stale_segments(storageURL, token, old)
+  return etag
+
+def delete_container(storageURL, token, container):
+  """Delete an (empty) container"""
+  _request('DELETE', "%s/%s" % (storageURL, quote(container)), token)
+
+# vim: ts=2 sw=2 tw=78 expandtab
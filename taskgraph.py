@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# taskgraph - Run a set of tasks that depend on each other, starting each one
+# as soon as everything it depends on has finished, with independent tasks
+# running at the same time.
+
+# Copyright 2013 Scott Gilbert
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+import Queue
+from multiprocessing.pool import ThreadPool
+
+def _dependencies(tasks, deps):
+  """Return dict of task -> set of tasks it waits for, ignoring any
+  dependency that is not itself one of the tasks.
+  """
+  return dict((name, set(d for d in deps.get(name, ()) if d in tasks))
+              for name in tasks)
+
+def topological_order(tasks, deps):
+  """Return list of task names ordered so that every task comes after the
+  tasks it depends on.  Ties are broken by name, so the order is stable.
+  Raises ValueError if the dependencies go round in a circle.
+  """
+  waiting = _dependencies(tasks, deps)
+  order = []
+  while waiting:
+    ready = sorted(name for name, needs in waiting.items() if not needs)
+    if not ready:
+      raise ValueError("Circular dependency between %s" %
+                       ", ".join(sorted(waiting)))
+    for name in ready:
+      del waiting[name]
+      order.append(name)
+    for needs in waiting.values():
+      needs.difference_update(ready)
+  return order
+
+def critical_path(tasks, deps, cost=None):
+  """Return list of task names making up the longest chain of dependent
+  tasks - the chain that decides how long the whole graph takes no matter
+  how much runs in parallel.  cost(name), if given, is the expected duration
+  of a task, otherwise every task counts as 1.
+  """
+  if cost is None:
+    cost = lambda name: 1
+  needs = _dependencies(tasks, deps)
+  longest = {}
+  via = {}
+  for name in topological_order(tasks, deps):
+    before = max(needs[name], key=lambda d: longest[d]) if needs[name] else None
+    longest[name] = cost(name) + (longest[before] if before else 0)
+    via[name] = before
+  if not longest:
+    return []
+  name = max(sorted(longest), key=lambda n: longest[n])
+  path = []
+  while name is not None:
+    path.insert(0, name)
+    name = via[name]
+  return path
+
+def print_plan(tasks, deps, describe=str):
+  """Print the task graph: one line per task, in the order it could run,
+  listing the tasks it waits for.  Finish with the critical path.
+  """
+  needs = _dependencies(tasks, deps)
+  for name in topological_order(tasks, deps):
+    if needs[name]:
+      print "  %-40s after: %s" % (describe(name),
+                                   ", ".join(describe(d) for d in
+                                             sorted(needs[name])))
+    else:
+      print "  %s" % describe(name)
+  path = critical_path(tasks, deps)
+  print "Critical path (%d step%s): %s" % (len(path),
+          "" if len(path) == 1 else "s",
+          " -> ".join(describe(name) for name in path))
+
+def run_tasks(tasks, deps, concurrency=4):
+  """Run tasks, a dict of name -> callable, in a pool of concurrency
+  threads.  deps is a dict of name -> list of names that have to finish
+  before that task can start.  Each task starts the moment the last of its
+  dependencies is done.
+
+  Returns dict of name -> (state, value) where state is 'done' (value is
+  whatever the task returned), 'failed' (value is the exception) or
+  'skipped' (value is the name of the failed dependency - tasks that depend
+  on a failed task are never run).
+  """
+  waiting = _dependencies(tasks, deps)
+  topological_order(tasks, deps)   # just to catch circular dependencies
+  dependents = {}
+  for name, needs in waiting.items():
+    for d in needs:
+      dependents.setdefault(d, []).append(name)
+
+  results = {}
+  finished = Queue.Queue()
+
+  def run(name):
+    try:
+      finished.put((name, 'done', tasks[name]()))
+    except Exception as err:
+      finished.put((name, 'failed', err))
+
+  def skip(name, because):
+    results[name] = ('skipped', because)
+    del waiting[name]
+    for d in dependents.get(name, []):
+      if d in waiting:
+        skip(d, because)
+
+  pool = ThreadPool(max(1, concurrency))
+  try:
+    running = 0
+    while waiting or running:
+      for name in sorted(waiting):
+        if not waiting[name]:
+          del waiting[name]
+          pool.apply_async(run, (name,))
+          running += 1
+      # wait (with timeout, so ctrl-c is still noticed) for the next task
+      # to finish
+      while True:
+        try:
+          name, state, value = finished.get(True, 1)
+          break
+        except Queue.Empty:
+          pass
+      running -= 1
+      results[name] = (state, value)
+      for d in dependents.get(name, []):
+        if d not in waiting:
+          continue
+        if state == 'done':
+          waiting[d].discard(name)
+        else:
+          skip(d, name)
+  finally:
+    pool.close()
+    pool.join()
+  return results
+
+# vim: ts=2 sw=2 tw=78 expandtab
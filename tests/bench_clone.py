@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Benchmark for challenge2 - cloning a server N times with the old
+# clone_server (an image per clone, one build at a time) versus
+# clone_servers (one image, concurrent builds) and --maxage (no image).
+
+# Copyright 2013 Scott Gilbert
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+# Optional Parameters:
+#   -h, --help                show help message and exit
+#   --clones N [N ...]        Numbers of clones to try (default 1 5 20)
+#   --latency MS              Round trip added to each build request
+#                             (default 200)
+#   --imagemin MINUTES        Minutes an image takes, to charge each image
+#                             taken (default 45)
+#   --concurrency N           Build requests clone_servers sends at once
+#                             (default 4)
+#
+# Build requests really are sent, to a stub compute service that sleeps
+# --latency on each one.  Images are not waited for; instead every image
+# taken is charged --imagemin.
+
+import os
+import sys
+import time
+import argparse
+
+# the challenges live one directory up
+sys.path.insert(0,
+                os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import stubs
+import buildhistory
+import challenge2 as c2
+
+class Image(object):
+  """A snapshot that goes ACTIVE on its third refresh"""
+  def __init__(self, imageId, name, serverId):
+    self.id = imageId
+    self.name = name
+    self.server = {'id': serverId}
+    self.metadata = {}
+    self.created = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+    self.status = 'SAVING'
+    self.progress = 0
+    self.refreshes = 0
+
+  def get(self):
+    self.refreshes += 1
+    if self.refreshes >= 3:
+      self.status, self.progress = 'ACTIVE', 100
+
+class Images(object):
+  def __init__(self):
+    self.images = {}
+    self.calls = dict((c, 0) for c in ('create', 'get', 'list'))
+
+  def get(self, imageId):
+    self.calls['get'] += 1
+    return self.images[imageId]
+
+  def _list(self, uri, key):
+    self.calls['list'] += 1
+    return self.images.values()
+
+class Servers(stubs.FakeServers):
+  """FakeServers that can take images, and that takes latency seconds to
+  answer a build request.
+  """
+  def __init__(self, images, latency):
+    stubs.FakeServers.__init__(self)
+    self.images = images
+    self.latency = latency
+
+  def get(self, serverId):
+    self.calls['get'] += 1
+    return stubs.Server(self, dict(self.backend[serverId]))
+
+  def create(self, *args, **kwargs):
+    time.sleep(self.latency)
+    return stubs.FakeServers.create(self, *args, **kwargs)
+
+  def create_image(self, serverId, name):
+    self.images.calls['create'] += 1
+    imageId = "img-%d" % (len(self.images.images) + 1)
+    self.images.images[imageId] = Image(imageId, name, serverId)
+    return imageId
+
+def compute(latency):
+  cs = stubs._Thing(images=Images())
+  cs.servers = Servers(cs.images, latency)
+  return cs
+
+def old_clone_server(cs, serverUUID):
+  """The old clone_server: take an image, wait for it and build one server
+  from it.
+  """
+  source_server = cs.servers.get(serverUUID)
+  image_id = cs.servers.create_image(serverUUID, source_server.name + "-img")
+  newImage = cs.images.get(image_id)
+  while newImage.status <> 'ACTIVE':
+    newImage.get()
+  return cs.servers.create(source_server.name + '-clone', image_id,
+                           source_server.flavor['id'])
+
+def old_clone(cs, source, clones):
+  return [old_clone_server(cs, source.id) for n in xrange(clones)]
+
+def run(clone, clones, latency):
+  """Clone a fresh source server clones times; returns (seconds, images
+  taken, build requests)
+  """
+  cs = compute(latency)
+  source = stubs.FakeServers.create(cs.servers, "web", "base", 2,
+                                    status='ACTIVE')
+  # an image taken earlier, for --maxage to find
+  cs.servers.create_image(source.id, "web-earlier")
+  cs.images.images["img-1"].status = 'ACTIVE'
+  cs.images.calls['create'] = 0
+  started = time.time()
+  with stubs.quiet():
+    servers = clone(cs, source, clones)
+  elapsed = time.time() - started
+  assert len(servers) == clones
+  return elapsed, cs.images.calls['create'], cs.servers.calls['create'] - 1
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--clones", type=int, nargs='+', default=[1, 5, 20],
+                      help="Numbers of clones to try")
+  parser.add_argument("--latency", type=float, default=200.0,
+                      help="Round trip added to each build request, in ms")
+  parser.add_argument("--imagemin", type=float, default=45.0,
+                      help="Minutes to charge each image taken")
+  parser.add_argument("--concurrency", type=int, default=4,
+                      help="Build requests clone_servers sends at once")
+  args = parser.parse_args()
+
+  # no waiting on the stub images, and nothing written to the real build
+  # history
+  predict, record = buildhistory.predict_build_time, buildhistory.record_build
+  buildhistory.predict_build_time = lambda *args, **kwargs: None
+  buildhistory.record_build = lambda *args, **kwargs: None
+  waits = stubs.FastWaits()
+  waits.setUp()
+  try:
+    print "%-7s %-13s %7s %9s %14s %14s" % (
+        "clones", "clone", "images", "requests", "requests (s)",
+        "total")
+    for clones in args.clones:
+      for name, clone in (
+          ("old", old_clone),
+          ("clone_servers",
+           lambda cs, src, n: c2.clone_servers(cs, src.id, n, 0,
+                                               args.concurrency)),
+          ("--maxage",
+           lambda cs, src, n: c2.clone_servers(cs, src.id, n, 60,
+                                               args.concurrency))):
+        elapsed, images, requests = run(clone, clones, args.latency / 1000)
+        print "%-7d %-13s %7d %9d %14.2f %13.0fm" % (
+            clones, name, images, requests, elapsed,
+            images * args.imagemin + elapsed / 60)
+  finally:
+    waits.tearDown()
+    buildhistory.predict_build_time, buildhistory.record_build = \
+        predict, record
+
+# vim: ts=2 sw=2 tw=78 expandtab
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Benchmark for challenge1 - waiting on a fleet of servers with one srv.get()
+# per server per tick (the old loop) versus one detailed listing per tick
+# (wait_for_servers).
+
+# Copyright 2013 Scott Gilbert
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+# Optional Parameters:
+#   -h, --help                show help message and exit
+#   --servers N [N ...]       Fleet sizes to try (default 10 100 1000)
+#   --latency MS              Round trip to charge each API call (default 100)
+#   --seed SEED               Seed for the servers' build times
+
+import os
+import sys
+import time
+import random
+import argparse
+
+# the challenges live one directory up
+sys.path.insert(0,
+                os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import stubs
+import waiter
+import challenge1 as c1
+
+class Fleet(stubs.FakeServers):
+  """FakeServers whose clock only moves between polls, so that both loops
+  see the servers finish at the same points no matter how many calls they
+  make in between.
+  """
+  def list(self, detailed=True, search_opts=None):
+    tick = self.tick
+    self.tick = lambda: None
+    try:
+      return stubs.FakeServers.list(self, detailed, search_opts)
+    finally:
+      self.tick = tick
+
+def fleet(numServers, seed):
+  """Return a Fleet and numServers servers on it that finish building
+  somewhere between 4 and 40 ticks in.
+  """
+  rand = random.Random(seed)
+  manager = Fleet()
+  servers = [manager.create("web%d" % n, "img", 2)
+             for n in range(numServers)]
+  for srv in servers:
+    manager.backend[srv.id]['ticks'] = -rand.randint(0, 36)
+  return manager, servers
+
+def old_wait_for_server_builds(manager, servers):
+  """The loop wait_for_server_builds used to run, with the clock ticking
+  where it slept.  Returns the number of polls.
+  """
+  polls = 0
+  allBuildsComplete = False
+  while not allBuildsComplete:
+    manager.tick()
+    polls += 1
+    allBuildsComplete = True
+    for srv in servers:
+      srv.get()
+      if srv.status not in ['ACTIVE','ERROR']:
+        allBuildsComplete = False
+        break
+  return polls
+
+def new_wait_for_server_builds(manager, servers):
+  """wait_for_servers, with the clock ticking where it sleeps.  Returns the
+  number of polls.
+  """
+  polls = [0]
+
+  def ticking_intervals(**kwargs):
+    while True:
+      manager.tick()
+      polls[0] += 1
+      yield 0
+
+  intervals = waiter.intervals
+  waiter.intervals = ticking_intervals
+  try:
+    with stubs.quiet():
+      c1.wait_for_servers(servers,
+                          lambda srv: srv.status in ['ACTIVE','ERROR'])
+  finally:
+    waiter.intervals = intervals
+  return polls[0]
+
+def run(wait, numServers, seed):
+  manager, servers = fleet(numServers, seed)
+  started = time.time()
+  polls = wait(manager, servers)
+  elapsed = time.time() - started
+  assert all(srv.status == 'ACTIVE' for srv in servers)
+  return polls, manager.calls['get'] + manager.calls['list'], elapsed
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--servers", type=int, nargs='+',
+                      default=[10, 100, 1000], help="Fleet sizes to try")
+  parser.add_argument("--latency", type=float, default=100.0,
+                      help="Round trip to charge each API call, in ms")
+  parser.add_argument("--seed", type=int, default=1,
+                      help="Seed for the servers' build times")
+  args = parser.parse_args()
+
+  print "%-6s %-5s %6s %9s %10s %12s" % ("fleet", "loop", "polls", "calls",
+                                          "cpu (ms)", "at latency")
+  for numServers in args.servers:
+    for name, wait in (("old", old_wait_for_server_builds),
+                       ("new", new_wait_for_server_builds)):
+      polls, calls, elapsed = run(wait, numServers, args.seed)
+      print "%-6d %-5s %6d %9d %10.1f %11.1fs" % (
+          numServers, name, polls, calls, elapsed * 1000,
+          calls * args.latency / 1000)
+
+# vim: ts=2 sw=2 tw=78 expandtab
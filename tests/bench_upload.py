@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Benchmark for challenge3 - uploading a directory one file at a time (as
+# pyrax's upload_folder did) versus the threaded upload engine, and picking
+# up an interrupted upload from its manifest.
+
+# Copyright 2013 Scott Gilbert
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+# Optional Parameters:
+#   -h, --help                show help message and exit
+#   --files FILES             Number of files to upload (default 2000)
+#   --size SIZE               Size of each file in bytes; K, M and G suffixes
+#                             work (default 4K)
+#   --latency MS              Round trip added to every request (default 20)
+#   --concurrency N [N ...]   Upload threads to try (default 1 8 32)
+#
+# eg: --files 100000 for a big tree of small files, or --files 3 --size 2G
+# for a few large objects.  Objects are kept in memory without their data,
+# but every segment PUT is read into memory once on its way through.
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import StringIO
+import argparse
+
+# the challenges live one directory up
+sys.path.insert(0,
+                os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import stubs
+import session
+import uploadmeter
+import challenge3 as c3
+
+class SlowSwift(stubs.FakeSwift):
+  """FakeSwift with a fixed round trip on every request, which does not
+  hold on to object data.
+  """
+  def __init__(self, latency):
+    stubs.FakeSwift.__init__(self)
+    self.latency = latency
+
+  def send(self, request, **kwargs):
+    time.sleep(self.latency)
+    return stubs.FakeSwift.send(self, request, **kwargs)
+
+  def _handle(self, request, method, container, name, query, body):
+    resp = stubs.FakeSwift._handle(self, request, method, container, name,
+                                   query, body)
+    if method == 'PUT' and name:
+      self.containers[container][name].pop('data', None)
+    return resp
+
+def make_tree(directory, files, size):
+  """Write files files of size bytes each, 1000 to a directory"""
+  block = os.urandom(min(size, 1024 * 1024))
+  for n in xrange(files):
+    sub = os.path.join(directory, "d%03d" % (n / 1000))
+    if not os.path.isdir(sub):
+      os.makedirs(sub)
+    with open(os.path.join(sub, "f%06d" % n), 'wb') as f:
+      left = size
+      while left > 0:
+        f.write(block[:left])
+        left -= len(block)
+
+def upload(swift, url, directory, concurrency, manifestFile):
+  """Upload directory into a fresh container; returns the seconds it took
+  and the number of object PUTs.
+  """
+  swift.containers.clear()
+  del swift.requests[:]
+  cf = stubs.FakeCloudFiles(url)
+  started = time.time()
+  with stubs.quiet():
+    c3.upload_dir_to_container(cf, directory, "bench", concurrency,
+                               manifestFile)
+  elapsed = time.time() - started
+  # /v1/account/container/object, leaving out the container PUT
+  return elapsed, len([r for r in swift.requests
+                       if r[0] == 'PUT' and r[1].count('/') > 3])
+
+def size_arg(value):
+  units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+  if value[-1:].upper() in units:
+    return int(value[:-1]) * units[value[-1:].upper()]
+  return int(value)
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--files", type=int, default=2000,
+                      help="Number of files to upload")
+  parser.add_argument("--size", type=size_arg, default=4096,
+                      help="Size of each file in bytes (K, M, G work)")
+  parser.add_argument("--latency", type=float, default=20.0,
+                      help="Round trip added to every request, in ms")
+  parser.add_argument("--concurrency", type=int, nargs='+',
+                      default=[1, 8, 32], help="Upload threads to try")
+  args = parser.parse_args()
+
+  url = "http://swift.bench/v1/AUTH_bench"
+  swift = SlowSwift(args.latency / 1000)
+  swift.mount(session.http_session(), url)
+  # the meter writes to the real stdout unless told otherwise
+  meter = uploadmeter.UploadMeter
+  uploadmeter.UploadMeter = \
+      lambda traceFile=None: meter(traceFile, StringIO.StringIO())
+  work = tempfile.mkdtemp()
+  try:
+    tree = os.path.join(work, "tree")
+    make_tree(tree, args.files, args.size)
+    totalMB = args.files * args.size / (1024.0 * 1024)
+    print "%d files of %d bytes, %.0f ms a request\n" % (
+        args.files, args.size, args.latency)
+    print "%-24s %9s %7s %9s %8s" % ("run", "seconds", "PUTs", "files/s",
+                                      "MB/s")
+
+    def report(name, elapsed, puts, files):
+      print "%-24s %9.2f %7d %9.0f %8.1f" % (
+          name, elapsed, puts, files / elapsed,
+          totalMB * files / args.files / elapsed)
+
+    for concurrency in args.concurrency:
+      manifestFile = os.path.join(work, "manifest-%d" % concurrency)
+      elapsed, puts = upload(swift, url, tree, concurrency, manifestFile)
+      report("%d thread%s" % (concurrency, "s" if concurrency > 1 else ""),
+             elapsed, puts, args.files)
+
+    # interrupted half way: the manifest only has the first half, so only
+    # the second half goes up again
+    concurrency = args.concurrency[-1]
+    manifestFile = os.path.join(work, "manifest-%d" % concurrency)
+    with open(manifestFile) as mf:
+      done = mf.readlines()[:args.files / 2]
+    with open(manifestFile, 'w') as mf:
+      mf.writelines(done)
+    elapsed, puts = upload(swift, url, tree, concurrency, manifestFile)
+    report("resume half, %d threads" % concurrency, elapsed, puts,
+           args.files - len(done))
+  finally:
+    uploadmeter.UploadMeter = meter
+    shutil.rmtree(work)
+
+# vim: ts=2 sw=2 tw=78 expandtab
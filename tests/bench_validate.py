@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Benchmark for challenge4 - checking an inventory of host names and
+# addresses with the old per-call validators versus validate_lines.
+
+# Copyright 2013 Scott Gilbert
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+# Optional Parameters:
+#   -h, --help                show help message and exit
+#   --lines LINES             Lines in the inventory (default 500000)
+#   --processes N [N ...]     Worker processes to try (default 1 4)
+#   --seed SEED               Seed for the inventory
+
+import os
+import re
+import sys
+import time
+import random
+import tempfile
+import argparse
+
+# the challenges live one directory up
+sys.path.insert(0,
+                os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import stubs    # for "import pyrax" in challenge4
+import challenge4 as c4
+
+def old_is_valid_hostname(hostname):
+  """is_valid_hostname as it was, compiling its pattern on every call"""
+  if len(hostname) > 255:
+    return False
+  if hostname[-1:] == ".":
+    hostname = hostname[:-1]
+  allowed = re.compile("(?!-)[A-Z\d-]{1,63}(?<!-)$", re.IGNORECASE)
+  return all(allowed.match(x) for x in hostname.split("."))
+
+def old_validate(lines):
+  """What checking an inventory took with the per-call functions: split
+  each line, check the name, then try the address as IPv4 and as IPv6.
+  Returns the number of errors.
+  """
+  errors = 0
+  for line in lines:
+    fields = [field.strip() for field in line.rstrip("\r\n").split(",")]
+    if not fields[0] or fields[0].startswith('#') or \
+       fields[0].lower() == 'fqdn':
+      continue
+    if not old_is_valid_hostname(fields[0]):
+      errors += 1
+    if len(fields) > 1 and fields[1]:
+      if not (c4.is_valid_ipv4_address(fields[1]) or
+              c4.is_valid_ipv6_address(fields[1])):
+        errors += 1
+  return errors
+
+def inventory(path, numLines, seed):
+  """Write an inventory of numLines lines: IPv4, IPv6 and bare host names,
+  with about one line in fifty carrying a bad name or address.
+  """
+  rand = random.Random(seed)
+  with open(path, 'w') as f:
+    f.write("fqdn,ip\n")
+    for n in xrange(numLines):
+      name = "host%d.rack%d.dc%d.example.com" % (n, n % 40, n % 3)
+      kind = rand.randint(0, 99)
+      if kind < 60:
+        addr = "10.%d.%d.%d" % (rand.randint(0, 255), rand.randint(0, 255),
+                                rand.randint(1, 254))
+      elif kind < 90:
+        addr = "2001:db8::%x:%x" % (rand.randint(0, 0xffff), n & 0xffff)
+      elif kind < 98:
+        addr = ""
+      elif kind < 99:
+        addr = "10.0.0.%d" % (256 + n % 100)
+      else:
+        name = "-bad%d.example.com" % n
+        addr = "10.0.0.1"
+      f.write("%s,%s\n" % (name, addr) if addr else "%s\n" % name)
+
+def timed(run, path):
+  with open(path) as lines:
+    started = time.time()
+    errors = run(lines)
+  return time.time() - started, errors
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--lines", type=int, default=500000,
+                      help="Lines in the inventory")
+  parser.add_argument("--processes", type=int, nargs='+', default=[1, 4],
+                      help="Worker processes to try")
+  parser.add_argument("--seed", type=int, default=1,
+                      help="Seed for the inventory")
+  args = parser.parse_args()
+
+  fd, path = tempfile.mkstemp()
+  os.close(fd)
+  try:
+    inventory(path, args.lines, args.seed)
+    print "%d lines\n" % args.lines
+    print "%-22s %9s %10s %8s" % ("check", "seconds", "lines/s", "errors")
+
+    def report(name, elapsed, errors):
+      print "%-22s %9.2f %10.0f %8d" % (name, elapsed, args.lines / elapsed,
+                                        errors)
+
+    # the hostname check on its own, which is where the recompile was
+    with open(path) as lines:
+      hostnames = [line.split(",")[0].strip() for line in lines][1:]
+    for name, check in (("old is_valid_hostname", old_is_valid_hostname),
+                        ("is_valid_hostname", c4.is_valid_hostname)):
+      started = time.time()
+      bad = len([h for h in hostnames if not check(h)])
+      report(name, time.time() - started, bad)
+
+    report("per-call functions", *timed(old_validate, path))
+    for processes in args.processes:
+      elapsed, (counts, errors) = timed(
+          lambda lines: c4.validate_lines(lines, processes), path)
+      report("validate_lines, %d proc" % processes, elapsed, len(errors))
+  finally:
+    os.remove(path)
+
+# vim: ts=2 sw=2 tw=78 expandtab
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Benchmark for challenge4 - finding the zone for a name with a dns.find
+# per guess (the old create_dns_record) versus the cached longest-suffix
+# index (ZoneIndex).
+
+# Copyright 2013 Scott Gilbert
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+# Optional Parameters:
+#   -h, --help                show help message and exit
+#   --zones ZONES             Zones in the account (default 10000)
+#   --lookups LOOKUPS         Names to look up (default 100000)
+#   --latency MS              Round trip to charge each API call (default 100)
+#   --seed SEED               Seed for the names looked up
+
+import os
+import sys
+import time
+import random
+import argparse
+
+# the challenges live one directory up
+sys.path.insert(0,
+                os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import stubs
+import challenge4 as c4
+
+# zones Cloud DNS lists per page
+DOMAIN_PAGE = 100
+
+class Zones(stubs.FakeDNS):
+  """FakeDNS that counts round trips: one per find, one per page of the
+  domain listing.  find is a dict lookup, the best the service could do.
+  """
+  def __init__(self, zones):
+    stubs.FakeDNS.__init__(self, zones)
+    self.byName = dict((d.name, d) for d in self.domains)
+    self.calls = 0
+
+  def find(self, name):
+    self.calls += 1
+    if name not in self.byName:
+      raise stubs.NotFound("no domain %s" % name)
+    return self.byName[name]
+
+  def get_domain_iterator(self):
+    self.calls += (len(self.domains) + DOMAIN_PAGE - 1) / DOMAIN_PAGE
+    return stubs.FakeDNS.get_domain_iterator(self)
+
+def old_find_zone(dns, FQDN):
+  """The guesses the old create_dns_record made; None where it would have
+  created a new zone.
+  """
+  try:
+    return dns.find(name=FQDN)
+  except stubs.NotFound:
+    try:
+      return dns.find(name=FQDN.split('.',1)[1])
+    except stubs.NotFound:
+      return None
+
+def zone_names(numZones):
+  """Zones one and two levels below a TLD, ie: z17.com and
+  z18.example.net
+  """
+  tlds = ["com", "net", "org", "io"]
+  return ["z%d.%s%s" % (n, "example." if n % 2 else "", tlds[n % 4])
+          for n in xrange(numZones)]
+
+def names(zones, count, seed):
+  """Generate (name, zone it belongs in) pairs: the zone itself, a host in
+  it, a host two or three labels down, and a name in no zone at all.
+  """
+  rand = random.Random(seed)
+  for n in xrange(count):
+    zone = rand.choice(zones)
+    kind = n % 5
+    if kind == 0:
+      yield zone, zone
+    elif kind == 1:
+      yield "www.%s" % zone, zone
+    elif kind == 2:
+      yield "a.b.%s" % zone, zone
+    elif kind == 3:
+      yield "a.b.c.%s" % zone, zone
+    else:
+      yield "www.unknown%d.test" % n, None
+
+def run(lookup, dns, queries):
+  """Look every name up; returns (seconds, names sent to the wrong zone)"""
+  wrong = 0
+  started = time.time()
+  for name, zone in queries:
+    domain = lookup(name)
+    if (domain and domain.name) != zone:
+      wrong += 1
+  return time.time() - started, wrong
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--zones", type=int, default=10000,
+                      help="Zones in the account")
+  parser.add_argument("--lookups", type=int, default=100000,
+                      help="Names to look up")
+  parser.add_argument("--latency", type=float, default=100.0,
+                      help="Round trip to charge each API call, in ms")
+  parser.add_argument("--seed", type=int, default=1,
+                      help="Seed for the names looked up")
+  args = parser.parse_args()
+
+  zones = zone_names(args.zones)
+  queries = list(names(zones, args.lookups, args.seed))
+  print "%d zones, %d lookups\n" % (args.zones, args.lookups)
+  print "%-7s %9s %10s %12s %12s %7s" % ("lookup", "calls", "cpu (s)",
+                                         "lookups/s", "at latency", "wrong")
+
+  dns = Zones(zones)
+  old = lambda name: old_find_zone(dns, name)
+  new = c4.ZoneIndex(dns).lookup
+  for label, lookup in (("old", old), ("index", new)):
+    dns.calls = 0
+    elapsed, wrong = run(lookup, dns, queries)
+    print "%-7s %9d %10.2f %12.0f %11.1fs %7d" % (
+        label, dns.calls, elapsed, len(queries) / elapsed,
+        dns.calls * args.latency / 1000, wrong)
+
+# vim: ts=2 sw=2 tw=78 expandtab
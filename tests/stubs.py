@@ -0,0 +1,670 @@
+# -*- coding: utf-8 -*-
+# stubs - Stand-ins for the cloud APIs, so the tests run without an account
+# (or pyrax) and without touching the network: a tiny pyrax module, an
+# in-memory Cloud Servers manager and an in-memory Swift that plugs into
+# requests as a transport adapter.
+
+# Copyright 2013 Scott Gilbert
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+import os
+import sys
+import time
+import json
+import types
+import random
+import string
+import urllib
+import shutil
+import hashlib
+import urlparse
+import StringIO
+import tempfile
+import itertools
+import threading
+import contextlib
+import SocketServer
+import BaseHTTPServer
+import requests
+import requests.adapters
+import waiter
+
+class NotFound(Exception):
+  code = 404
+
+def install_pyrax():
+  """Make "import pyrax" work when pyrax is not installed, with just enough
+  of it for the modules under test to import.
+  """
+  try:
+    import pyrax
+    return pyrax
+  except ImportError:
+    pass
+  pyrax = types.ModuleType('pyrax')
+  pyrax.exceptions = types.ModuleType('pyrax.exceptions')
+  for name in ('NotFound', 'FolderNotFound', 'DomainCreationFailed',
+               'AuthenticationFailed'):
+    setattr(pyrax.exceptions, name,
+            NotFound if name == 'NotFound' else type(name, (Exception,), {}))
+  pyrax.utils = types.ModuleType('pyrax.utils')
+  pyrax.utils.random_name = lambda length=20, ascii_only=False: "".join(
+      random.choice(string.ascii_letters) for i in xrange(length))
+  pyrax.identity = None
+  pyrax.regions = ()
+  pyrax.services = ()
+  sys.modules['pyrax'] = pyrax
+  sys.modules['pyrax.exceptions'] = pyrax.exceptions
+  sys.modules['pyrax.utils'] = pyrax.utils
+  return pyrax
+
+pyrax = install_pyrax()
+
+# needs pyrax, real or not
+import session
+import swiftapi
+
+def fast_intervals(initial=1, maximum=30, factor=1.5, jitter=0.25, hint=None):
+  """Drop-in for waiter.intervals that hardly sleeps at all"""
+  while True:
+    yield 0.001
+
+class FastWaits(object):
+  """Mixin for TestCase: polling loops don't sleep while a test runs"""
+  def setUp(self):
+    self._intervals = waiter.intervals
+    waiter.intervals = fast_intervals
+
+  def tearDown(self):
+    waiter.intervals = self._intervals
+
+@contextlib.contextmanager
+def quiet():
+  """Swallow whatever the code under test prints"""
+  stdout = sys.stdout
+  sys.stdout = StringIO.StringIO()
+  try:
+    yield sys.stdout
+  finally:
+    sys.stdout = stdout
+
+class Server(object):
+  """A pyrax-ish server resource backed by a FakeServers manager"""
+  def __init__(self, manager, info):
+    self.manager = manager
+    self._info = info
+    self._add_details(info)
+
+  def _add_details(self, info):
+    for key, value in info.items():
+      setattr(self, key, value)
+
+  def get(self):
+    self.manager.calls['get'] += 1
+    if self.id not in self.manager.backend:
+      raise NotFound("server %s not found" % self.id)
+    self._add_details(dict(self.manager.backend[self.id]))
+
+  def update(self, name=None):
+    if self.id not in self.manager.backend:
+      raise NotFound("server %s not found" % self.id)
+    self.manager.backend[self.id]['name'] = name
+
+  def change_password(self, password):
+    self.manager.calls['change_password'] += 1
+
+  def delete(self):
+    self.manager.calls['delete'] += 1
+    self.manager.backend.pop(self.id, None)
+
+class FakeServers(object):
+  """In-memory cs.servers.  Every listing is one tick of the clock: a new
+  server gets its IP on its third tick and goes ACTIVE on its buildTicks'th
+  (or ERROR, if its name is in failNames).
+  """
+  def __init__(self, buildTicks=4, failNames=()):
+    self.backend = {}
+    self.ids = itertools.count(1)
+    self.buildTicks = buildTicks
+    self.failNames = set(failNames)
+    self.calls = dict((c, 0) for c in ('create', 'list', 'get', 'delete',
+                                       'change_password'))
+    self.lock = threading.Lock()
+
+  def create(self, name, image, flavor, files=None, nics=None,
+             status='BUILD', created=None):
+    with self.lock:
+      self.calls['create'] += 1
+      srvId = '%05d' % next(self.ids)
+      self.backend[srvId] = {
+        'id': srvId, 'name': name, 'status': status, 'networks': {},
+        'nics': nics,
+        'ticks': 0, 'flavor': {'id': str(flavor)}, 'image': {'id': image},
+        'created': created or time.strftime("%Y-%m-%dT%H:%M:%SZ",
+                                            time.gmtime())}
+      info = dict(self.backend[srvId])
+    info['adminPass'] = 'secret'
+    return Server(self, info)
+
+  def tick(self):
+    for info in self.backend.values():
+      info['ticks'] += 1
+      if info['ticks'] >= 3:
+        info['networks'] = {'private': ['10.0.0.%d' % int(info['id'])]}
+      if info['status'] == 'BUILD' and info['ticks'] >= self.buildTicks:
+        info['status'] = ('ERROR' if info['name'] in self.failNames
+                          else 'ACTIVE')
+
+  def list(self, detailed=True, search_opts=None):
+    with self.lock:
+      self.calls['list'] += 1
+      self.tick()
+      search_opts = search_opts or {}
+      ids = sorted(self.backend)
+      if 'marker' in search_opts:
+        ids = [i for i in ids if i > search_opts['marker']]
+      ids = ids[:search_opts.get('limit', 1000)]
+      return [Server(self, dict(self.backend[i])) for i in ids]
+
+class FakeCompute(object):
+  def __init__(self, **kwargs):
+    self.servers = FakeServers(**kwargs)
+
+class _Thing(object):
+  """A bag of attributes"""
+  def __init__(self, **kwargs):
+    self.__dict__.update(kwargs)
+
+class Volume(object):
+  """A CBS volume: available one refresh after it is created, in-use one
+  refresh after it is attached.
+  """
+  def __init__(self, name, size, failCreate=False):
+    self.id = name
+    self.name = name
+    self.size = size
+    self.status = 'creating'
+    self.next = 'error' if failCreate else 'available'
+    self.attachedTo = None
+    self.deleted = False
+
+  def get(self):
+    if self.next:
+      self.status, self.next = self.next, None
+
+  def attach_to_instance(self, srv, mountpoint):
+    self.status, self.next = 'attaching', 'in-use'
+    self.attachedTo = srv
+
+  def delete(self):
+    self.deleted = True
+
+class FakeBlockStorage(object):
+  def __init__(self, failNames=()):
+    self.volumes = []
+    self.failNames = set(failNames)
+
+  def create(self, name, size, volume_type):
+    vol = Volume(name, size, name in self.failNames)
+    self.volumes.append(vol)
+    return vol
+
+class ImmutableEntity(Exception):
+  """What a loadbalancer that is not ACTIVE says to a change"""
+  code = 422
+
+class LoadBalancer(object):
+  """A loadbalancer that goes ACTIVE one refresh after each change, and
+  (like the real thing) refuses a change while it is not ACTIVE.
+  """
+  def __init__(self, name, nodes):
+    self.id = name
+    self.name = name
+    self.nodes = list(nodes)
+    self.virtual_ips = [_Thing(address="203.0.113.10", type="PUBLIC")]
+    self.protocol = "HTTP"
+    self.port = 80
+    self.status = 'BUILD'
+    self.changes = []
+
+  def get(self):
+    self.status = 'ACTIVE'
+
+  def _change(self, what, *args, **kwargs):
+    if self.status != 'ACTIVE':
+      raise ImmutableEntity("loadbalancer is %s" % self.status)
+    self.changes.append((what, args, kwargs))
+    self.status = 'PENDING_UPDATE'
+
+  def add_nodes(self, nodes):
+    self._change('add_nodes')
+    self.nodes.extend(nodes)
+
+  def add_health_monitor(self, **kwargs):
+    self._change('add_health_monitor', **kwargs)
+
+  def set_error_page(self, html):
+    self._change('set_error_page', html)
+
+  def add_ssl_termination(self, **kwargs):
+    self._change('add_ssl_termination', **kwargs)
+
+class FakeLoadBalancers(object):
+  def __init__(self):
+    self.lbs = []
+
+  def Node(self, address, port, condition):
+    return _Thing(address=address, port=port, condition=condition)
+
+  def VirtualIP(self, type):
+    return _Thing(type=type)
+
+  def create(self, name, port, protocol, nodes, virtual_ips, algorithm):
+    lb = LoadBalancer(name, nodes)
+    self.lbs.append(lb)
+    return lb
+
+class FakeNetworks(object):
+  def __init__(self):
+    self.networks = []
+
+  def create(self, name, cidr):
+    network = _Thing(id="net-%d" % (len(self.networks) + 1), name=name,
+                     cidr=cidr)
+    network.get_server_networks = lambda public, private: [
+        {'net-id': 'public'}, {'net-id': 'private'}, {'net-id': network.id}]
+    self.networks.append(network)
+    return network
+
+class DatabaseInstance(object):
+  def __init__(self, name, flavor, volume):
+    self.name = name
+    self.hostname = "%s.db.example.com" % name
+    self.flavor = flavor
+    self.volume = volume
+    self.status = 'BUILD'
+    self.databases = []
+    self.users = []
+
+  def get(self):
+    self.status = 'ACTIVE'
+
+  def create_database(self, name):
+    self.databases.append(name)
+
+  def create_user(self, name, password, database_names):
+    self.users.append((name, password, database_names))
+
+class FakeDatabases(object):
+  def get_flavor(self, flavor):
+    return flavor
+
+  def create(self, name, flavor, volume):
+    return DatabaseInstance(name, flavor, volume)
+
+class FakeDomain(object):
+  ids = itertools.count(1)
+
+  def __init__(self, name):
+    self.id = next(self.ids)
+    self.name = name
+    self.records = []
+
+  def add_record(self, rec):
+    self.records.append(rec)
+
+  def add_records(self, recs):
+    self.records.extend(recs)
+
+class FakeDNS(object):
+  def __init__(self, zones=()):
+    self.domains = [FakeDomain(name) for name in zones]
+
+  def get_domain_iterator(self):
+    return iter(self.domains)
+
+  def create(self, name, ttl, emailAddress):
+    domain = FakeDomain(name)
+    self.domains.append(domain)
+    return domain
+
+class FakeCloudFiles(object):
+  """Just enough of a pyrax CloudFiles client to put objects in a
+  FakeSwift
+  """
+  def __init__(self, url):
+    self.connection = _Thing(url=url, token="token")
+
+  def get_container(self, name):
+    # every lookup (re)creates the container, which is fine by Swift
+    swiftapi._request('PUT', "%s/%s" % (self.connection.url,
+                                        swiftapi.quote(name)), "token")
+    return _Thing(name=name)
+
+  create_container = get_container
+
+class FakeSwift(requests.adapters.BaseAdapter):
+  """An in-memory Swift account, reached through requests: mount it on a
+  Session for the storage URL (see mount).  Knows container and object
+  listings (limit, marker, prefix), PUT with etags, Static Large Object
+  manifests, DELETE and bulk delete.
+  """
+  def __init__(self):
+    requests.adapters.BaseAdapter.__init__(self)
+    self.containers = {}    # name -> {object name -> dict}
+    self.requests = []
+    self.lock = threading.Lock()
+
+  def mount(self, http, storageURL):
+    http.mount(storageURL, self)
+
+  def close(self):
+    pass
+
+  def _body(self, body):
+    if body is None:
+      return ""
+    if isinstance(body, basestring):
+      return body
+    if hasattr(body, 'read'):
+      chunks = []
+      while True:
+        data = body.read(65536)
+        if not data:
+          return "".join(chunks)
+        chunks.append(data)
+    return "".join(body)
+
+  def _response(self, request, status, body="", headers=None):
+    resp = requests.models.Response()
+    resp.status_code = status
+    resp._content = body
+    resp.headers = requests.structures.CaseInsensitiveDict(headers or {})
+    resp.url = request.url
+    resp.request = request
+    resp.reason = str(status)
+    return resp
+
+  def _listing(self, request, items, query):
+    if 'prefix' in query:
+      items = [i for i in items if i['name'].startswith(query['prefix'])]
+    if 'marker' in query:
+      items = [i for i in items if i['name'] > query['marker']]
+    items = items[:int(query.get('limit', 10000))]
+    if not items:
+      return self._response(request, 204)
+    return self._response(request, 200, json.dumps(items),
+                          {'Content-Type': 'application/json'})
+
+  def send(self, request, **kwargs):
+    url = urlparse.urlparse(request.url)
+    query = dict(urlparse.parse_qsl(url.query, keep_blank_values=True))
+    parts = [urllib.unquote(p) for p in url.path.split('/')[3:]]
+    container = parts[0] if parts else ''
+    name = '/'.join(parts[1:])
+    body = self._body(request.body)
+    with self.lock:
+      self.requests.append((request.method, urllib.unquote(url.path),
+                            query))
+      return self._handle(request, request.method, container, name, query,
+                          body)
+
+  def _handle(self, request, method, container, name, query, body):
+    if method == 'POST' and 'bulk-delete' in query:
+      deleted = notFound = 0
+      for line in body.split("\n"):
+        path = urllib.unquote(line).lstrip('/')
+        cont, _, obj = path.partition('/')
+        if self.containers.get(cont, {}).pop(obj, None) is not None:
+          deleted += 1
+        else:
+          notFound += 1
+      return self._response(request, 200, json.dumps(
+          {'Number Deleted': deleted, 'Number Not Found': notFound,
+           'Errors': []}))
+    if not container:
+      return self._listing(request, [{'name': n, 'count': len(objs),
+                                      'bytes': 0} for n, objs in
+                                     sorted(self.containers.items())],
+                           query)
+    if not name:
+      if method == 'PUT':
+        self.containers.setdefault(container, {})
+        return self._response(request, 201)
+      if method == 'DELETE':
+        if self.containers.get(container):
+          return self._response(request, 409)
+        self.containers.pop(container, None)
+        return self._response(request, 204)
+      if container not in self.containers:
+        return self._response(request, 404)
+      return self._listing(request, [
+          {'name': n, 'hash': o['etag'], 'bytes': o['bytes'],
+           'last_modified': '', 'content_type': 'application/octet-stream'}
+          for n, o in sorted(self.containers[container].items())], query)
+
+    objects = self.containers.setdefault(container, {})
+    if method == 'PUT':
+      if 'multipart-manifest' in query:
+        segments = json.loads(body)
+        etag = hashlib.md5("".join(s['etag'] for s in segments)).hexdigest()
+        objects[name] = {'etag': etag, 'manifest': segments,
+                         'bytes': sum(s['size_bytes'] for s in segments)}
+      else:
+        etag = hashlib.md5(body).hexdigest()
+        objects[name] = {'etag': etag, 'data': body, 'bytes': len(body)}
+      return self._response(request, 201, "", {'Etag': '"%s"' % etag})
+    obj = objects.get(name)
+    if obj is None:
+      return self._response(request, 404)
+    if method == 'DELETE':
+      del objects[name]
+      return self._response(request, 204)
+    if method in ('GET', 'HEAD'):
+      headers = {'Etag': '"%s"' % obj['etag']}
+      if 'manifest' in obj:
+        headers['X-Static-Large-Object'] = 'True'
+        if query.get('multipart-manifest') == 'get':
+          return self._response(request, 200, json.dumps(
+              [{'name': s['path'], 'hash': s['etag'],
+                'bytes': s['size_bytes']} for s in obj['manifest']]),
+              headers)
+      return self._response(request, 200,
+                            "" if method == 'HEAD' else obj.get('data', ''),
+                            headers)
+    return self._response(request, 405)
+
+class _ThreadingHTTPServer(SocketServer.ThreadingMixIn,
+                           BaseHTTPServer.HTTPServer):
+  daemon_threads = True
+
+class IdentityServer(object):
+  """Identity, and one API endpoint, on a local HTTP/1.1 server - real
+  sockets, so keep-alive connections can be counted.  POST /tokens hands
+  out a new token lasting lifetime seconds, its expiry time given in UTC
+  offset utcOffset (seconds); GET /servers refuses tokens it did not hand
+  out or that have been revoked.
+  """
+  def __init__(self, lifetime=3600, utcOffset=-5 * 3600):
+    self.lifetime = lifetime
+    self.utcOffset = utcOffset
+    self.tokens = set()
+    self.authCalls = 0
+    self.lock = threading.Lock()
+    server = self
+
+    class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+      protocol_version = "HTTP/1.1"
+
+      def log_message(self, *args):
+        pass
+
+      def reply(self, code, body):
+        data = json.dumps(body)
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+      def do_POST(self):
+        self.rfile.read(int(self.headers.getheader('content-length') or 0))
+        self.reply(200, server.issue())
+
+      def do_GET(self):
+        if self.headers.getheader('x-auth-token') in server.tokens:
+          self.reply(200, {"servers": []})
+        else:
+          self.reply(401, {"unauthorized": {"code": 401}})
+
+    self.httpd = _ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    self.url = "http://127.0.0.1:%d" % self.httpd.server_port
+    thread = threading.Thread(target=self.httpd.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+  def issue(self):
+    """Hand out a new token"""
+    with self.lock:
+      self.authCalls += 1
+      token = "token-%d" % self.authCalls
+      self.tokens.add(token)
+    offset = abs(self.utcOffset) // 60
+    expires = time.strftime("%Y-%m-%dT%H:%M:%S.000", time.gmtime(
+        time.time() + self.lifetime + self.utcOffset)) + "%s%02d:%02d" % (
+        "-" if self.utcOffset < 0 else "+", offset // 60, offset % 60)
+    catalog = [{"type": "compute", "name": "cloudServersOpenStack",
+                "endpoints": [{"region": r, "publicURL": self.url}
+                              for r in ("DFW", "ORD")]}]
+    return {"access": {"token": {"id": token, "expires": expires},
+                       "serviceCatalog": catalog}}
+
+  def revoke(self, token):
+    with self.lock:
+      self.tokens.discard(token)
+
+  def close(self):
+    self.httpd.shutdown()
+    self.httpd.server_close()
+
+class Identity(object):
+  """pyrax's identity, as far as session uses it, talking to an
+  IdentityServer through pyrax.http
+  """
+  def __init__(self, url):
+    self.url = url
+    self.token = None
+    self.expires = None
+    self.regions = ()
+    self.services = {}
+    self.authenticated = False
+
+  def set_credential_file(self, credentialFile, region=None):
+    self.credentialFile = credentialFile
+
+  def authenticate(self):
+    resp = pyrax.http.req_methods['POST'](self.url + "/tokens", data="{}")
+    if resp.status_code != 200:
+      raise pyrax.exceptions.AuthenticationFailed(resp.status_code)
+    self._parse_response(resp.json())
+    self.authenticated = True
+
+  def _parse_response(self, resp):
+    access = resp['access']
+    self.token = access['token']['id']
+    self.expires = access['token']['expires']
+    self.services = {}
+    for svc in access['serviceCatalog']:
+      self.services[svc['type']] = {'endpoints': dict(
+          (ep['region'], ep) for ep in svc['endpoints'])}
+    self.regions = set().union(*[svc['endpoints'].keys()
+                                 for svc in self.services.values()])
+
+  def get(self, path):
+    """An API call, made the way a pyrax client makes it: with the current
+    token.  Returns the status code.
+    """
+    return pyrax.http.req_methods['GET'](
+        self.url + path, headers={'X-Auth-Token': self.token}).status_code
+
+class IdentityService(object):
+  """Mixin for TestCase: pyrax authenticates against an IdentityServer
+  (self.server), with a credential file (self.credentialFile) and session
+  cache file (self.cacheFile) of its own, and session starts over with no
+  HTTP session, so no open connections.
+  """
+  def setUp(self):
+    self.server = IdentityServer()
+    self.dir = tempfile.mkdtemp()
+    self.credentialFile = os.path.join(self.dir, "credentials")
+    with open(self.credentialFile, 'w') as f:
+      f.write("[rackspace_cloud]\nusername = me\napi_key = key\n")
+    self.cacheFile = os.path.join(self.dir, "session")
+
+    self.saved = dict((name, getattr(pyrax, name))
+                      for name in ('identity', 'http', '_create_identity',
+                                   'set_credential_file',
+                                   'connect_to_services')
+                      if hasattr(pyrax, name))
+    self.savedModule = sys.modules.get('pyrax.http')
+    pyrax.http = types.ModuleType('pyrax.http')
+    pyrax.http.req_methods = {'GET': requests.get, 'POST': requests.post}
+    sys.modules['pyrax.http'] = pyrax.http
+    pyrax.identity = None
+    pyrax._create_identity = self.create_identity
+    pyrax.set_credential_file = self.pyrax_set_credential_file
+    pyrax.connect_to_services = lambda region=None: None
+    self.savedSessions = dict(session._sessions)
+    session._sessions.clear()
+    session._restored.clear()
+
+  def tearDown(self):
+    session._sessions.clear()
+    session._sessions.update(self.savedSessions)
+    session._restored.clear()
+    for name in ('http', '_create_identity', 'set_credential_file',
+                 'connect_to_services'):
+      if name not in self.saved:
+        delattr(pyrax, name)
+    for name, value in self.saved.items():
+      setattr(pyrax, name, value)
+    if self.savedModule is None:
+      sys.modules.pop('pyrax.http', None)
+    else:
+      sys.modules['pyrax.http'] = self.savedModule
+    self.server.close()
+    shutil.rmtree(self.dir)
+
+  def create_identity(self):
+    pyrax.identity = Identity(self.server.url)
+
+  def pyrax_set_credential_file(self, credentialFile, region=None):
+    """What pyrax.set_credential_file does, give or take"""
+    if pyrax.identity is None:
+      self.create_identity()
+    pyrax.identity.set_credential_file(credentialFile, region=region)
+    pyrax.identity.authenticate()
+    pyrax.regions = tuple(pyrax.identity.regions)
+    pyrax.services = tuple(pyrax.identity.services.keys())
+    pyrax.connect_to_services(region=region)
+
+  def new_run(self):
+    """Forget who we are, as if the script were run again - but keep the
+    connections, so they can be counted across runs.
+    """
+    pyrax.identity = None
+
+# vim: ts=2 sw=2 tw=78 expandtab
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+# Tests for buildhistory - recording build durations and predicting the
+# next one.
+
+# Copyright 2013 Scott Gilbert
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+import os
+import shutil
+import tempfile
+import unittest
+import stubs
+import buildhistory
+
+class PercentileTest(unittest.TestCase):
+  def test_empty(self):
+    self.assertEqual(buildhistory.percentile([], 50), None)
+
+  def test_single_value(self):
+    for pct in (0, 25, 50, 99, 100):
+      self.assertEqual(buildhistory.percentile([7], pct), 7)
+
+  def test_nearest_rank(self):
+    values = [4, 3, 2, 1]
+    self.assertEqual(buildhistory.percentile(values, 25), 1)
+    self.assertEqual(buildhistory.percentile(values, 50), 2)
+    self.assertEqual(buildhistory.percentile(values, 75), 3)
+    self.assertEqual(buildhistory.percentile(values, 76), 4)
+    self.assertEqual(buildhistory.percentile(range(1, 11), 95), 10)
+    self.assertEqual(buildhistory.percentile(range(1, 21), 95), 19)
+
+  def test_extremes(self):
+    values = [5, 1, 4, 2, 3]
+    self.assertEqual(buildhistory.percentile(values, 0), 1)
+    self.assertEqual(buildhistory.percentile(values, 100), 5)
+
+class HistoryTest(unittest.TestCase):
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+    self.history = os.path.join(self.dir, "history")
+
+  def tearDown(self):
+    shutil.rmtree(self.dir)
+
+  def record(self, seconds, flavor=2, image='img', region='DFW'):
+    buildhistory.record_build('server', flavor, image, region, seconds,
+                              self.history)
+
+  def test_record_and_load(self):
+    self.record(61.23)
+    self.record(70, flavor=3)
+    history = buildhistory.load_history(self.history)
+    self.assertEqual([h['seconds'] for h in history], [61.2, 70])
+    self.assertEqual(buildhistory.build_times('server', 2, 'img', 'DFW',
+                                              self.history), [61.2])
+
+  def test_half_written_line_is_skipped(self):
+    self.record(60)
+    with open(self.history, 'a') as hist:
+      hist.write('{"kind": "ser')
+    self.assertEqual(len(buildhistory.load_history(self.history)), 1)
+
+  def test_missing_file(self):
+    self.assertEqual(buildhistory.load_history(self.history), [])
+
+  def test_predict_needs_enough_samples(self):
+    self.record(60)
+    self.record(70)
+    self.assertEqual(buildhistory.predict_build_time('server', 2, 'img',
+                     'DFW', historyFile=self.history), None)
+    self.record(80)
+    self.assertEqual(buildhistory.predict_build_time('server', 2, 'img',
+                     'DFW', historyFile=self.history), 60)
+
+class ClientRegionTest(unittest.TestCase):
+  def test_digs_out_region(self):
+    class Obj(object):
+      pass
+    srv = Obj()
+    srv.manager = Obj()
+    srv.manager.api = Obj()
+    srv.manager.api.client = Obj()
+    srv.manager.api.client.region_name = 'ORD'
+    self.assertEqual(buildhistory.client_region(srv), 'ORD')
+    self.assertEqual(buildhistory.client_region(Obj()), 'unknown')
+
+if __name__ == "__main__":
+  unittest.main()
+
+# vim: ts=2 sw=2 tw=78 expandtab
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+# Tests for the challenge1 helpers the other scripts share: server names and
+# refreshing/waiting on a fleet of servers.
+
+# Copyright 2013 Scott Gilbert
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+import os
+import unittest
+import stubs
+import session
+import buildhistory
+import challenge1 as c1
+
+class ServerNamesTest(unittest.TestCase):
+  def test_names(self):
+    self.assertEqual(c1.server_names("web", 1), ["web"])
+    self.assertEqual(c1.server_names("web", 3), ["web1", "web2", "web3"])
+
+class RefreshTest(stubs.FastWaits, unittest.TestCase):
+  def setUp(self):
+    stubs.FastWaits.setUp(self)
+    self.cs = stubs.FakeCompute()
+    with stubs.quiet():
+      self.servers = c1.build_some_servers(self.cs, 2, "img", "web", 5,
+                                           concurrency=3)
+
+  def test_build_some_servers(self):
+    self.assertEqual(sorted(s.name for s in self.servers),
+                     ["web1", "web2", "web3", "web4", "web5"])
+    self.assertEqual(self.cs.servers.calls['create'], 5)
+
+  def test_one_listing_per_page(self):
+    c1.refresh_servers(self.servers, pageSize=2)
+    self.assertEqual(self.cs.servers.calls['list'], 3)
+    self.assertEqual(self.cs.servers.calls['get'], 0)
+    # adminPass only comes back from create, and must survive a refresh
+    self.assertEqual(self.servers[0].adminPass, 'secret')
+
+  def test_missing_server_fetched_on_its_own(self):
+    gone = self.servers[0]
+    del self.cs.servers.backend[gone.id]
+    self.assertRaises(stubs.NotFound, c1.refresh_servers, self.servers)
+    self.assertEqual(self.cs.servers.calls['get'], 1)
+
+  def test_skip_missing(self):
+    gone = self.servers[0]
+    del self.cs.servers.backend[gone.id]
+    self.assertEqual(c1.refresh_servers(self.servers, skipMissing=True),
+                     [gone])
+    self.assertEqual(c1.refresh_servers(self.servers[1:]), [])
+
+  def test_wait_for_servers(self):
+    done = []
+    with stubs.quiet():
+      c1.wait_for_servers(self.servers, lambda s: s.status == 'ACTIVE',
+                          on_done=done.append)
+    self.assertEqual(len(done), 5)
+    self.assertEqual(self.cs.servers.calls['list'], 4)
+
+  def test_iter_servers_with_networks_skips_errors(self):
+    cs = stubs.FakeCompute(buildTicks=2, failNames=["bad"])
+    with stubs.quiet():
+      servers = [cs.servers.create(n, "img", 2) for n in ("ok", "bad")]
+      ready = list(c1.iter_servers_with_networks(servers))
+    self.assertEqual([s.name for s in ready], ["ok"])
+
+class RegionCatalogTest(stubs.IdentityService, unittest.TestCase):
+  def setUp(self):
+    stubs.IdentityService.setUp(self)
+    self.catalog = c1._catalog
+    c1._catalog = None
+
+  def tearDown(self):
+    c1._catalog = self.catalog
+    stubs.IdentityService.tearDown(self)
+
+  def test_no_credential_file(self):
+    # nothing to look the cache up by, so authenticate and let pyrax find
+    # the credentials (or complain that it can't)
+    missing = os.path.join(self.dir, "missing")
+    catalog = c1.region_catalog(missing)
+    self.assertEqual(sorted(catalog.regions_for("compute")), ["DFW", "ORD"])
+    self.assertEqual(self.server.authCalls, 1)
+    self.assertEqual(session.load_cached_auth(missing, self.cacheFile), None)
+
+class BuildHistoryTest(stubs.FastWaits, unittest.TestCase):
+  def setUp(self):
+    stubs.FastWaits.setUp(self)
+    self.predicted = []
+    self.recorded = []
+    self.predict = buildhistory.predict_build_time
+    self.record = buildhistory.record_build
+    buildhistory.predict_build_time = \
+        lambda *args, **kwargs: self.predicted.append(args)
+    buildhistory.record_build = \
+        lambda *args, **kwargs: self.recorded.append(args)
+
+  def tearDown(self):
+    buildhistory.predict_build_time = self.predict
+    buildhistory.record_build = self.record
+    stubs.FastWaits.tearDown(self)
+
+  def test_builds_are_recorded(self):
+    cs = stubs.FakeCompute()
+    servers = [cs.servers.create("web", "img", 2)]
+    with stubs.quiet():
+      c1.wait_for_server_builds(servers)
+    self.assertEqual(self.predicted[0][:3], ('server', '2', 'img'))
+    self.assertEqual([r[:3] for r in self.recorded],
+                     [('server', '2', 'img')])
+
+  def test_boot_from_volume_has_no_image(self):
+    cs = stubs.FakeCompute()
+    servers = [cs.servers.create("web", "img", 2)]
+    cs.servers.backend[servers[0].id]['image'] = ""
+    done = []
+    with stubs.quiet():
+      c1.wait_for_server_builds(servers, on_done=done.append)
+    self.assertEqual(done, servers)
+    self.assertEqual((self.predicted, self.recorded), ([], []))
+
+if __name__ == "__main__":
+  unittest.main()
+
+# vim: ts=2 sw=2 tw=78 expandtab
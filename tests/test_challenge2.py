@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+# Tests for challenge2 - imaging a server.
+
+# Copyright 2013 Scott Gilbert
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+import unittest
+import stubs
+import buildhistory
+import challenge2 as c2
+
+class Image(object):
+  """An image that is ACTIVE on its first refresh"""
+  status = 'SAVING'
+  progress = 0
+
+  def get(self):
+    self.status, self.progress = 'ACTIVE', 100
+
+def compute():
+  image = Image()
+  return stubs._Thing(
+      region_name="DFW",
+      servers=stubs._Thing(create_image=lambda srv, name: "img-new"),
+      images=stubs._Thing(get=lambda imageId: image))
+
+class ImageServerTest(stubs.FastWaits, unittest.TestCase):
+  def setUp(self):
+    stubs.FastWaits.setUp(self)
+    self.predicted = []
+    self.recorded = []
+    self.predict = buildhistory.predict_build_time
+    self.record = buildhistory.record_build
+    buildhistory.predict_build_time = \
+        lambda *args, **kwargs: self.predicted.append(args)
+    buildhistory.record_build = \
+        lambda *args, **kwargs: self.recorded.append(args)
+
+  def tearDown(self):
+    buildhistory.predict_build_time = self.predict
+    buildhistory.record_build = self.record
+    stubs.FastWaits.tearDown(self)
+
+  def source(self, image):
+    return stubs._Thing(id="srv-1", name="web", image=image,
+                        flavor={'id': '2'})
+
+  def test_build_is_recorded(self):
+    with stubs.quiet():
+      imageId = c2.image_server(compute(), self.source({'id': 'img'}))
+    self.assertEqual(imageId, "img-new")
+    self.assertEqual(self.predicted[0][:3], ('image', '2', 'img'))
+    self.assertEqual([r[:3] for r in self.recorded], [('image', '2', 'img')])
+
+  def test_boot_from_volume_has_no_image(self):
+    with stubs.quiet():
+      c2.image_server(compute(), self.source(""))
+    self.assertEqual((self.predicted, self.recorded), ([], []))
+
+if __name__ == "__main__":
+  unittest.main()
+
+# vim: ts=2 sw=2 tw=78 expandtab
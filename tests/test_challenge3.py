@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+# Tests for challenge3 - uploading and syncing a directory to a container,
+# against an in-memory Swift.
+
+# Copyright 2013 Scott Gilbert
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+import os
+import shutil
+import StringIO
+import tempfile
+import threading
+import itertools
+import unittest
+import stubs
+import session
+import swiftapi
+import uploadmeter
+import challenge3 as c3
+
+_accounts = itertools.count(1)
+
+class UploadTestCase(unittest.TestCase):
+  def setUp(self):
+    self.swift = stubs.FakeSwift()
+    self.url = "http://swift.test/v1/AUTH_c3_%d" % next(_accounts)
+    self.swift.mount(session.http_session(), self.url)
+    self.dir = tempfile.mkdtemp()
+    # the meter writes to the real stdout unless told otherwise
+    self.meter = uploadmeter.UploadMeter
+    uploadmeter.UploadMeter = \
+        lambda traceFile=None: self.meter(traceFile, StringIO.StringIO())
+
+  def tearDown(self):
+    uploadmeter.UploadMeter = self.meter
+    shutil.rmtree(self.dir)
+
+  def write(self, name, data):
+    path = os.path.join(self.dir, name)
+    if not os.path.isdir(os.path.dirname(path)):
+      os.makedirs(os.path.dirname(path))
+    with open(path, 'wb') as f:
+      f.write(data)
+    return path
+
+  def work(self):
+    for path, objName in c3.walk_files(self.dir):
+      yield (path, objName, os.stat(path))
+
+  def upload(self, record=None, concurrency=4):
+    """Run upload_files in a thread, so a hang fails the test instead of
+    hanging it.
+    """
+    result = {}
+
+    def run():
+      with stubs.quiet():
+        result['stats'] = c3.upload_files(self.url, "token", "c", self.work(),
+                                          concurrency, record)
+
+    thread = threading.Thread(target=run)
+    thread.daemon = True
+    thread.start()
+    thread.join(30)
+    self.assertFalse(thread.is_alive(), "upload_files hung")
+    return result['stats']
+
+class UploadFilesTest(UploadTestCase):
+  def test_counts(self):
+    for i in xrange(40):
+      self.write("d%d/f%02d" % (i % 3, i), "x" * i)
+    recorded = []
+    stats = self.upload(lambda *args: recorded.append(args))
+    self.assertEqual((stats['files'], stats['bytes'], stats['failed'],
+                      stats['inflight']), (40, sum(xrange(40)), 0, 0))
+    self.assertEqual(len(recorded), 40)
+    self.assertEqual(len(self.swift.containers["c"]), 40)
+
+  def test_record_failure_counts_as_failed(self):
+    for i in xrange(5):
+      self.write("f%d" % i, "data")
+
+    def record(path, objName, st, etag):
+      if objName == "f2":
+        raise IOError("disk full")
+
+    stats = self.upload(record)
+    self.assertEqual((stats['files'], stats['failed'], stats['inflight']),
+                     (4, 1, 0))
+
+class SyncTest(UploadTestCase):
+  def setUp(self):
+    UploadTestCase.setUp(self)
+    self.cf = stubs.FakeCloudFiles(self.url)
+    self.cache = {}
+    self.load = c3.load_etag_cache
+    self.save = c3.save_etag_cache
+    c3.load_etag_cache = lambda: self.cache
+    c3.save_etag_cache = lambda cache: None
+
+  def tearDown(self):
+    c3.load_etag_cache = self.load
+    c3.save_etag_cache = self.save
+    UploadTestCase.tearDown(self)
+
+  def sync(self, deleteOrphans=True):
+    before = len(self.swift.requests)
+    with stubs.quiet():
+      c3.sync_dir_to_container(self.cf, self.dir, "c", 2, deleteOrphans)
+    return [r for r in self.swift.requests[before:] if r[0] != 'GET']
+
+  def test_walk_names_are_unicode(self):
+    self.write(u"caf\xe9/\u65e5\u672c".encode('utf-8'), "x")
+    self.write("plain", "y")
+    self.assertEqual([name for path, name in c3.walk_files(self.dir)],
+                     [u"plain", u"caf\xe9/\u65e5\u672c"])
+    self.assertTrue(all(isinstance(name, unicode)
+                        for path, name in c3.walk_files(self.dir)))
+
+  def test_non_utf8_name_is_skipped(self):
+    self.write("bad\xff", "x")
+    self.write("good", "y")
+    with stubs.quiet():
+      names = [name for path, name in c3.walk_files(self.dir)]
+    self.assertEqual(names, [u"good"])
+
+  def test_non_ascii_names_sync_once(self):
+    self.write(u"caf\xe9.txt".encode('utf-8'), "coffee")
+    self.write("plain.txt", "plain")
+    self.assertEqual(len(self.sync()), 3)    # container PUT, two objects
+    # nothing changed: no uploads, and nothing is taken for an orphan
+    self.assertEqual([r[0] for r in self.sync()], ['PUT'])
+    self.assertEqual(sorted(self.swift.containers["c"]),
+                     [u"caf\xe9.txt".encode('utf-8'), "plain.txt"])
+
+  def test_changed_file_is_uploaded_again(self):
+    self.write("f", "same size")
+    self.sync()
+    self.assertEqual([r[0] for r in self.sync()], ['PUT'])
+    self.write("f", "SAME SIZE")
+    # the inode and mtime may not change fast enough to notice
+    self.cache.clear()
+    made = self.sync()
+    self.assertEqual([r[0] for r in made], ['PUT', 'HEAD', 'PUT'])
+    self.assertEqual(self.swift.containers["c"]["f"]['data'], "SAME SIZE")
+
+  def test_orphans_are_deleted(self):
+    self.write(u"caf\xe9.txt".encode('utf-8'), "coffee")
+    self.sync()
+    self.swift.containers["c"]["gone"] = {'etag': '', 'bytes': 0}
+    made = self.sync()
+    self.assertEqual([r[0] for r in made], ['PUT', 'POST'])
+    self.assertEqual(sorted(self.swift.containers["c"]),
+                     [u"caf\xe9.txt".encode('utf-8')])
+
+  def test_upload_checks_only_existing_objects(self):
+    for i in xrange(5):
+      self.write("f%d" % i, "new")
+    self.swift.containers["c"] = {"f0": {'etag': '', 'bytes': 0}}
+    manifest = os.path.join(self.dir, os.pardir,
+                            os.path.basename(self.dir) + ".manifest")
+    before = len(self.swift.requests)
+    try:
+      with stubs.quiet():
+        c3.upload_dir_to_container(self.cf, self.dir, "c", 2, manifest)
+    finally:
+      os.remove(manifest)
+    made = self.swift.requests[before:]
+    # one listing, and old segments are only looked for where there was
+    # an object already
+    heads = [r[1] for r in made if r[0] == 'HEAD']
+    self.assertEqual(len(heads), 1)
+    self.assertTrue(heads[0].endswith("/c/f0"))
+    self.assertEqual(len([r for r in made if r[0] == 'PUT']), 6)
+
+  def test_resume_with_non_ascii_names(self):
+    self.write(u"caf\xe9.txt".encode('utf-8'), "coffee")
+    manifest = os.path.join(self.dir, os.pardir,
+                            os.path.basename(self.dir) + ".manifest")
+    try:
+      for run in (1, 2):
+        before = len(self.swift.requests)
+        with stubs.quiet():
+          c3.upload_dir_to_container(self.cf, self.dir, "c", 2, manifest)
+        puts = [r for r in self.swift.requests[before:]
+                if r[0] == 'PUT' and r[1].endswith("caf\xc3\xa9.txt")]
+        # the second run finds the file in the manifest
+        self.assertEqual(len(puts), 1 if run == 1 else 0)
+    finally:
+      os.remove(manifest)
+
+if __name__ == "__main__":
+  unittest.main()
+
+# vim: ts=2 sw=2 tw=78 expandtab
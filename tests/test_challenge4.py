@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+# Tests for challenge4 - reading, checking and adding DNS records, against
+# an in-memory Cloud DNS.
+
+# Copyright 2013 Scott Gilbert
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+import os
+import json
+import StringIO
+import tempfile
+import unittest
+import stubs
+import challenge4 as c4
+
+class ReadRecordsTest(unittest.TestCase):
+  def read(self, text):
+    return c4.read_records(StringIO.StringIO(text))
+
+  def test_csv(self):
+    self.assertEqual(self.read("fqdn,ip,type,ttl\n"
+                               "# a comment\n"
+                               "\n"
+                               "www.example.com, 192.0.2.1\n"
+                               "mail.example.com,192.0.2.2,A,600\n"),
+                     [("www.example.com", "192.0.2.1", None, None),
+                      ("mail.example.com", "192.0.2.2", "A", "600")])
+
+  def test_json(self):
+    self.assertEqual(self.read('[{"fqdn": "a.example.com", "ip": "::1"},'
+                               ' ["b.example.com", "192.0.2.1", "A", 60]]'),
+                     [("a.example.com", "::1", None, None),
+                      ("b.example.com", "192.0.2.1", "A", 60)])
+
+  def test_bad_ttl_does_not_stop_the_read(self):
+    records = self.read("a.example.com,192.0.2.1,,abc\n"
+                        "b.example.com,192.0.2.2\n")
+    self.assertEqual(len(records), 2)
+
+class CreateRecordsTest(unittest.TestCase):
+  def test_bad_rows_are_reported(self):
+    dns = stubs.FakeDNS(["example.com"])
+    records = c4.read_records(StringIO.StringIO(
+        "a.example.com,192.0.2.1,,abc\n"
+        "b.example.com,192.0.2.2,,600\n"
+        "c.example.com,not-an-address\n"
+        "-bad-.example.com,192.0.2.3\n"
+        "d.example.com,2001:db8::1\n"))
+    with stubs.quiet():
+      added, failed = c4.create_dns_records(dns, records)
+    self.assertEqual(added, 2)
+    self.assertEqual([name for name, reason in failed],
+                     ["a.example.com", "c.example.com", "-bad-.example.com"])
+    self.assertTrue("TTL" in failed[0][1])
+    self.assertEqual([(r['name'], r['type'], r['ttl'])
+                      for r in dns.domains[0].records],
+                     [("b.example.com", "A", 600),
+                      ("d.example.com", "AAAA", 300)])
+
+  def test_typed_address_is_checked(self):
+    dns = stubs.FakeDNS(["example.com"])
+    records = [("a.example.com", "192.0.2.300", "A", None),
+               ("b.example.com", "192.0.2.1", "AAAA", None),
+               ("c.example.com", "192.0.2.1", "a", None),
+               ("d.example.com", "www.example.com", "CNAME", None)]
+    with stubs.quiet():
+      added, failed = c4.create_dns_records(dns, records)
+    self.assertEqual(added, 2)
+    self.assertEqual([name for name, reason in failed],
+                     ["a.example.com", "b.example.com"])
+    self.assertTrue("AAAA record" in failed[1][1])
+    self.assertEqual([(r['name'], r['type'])
+                      for r in dns.domains[0].records],
+                     [("c.example.com", "A"), ("d.example.com", "CNAME")])
+
+class FakeRecord(object):
+  """A Cloud DNS record; like pyrax's, only MX and SRV have a priority"""
+  def __init__(self, name, rtype, data, ttl=300, priority=None):
+    self.name = name
+    self.type = rtype
+    self.data = data
+    self.ttl = ttl
+    if priority is not None:
+      self.priority = priority
+
+class ZoneDiffTest(unittest.TestCase):
+  def test_diff(self):
+    current = [FakeRecord("example.com", "NS", "ns.example.net"),
+               FakeRecord("www.example.com", "A", "192.0.2.1"),
+               FakeRecord("ftp.example.com", "A", "192.0.2.2", ttl=60),
+               FakeRecord("old.example.com", "A", "192.0.2.3"),
+               FakeRecord("example.com", "MX", "mail.example.com", 300, 5)]
+    desired = [{'name': 'www', 'type': 'a', 'data': '192.0.2.1'},
+               {'name': 'ftp', 'type': 'A', 'data': '192.0.2.9'},
+               {'name': 'new.example.com', 'type': 'A', 'data': '192.0.2.4'},
+               {'name': '@', 'type': 'MX', 'data': 'mail.example.com',
+                'priority': 10}]
+    adds, updates, deletes = c4.zone_diff("example.com", current, desired)
+    self.assertEqual([a['name'] for a in adds], ["new.example.com"])
+    self.assertEqual([(u[0].name, u[1]) for u in updates],
+                     [("example.com", {'priority': 10}),
+                      ("ftp.example.com", {'data': '192.0.2.9', 'ttl': 300})])
+    self.assertEqual([d.name for d in deletes], ["old.example.com"])
+
+  def test_priority_on_a_record_without_one(self):
+    current = [FakeRecord("www.example.com", "A", "192.0.2.1")]
+    desired = [{'name': 'www', 'type': 'A', 'data': '192.0.2.1',
+                'priority': 10}]
+    adds, updates, deletes = c4.zone_diff("example.com", current, desired)
+    self.assertEqual([u[1] for u in updates], [{'priority': 10}])
+
+  def test_bad_records_are_rejected_up_front(self):
+    for rec in ({'name': 'www', 'data': '192.0.2.1'},
+                {'name': 'www', 'type': 'A'},
+                {'type': 'A', 'data': '192.0.2.1'},
+                {'name': 'www', 'type': 'A', 'data': '192.0.2.1',
+                 'ttl': 'soon'},
+                {'name': '@', 'type': 'MX', 'data': 'mail', 'priority': []},
+                "www A 192.0.2.1"):
+      self.assertRaises(ValueError, c4.zone_diff, "example.com", [], [rec])
+
+class ZoneFileTest(unittest.TestCase):
+  def read(self, spec):
+    fd, path = tempfile.mkstemp()
+    with os.fdopen(fd, 'w') as zf:
+      if isinstance(spec, basestring):
+        zf.write(spec)
+      else:
+        json.dump(spec, zf)
+    try:
+      return c4.read_zone_file(path)
+    finally:
+      os.remove(path)
+
+  def test_read(self):
+    records = [{'name': 'www', 'type': 'A', 'data': '192.0.2.1'}]
+    self.assertEqual(self.read({'zone': 'example.com', 'records': records}),
+                     ('example.com', records))
+
+  def test_record_without_type(self):
+    try:
+      self.read({'zone': 'example.com',
+                 'records': [{'name': 'www', 'type': 'A', 'data': 'x'},
+                             {'name': 'ftp', 'data': '192.0.2.1'}]})
+    except ValueError as err:
+      self.assertTrue("record 2 has no type" in str(err))
+    else:
+      self.fail("no ValueError")
+
+  @unittest.skipUnless(c4.canDoYAML, "PyYAML is not installed")
+  def test_bad_yaml(self):
+    try:
+      self.read("zone: example.com\nrecords: [{name: www\n")
+    except ValueError as err:
+      self.assertTrue("is not valid YAML" in str(err))
+    else:
+      self.fail("no ValueError")
+
+  def test_bad_json(self):
+    self.assertRaises(ValueError, self.read, '{"zone": "example.com",')
+
+class ValidateTest(unittest.TestCase):
+  def test_lines(self):
+    lines = ["fqdn,ip,type,ttl\n",
+             "# comment\n",
+             "\n",
+             "www.example.com,192.0.2.1\n",
+             '"quoted.example.com","2001:db8::1",AAAA\n',
+             "bad_name!,192.0.2.300\n",
+             '"unbalanced.example.com,192.0.2.2\n',
+             "last.example.com\n"]
+    counts, errors = c4.validate_lines(lines, chunkSize=3)
+    self.assertEqual(counts, {'lines': 5, 'hostnames': 3, 'ipv4': 1,
+                              'ipv6': 1})
+    self.assertEqual([(e[0], e[1]) for e in errors],
+                     [(6, "bad_name!"), (6, "192.0.2.300"),
+                      (7, "unbalanced.example.com,192.0.2.2")])
+
+  def test_processes_agree(self):
+    lines = ["host%d.example.com,192.0.2.%d" % (i, i) for i in xrange(300)]
+    self.assertEqual(c4.validate_lines(lines, processes=2, chunkSize=50),
+                     c4.validate_lines(lines))
+
+if __name__ == "__main__":
+  unittest.main()
+
+# vim: ts=2 sw=2 tw=78 expandtab
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+# Tests for challenge7 - loadbalancer changes and node adds.
+
+# Copyright 2013 Scott Gilbert
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+import unittest
+import stubs
+import challenge7 as c7
+
+def server(n):
+  return stubs._Thing(name="web%d" % n,
+                      networks={'private': ['10.0.0.%d' % n]})
+
+class TryChangeTest(stubs.FastWaits, unittest.TestCase):
+  def setUp(self):
+    stubs.FastWaits.setUp(self)
+    self.lb = stubs.LoadBalancer("try-%d" % id(self), [])
+
+  def test_made_when_active(self):
+    self.assertTrue(c7.try_change_lb(self.lb, self.lb.set_error_page, "x"))
+    self.assertEqual([c[0] for c in self.lb.changes], ['set_error_page'])
+
+  def test_not_while_another_change_is_under_way(self):
+    lock = c7._lb_lock(self.lb)
+    with lock:
+      self.assertFalse(c7.try_change_lb(self.lb, self.lb.set_error_page,
+                                        "x"))
+    self.assertEqual(self.lb.changes, [])
+
+  def test_refused_change_is_not_an_error(self):
+    def refused():
+      raise stubs.ImmutableEntity("PENDING_UPDATE")
+    self.assertFalse(c7.try_change_lb(self.lb, refused))
+
+  def test_other_errors_are_raised(self):
+    def broken():
+      raise ValueError("bad node")
+    self.assertRaises(ValueError, c7.try_change_lb, self.lb, broken)
+
+class AddServersTest(stubs.FastWaits, unittest.TestCase):
+  def test_refused_adds_are_kept_for_later(self):
+    clb = stubs.FakeLoadBalancers()
+    lb = stubs.LoadBalancer("add-%d" % id(self), [])
+    add = lb.add_nodes
+    calls = []
+
+    def add_nodes(nodes):
+      calls.append(len(nodes))
+      if len(calls) == 1:
+        # another change got in between the status check and the add
+        lb.status = 'PENDING_UPDATE'
+      add(nodes)
+
+    lb.add_nodes = add_nodes
+    c7.add_servers_as_they_come_up(clb, lb, [server(n) for n in (1, 2, 3)])
+    self.assertEqual(sorted(n.address for n in lb.nodes),
+                     ["10.0.0.1", "10.0.0.2", "10.0.0.3"])
+    self.assertEqual(lb.status, 'ACTIVE')
+
+if __name__ == "__main__":
+  unittest.main()
+
+# vim: ts=2 sw=2 tw=78 expandtab
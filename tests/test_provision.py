@@ -0,0 +1,438 @@
+# -*- coding: utf-8 -*-
+# Tests for provision - Futures, coroutines and the Provisioner's poller.
+
+# Copyright 2013 Scott Gilbert
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+import os
+import time
+import shutil
+import tempfile
+import threading
+import itertools
+import unittest
+import stubs
+import waiter
+import session
+import buildhistory
+import provision
+import challenge10 as c10
+import challenge11 as c11
+
+_accounts = itertools.count(1)
+
+class FutureTest(unittest.TestCase):
+  def test_result_and_callbacks(self):
+    future = provision.Future()
+    seen = []
+    future.add_done_callback(lambda f: seen.append(f.result()))
+    self.assertFalse(future.done())
+    future.set_result(3)
+    future.set_result(4)    # only the first one counts
+    self.assertEqual(seen, [3])
+    self.assertEqual(future.result(), 3)
+    future.add_done_callback(lambda f: seen.append(f.result()))
+    self.assertEqual(seen, [3, 3])
+
+  def test_exception(self):
+    future = provision.Future()
+    future.set_exception(KeyError("k"))
+    self.assertTrue(isinstance(future.exception(), KeyError))
+    self.assertRaises(KeyError, future.result)
+
+  def test_timeout(self):
+    self.assertRaises(waiter.WaitTimeout, provision.Future().result, 0.01)
+
+  def test_set_from_another_thread(self):
+    future = provision.Future()
+    threading.Timer(0.05, future.set_result, ["later"]).start()
+    self.assertEqual(future.result(5), "later")
+
+class GatherTest(unittest.TestCase):
+  def test_keeps_order(self):
+    futures = [provision.Future() for i in xrange(3)]
+    gathered = provision.gather(futures)
+    for i in (2, 0, 1):
+      self.assertFalse(gathered.done())
+      futures[i].set_result(i)
+    self.assertEqual(gathered.result(), [0, 1, 2])
+
+  def test_empty(self):
+    self.assertEqual(provision.gather([]).result(), [])
+
+  def test_exceptions(self):
+    futures = [provision.Future() for i in xrange(2)]
+    futures[0].set_result(1)
+    futures[1].set_exception(ValueError("bad"))
+    self.assertRaises(ValueError, provision.gather(futures).result)
+    results = provision.gather(futures, returnExceptions=True).result()
+    self.assertEqual(results[0], 1)
+    self.assertTrue(isinstance(results[1], ValueError))
+
+class SpawnTest(unittest.TestCase):
+  def test_return(self):
+    ready = provision.Future()
+    ready.set_result(2)
+    pending = provision.Future()
+
+    def add():
+      first = yield ready
+      second, third = yield [pending, ready]
+      raise provision.Return(first + second + third)
+
+    result = provision.spawn(add())
+    self.assertFalse(result.done())
+    pending.set_result(5)
+    self.assertEqual(result.result(), 9)
+
+  def test_no_return_value(self):
+    def nothing():
+      if False:
+        yield
+    self.assertEqual(provision.spawn(nothing()).result(), None)
+
+  def test_exception_thrown_into_coroutine(self):
+    failing = provision.Future()
+
+    def catch():
+      try:
+        yield failing
+      except KeyError:
+        raise provision.Return("caught")
+
+    result = provision.spawn(catch())
+    failing.set_exception(KeyError("k"))
+    self.assertEqual(result.result(), "caught")
+
+  def test_must_yield_futures(self):
+    def bad():
+      yield 42
+    self.assertRaises(TypeError, provision.spawn(bad()).result)
+
+class ProvisionerTest(stubs.FastWaits, unittest.TestCase):
+  def setUp(self):
+    stubs.FastWaits.setUp(self)
+    self.p = provision.Provisioner(concurrency=4)
+
+  def tearDown(self):
+    self.p.close()
+    stubs.FastWaits.tearDown(self)
+
+  def test_call(self):
+    self.assertEqual(self.p.call(lambda a, b=0: a + b, 1, b=2).result(5), 3)
+    self.assertRaises(ZeroDivisionError,
+                      self.p.call(lambda: 1 / 0).result, 5)
+
+  def test_calls_run_concurrently(self):
+    started = time.time()
+    futures = [self.p.call(time.sleep, 0.2) for i in xrange(4)]
+    provision.gather(futures).result(5)
+    self.assertTrue(time.time() - started < 0.6)
+
+  def test_batched_waits_share_listings(self):
+    cs = stubs.FakeCompute(buildTicks=3, failNames=["web3"])
+    servers = [cs.servers.create("web%d" % i, "img", 2)
+               for i in xrange(1, 4)]
+    statuses = provision.gather([self.p.wait_for_status(srv, batch=True)
+                                 for srv in servers]).result(5)
+    self.assertEqual(statuses, ['ACTIVE', 'ACTIVE', 'ERROR'])
+    self.assertEqual(cs.servers.calls['get'], 0)
+    self.assertTrue(cs.servers.calls['list'] <= 4)
+
+  def test_deleted_server_only_fails_its_own_wait(self):
+    cs = stubs.FakeCompute(buildTicks=3)
+    servers = [cs.servers.create("web%d" % i, "img", 2)
+               for i in xrange(1, 4)]
+    servers[1].delete()
+    futures = [self.p.wait_for_status(srv, batch=True) for srv in servers]
+    results = provision.gather(futures, True).result(5)
+    self.assertEqual(results[0], 'ACTIVE')
+    self.assertTrue(isinstance(results[1], RuntimeError))
+    self.assertEqual(results[2], 'ACTIVE')
+
+  def test_wait_until_deadline(self):
+    future = self.p.wait_until(lambda: False, deadline=0.05)
+    self.assertRaises(waiter.WaitTimeout, future.result, 5)
+
+  def test_close_fails_pending_waits(self):
+    future = self.p.wait_until(lambda: False)
+    self.p.close()
+    self.assertRaises(RuntimeError, future.result, 5)
+    self.p = provision.Provisioner(concurrency=1)
+
+  def test_run(self):
+    def double(p):
+      value = yield p.call(lambda: 21)
+      raise provision.Return(value * 2)
+    self.assertEqual(provision.run(double, concurrency=2), 42)
+
+class WrapperTestCase(stubs.FastWaits, unittest.TestCase):
+  """Runs the provision coroutines against the stub clients, with no build
+  history read or written.
+  """
+  def setUp(self):
+    stubs.FastWaits.setUp(self)
+    self.predict = buildhistory.predict_build_time
+    self.record = buildhistory.record_build
+    buildhistory.predict_build_time = lambda *args, **kwargs: None
+    buildhistory.record_build = lambda *args, **kwargs: None
+    self.cs = stubs.FakeCompute(buildTicks=3, failNames=["web3"])
+    self.cbs = stubs.FakeBlockStorage()
+    self.clb = stubs.FakeLoadBalancers()
+    self.dns = stubs.FakeDNS(["example.com"])
+
+  def tearDown(self):
+    buildhistory.predict_build_time = self.predict
+    buildhistory.record_build = self.record
+    stubs.FastWaits.tearDown(self)
+
+  def run_quietly(self, coroutine):
+    with stubs.quiet():
+      return provision.run(coroutine, concurrency=4)
+
+  def lb_changes(self, lb):
+    """The changes made to a loadbalancer once it had all its nodes"""
+    return [c for c in lb.changes if c[0] != 'add_nodes']
+
+class ChangeLBTest(WrapperTestCase):
+  def test_changes_wait_for_active(self):
+    lb = stubs.LoadBalancer("lb", [])
+
+    def changes(p):
+      yield provision.spawn(provision.change_lb(p, lb, lb.set_error_page,
+                                                "<html/>"))
+      yield provision.spawn(provision.change_lb(p, lb, lb.add_health_monitor,
+                                                type="CONNECT"))
+
+    # the stub refuses a change while the loadbalancer is not ACTIVE
+    self.run_quietly(changes)
+    self.assertEqual([c[0] for c in lb.changes],
+                     ['set_error_page', 'add_health_monitor'])
+    self.assertEqual(lb.status, 'ACTIVE')
+
+class BuildVolumeTest(WrapperTestCase):
+  def test_attached(self):
+    def build(p):
+      srv = provision.spawn(provision.build_server(p, self.cs, "web1", "img",
+                                                   2))
+      vol = yield provision.spawn(provision.build_volume(p, self.cbs,
+                                                         "web1-vol", 10, srv))
+      raise provision.Return(vol)
+
+    vol = self.run_quietly(build)
+    self.assertEqual(vol.status, 'in-use')
+    self.assertEqual(vol.attachedTo.name, "web1")
+
+  def test_deleted_when_server_fails(self):
+    def build(p):
+      srv = provision.spawn(provision.build_server(p, self.cs, "web3", "img",
+                                                   2))
+      yield provision.spawn(provision.build_volume(p, self.cbs, "web3-vol",
+                                                   10, srv))
+
+    self.assertRaises(RuntimeError, self.run_quietly, build)
+    vol, = self.cbs.volumes
+    self.assertTrue(vol.deleted)
+    self.assertEqual(vol.attachedTo, None)
+
+  def test_volume_failure(self):
+    cbs = stubs.FakeBlockStorage(failNames=["web1-vol"])
+
+    def build(p):
+      srv = provision.spawn(provision.build_server(p, self.cs, "web1", "img",
+                                                   2))
+      yield provision.spawn(provision.build_volume(p, cbs, "web1-vol", 10,
+                                                   srv))
+
+    self.assertRaises(RuntimeError, self.run_quietly, build)
+
+class BuildSiteTest(WrapperTestCase):
+  def test_everything(self):
+    names = ["web1", "web2", "web3"]
+    servers, volumes, lb, failed = self.run_quietly(
+        lambda p: provision.build_site(p, self.cs, 2, "img", names,
+                                       cbs=self.cbs, volumeSize=10,
+                                       clb=self.clb, LBName="lb",
+                                       monitor=True, errorPage="<html/>",
+                                       cert="CERT", key="KEY", dns=self.dns,
+                                       FQDN="www.example.com"))
+    self.assertEqual([s.name for s in servers], ["web1", "web2"])
+    self.assertEqual([v.name for v in volumes], ["web1-vol", "web2-vol"])
+    self.assertEqual(sorted(failed), ["web3", "web3-vol"])
+    # the failed server's volume is not left behind
+    self.assertEqual([v.name for v in self.cbs.volumes if v.deleted],
+                     ["web3-vol"])
+
+    self.assertEqual(sorted(n.address for n in lb.nodes),
+                     ["10.0.0.1", "10.0.0.2"])
+    changes = self.lb_changes(lb)
+    self.assertEqual([c[0] for c in changes],
+                     ['add_health_monitor', 'set_error_page',
+                      'add_ssl_termination'])
+    self.assertEqual(changes[2][2]['certificate'], "CERT")
+    domain, = self.dns.domains
+    self.assertEqual(domain.records,
+                     [{"type": "A", "name": "www.example.com",
+                       "data": "203.0.113.10", "ttl": 300}])
+
+  def test_no_loadbalancer_without_servers(self):
+    servers, volumes, lb, failed = self.run_quietly(
+        lambda p: provision.build_site(p, self.cs, 2, "img", ["web3"],
+                                       clb=self.clb, LBName="lb"))
+    self.assertEqual((servers, volumes, lb), ([], [], None))
+    self.assertEqual(sorted(failed), ["web3"])
+    self.assertEqual(self.clb.lbs, [])
+
+  def test_loadbalancer_built_as_servers_come_up(self):
+    # servers get their IPs on the third listing but take ten to go ACTIVE
+    self.cs = stubs.FakeCompute(buildTicks=10)
+    create = self.clb.create
+    statuses = []
+
+    def create_lb(*args, **kwargs):
+      statuses.extend(info['status']
+                      for info in self.cs.servers.backend.values())
+      return create(*args, **kwargs)
+
+    self.clb.create = create_lb
+    servers, volumes, lb, failed = self.run_quietly(
+        lambda p: provision.build_site(p, self.cs, 2, "img",
+                                       ["web1", "web2", "web3"],
+                                       clb=self.clb, LBName="lb"))
+    self.assertEqual(failed, {})
+    self.assertEqual(statuses, ['BUILD'] * 3)
+    self.assertEqual(len(lb.nodes), 3)
+    self.assertEqual(lb.status, 'ACTIVE')
+
+  def test_loadbalancer_failure_keeps_servers(self):
+    def create_lb(*args, **kwargs):
+      raise RuntimeError("over quota")
+
+    self.clb.create = create_lb
+    servers, volumes, lb, failed = self.run_quietly(
+        lambda p: provision.build_site(p, self.cs, 2, "img",
+                                       ["web1", "web2"], clb=self.clb,
+                                       LBName="lb", dns=self.dns,
+                                       FQDN="www.example.com"))
+    self.assertEqual([s.name for s in servers], ["web1", "web2"])
+    self.assertEqual(lb, None)
+    self.assertEqual(sorted(failed), ["dns", "loadbalancer"])
+    self.assertEqual(self.dns.domains[0].records, [])
+
+  def test_dns_failure_keeps_loadbalancer(self):
+    def add_record(rec):
+      raise RuntimeError("bad zone")
+
+    self.dns.domains[0].add_record = add_record
+    servers, volumes, lb, failed = self.run_quietly(
+        lambda p: provision.build_site(p, self.cs, 2, "img",
+                                       ["web1", "web2"], clb=self.clb,
+                                       LBName="lb", monitor=True,
+                                       dns=self.dns, FQDN="www.example.com"))
+    self.assertEqual(len(servers), 2)
+    self.assertEqual(len(lb.nodes), 2)
+    self.assertEqual([c[0] for c in self.lb_changes(lb)],
+                     ['add_health_monitor'])
+    self.assertEqual(sorted(failed), ["dns"])
+
+  def test_stack(self):
+    cn = stubs.FakeNetworks()
+    servers, volumes, lb, failed = self.run_quietly(
+        lambda p: c11.build_stack(p, self.cs, cn, self.cbs, self.clb,
+                                  self.dns, 2, "img", ["web1", "web2"],
+                                  "net", "192.168.3.0/24", 10, "lb", "CERT",
+                                  "KEY", "www.example.com"))
+    self.assertEqual(failed, {})
+    self.assertEqual(len(volumes), 2)
+    network, = cn.networks
+    self.assertEqual(network.cidr, "192.168.3.0/24")
+    for srv in servers:
+      self.assertTrue({'net-id': network.id} in
+                      self.cs.servers.backend[srv.id]['nics'])
+    self.assertEqual([c[0] for c in self.lb_changes(lb)],
+                     ['add_ssl_termination'])
+
+class StoreFileTest(WrapperTestCase):
+  def setUp(self):
+    WrapperTestCase.setUp(self)
+    self.url = "http://swift.test/v1/AUTH_p%d" % next(_accounts)
+    self.swift = stubs.FakeSwift()
+    self.swift.mount(session.http_session(), self.url)
+    self.cf = stubs.FakeCloudFiles(self.url)
+    self.dir = tempfile.mkdtemp()
+    self.page = os.path.join(self.dir, "error.html")
+    with open(self.page, 'w') as f:
+      f.write("<html>sorry</html>")
+
+  def tearDown(self):
+    shutil.rmtree(self.dir)
+    WrapperTestCase.tearDown(self)
+
+  def test_store(self):
+    self.run_quietly(lambda p: provision.store_file(p, self.cf, "backup",
+                                                    self.page))
+    self.assertEqual(self.swift.containers["backup"]["error.html"]['data'],
+                     "<html>sorry</html>")
+
+  def test_website(self):
+    servers, lb, failed = self.run_quietly(
+        lambda p: c10.build_website(p, self.cs, self.clb, self.dns, self.cf,
+                                    2, "img", ["web1", "web2"], {}, "lb",
+                                    "www.example.com", self.page, "backup"))
+    self.assertEqual(failed, {})
+    self.assertEqual([s.name for s in servers], ["web1", "web2"])
+    changes = self.lb_changes(lb)
+    self.assertEqual([c[0] for c in changes],
+                     ['add_health_monitor', 'set_error_page'])
+    self.assertEqual(changes[1][1], ("<html>sorry</html>",))
+    self.assertEqual(self.swift.containers["backup"]["error.html"]['data'],
+                     "<html>sorry</html>")
+
+  def test_website_keeps_servers_when_loadbalancer_fails(self):
+    def create_lb(*args, **kwargs):
+      raise RuntimeError("over quota")
+
+    self.clb.create = create_lb
+    servers, lb, failed = self.run_quietly(
+        lambda p: c10.build_website(p, self.cs, self.clb, self.dns, self.cf,
+                                    2, "img", ["web1", "web2"], {}, "lb",
+                                    "www.example.com", self.page, "backup"))
+    self.assertEqual([s.name for s in servers], ["web1", "web2"])
+    self.assertEqual(lb, None)
+    self.assertEqual(sorted(failed), ["dns", "loadbalancer"])
+    self.assertTrue("error.html" in self.swift.containers["backup"])
+
+class BuildDatabaseTest(WrapperTestCase):
+  def test_database_and_user(self):
+    dbi, password = self.run_quietly(
+        lambda p: provision.build_database(p, stubs.FakeDatabases(), "db",
+                                           1, 5, dbName="site",
+                                           userName="app"))
+    self.assertEqual(dbi.status, 'ACTIVE')
+    self.assertEqual(dbi.databases, ["site"])
+    self.assertEqual(dbi.users, [("app", password, "site")])
+    self.assertEqual(len(password), 10)
+
+  def test_instance_only(self):
+    dbi, password = self.run_quietly(
+        lambda p: provision.build_database(p, stubs.FakeDatabases(), "db",
+                                           1, 5))
+    self.assertEqual((dbi.databases, dbi.users, password), ([], [], None))
+
+if __name__ == "__main__":
+  unittest.main()
+
+# vim: ts=2 sw=2 tw=78 expandtab
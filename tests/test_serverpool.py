@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+# Tests for serverpool - handing out pre-built servers.
+
+# Copyright 2013 Scott Gilbert
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+import time
+import unittest
+import stubs
+import serverpool
+
+class PoolTest(stubs.FastWaits, unittest.TestCase):
+  def setUp(self):
+    stubs.FastWaits.setUp(self)
+    self.pollInterval = serverpool.POLL_INTERVAL
+    serverpool.POLL_INTERVAL = 0.01
+    self.cs = stubs.FakeCompute(buildTicks=2)
+    self.pool = serverpool.ServerPool(self.cs, 2, "img", 2)
+
+  def tearDown(self):
+    self.pool.stop()
+    serverpool.POLL_INTERVAL = self.pollInterval
+    stubs.FastWaits.tearDown(self)
+
+  def fill(self):
+    with stubs.quiet():
+      self.pool.refill()
+      while self.pool.building:
+        self.pool.check()
+
+  def test_refill_tops_up_to_size(self):
+    self.fill()
+    self.assertEqual(len(self.pool.ready), 2)
+    with stubs.quiet():
+      self.assertEqual(self.pool.refill(), [])
+    self.assertEqual(self.cs.servers.calls['create'], 2)
+
+  def test_hit(self):
+    self.fill()
+    with stubs.quiet():
+      srv = self.pool.get("web1")
+    self.assertEqual(srv.name, "web1")
+    self.assertEqual(self.cs.servers.backend[srv.id]['name'], "web1")
+    self.assertEqual(srv.adminPass, 'secret')
+    stats = self.pool.stats()
+    self.assertEqual((stats['requests'], stats['hits'], stats['ready']),
+                     (1, 1, 1))
+
+  def test_miss_waits_for_a_build(self):
+    self.pool.size = 0
+    with stubs.quiet():
+      self.pool.start()
+      srv = self.pool.get("web1", timeout=10)
+    self.assertEqual(srv.name, "web1")
+    self.assertEqual(srv.status, 'ACTIVE')
+    stats = self.pool.stats()
+    self.assertEqual((stats['requests'], stats['hits']), (1, 0))
+    self.assertEqual(stats['hitRate'], 0.0)
+
+  def test_timeout(self):
+    self.pool.size = 0
+    self.assertEqual(self.pool.get("web1", timeout=0.01), None)
+    self.assertEqual(self.pool.waiting, 0)
+
+  def test_failed_builds_are_thrown_away(self):
+    self.cs.servers.failNames = set(["pool-x"])
+    with stubs.quiet():
+      srv = self.cs.servers.create("pool-x", "img", 2)
+      self.pool.building[srv.id] = srv
+      self.pool.check()
+      self.pool.check()
+    self.assertEqual(self.pool.building, {})
+    self.assertFalse(srv.id in self.cs.servers.backend)
+
+  def test_ttl(self):
+    self.fill()
+    self.pool.ttl = 60
+    since, srv = self.pool.ready[0]
+    self.pool.ready[0] = (since - 120, srv)
+    self.pool.check()
+    self.assertEqual(len(self.pool.ready), 1)
+    self.assertFalse(srv.id in self.cs.servers.backend)
+
+  def test_adopt(self):
+    servers = self.cs.servers
+    servers.create("pool-a", "img", 2, status='ACTIVE')
+    servers.create("pool-b", "img", 2)
+    servers.create("pool-c", "img", 2, status='ERROR')
+    servers.create("pool-d", "other", 2, status='ACTIVE')
+    servers.create("web", "img", 2, status='ACTIVE')
+    with stubs.quiet():
+      self.assertEqual(self.pool.adopt(), 2)
+      self.assertEqual(len(self.pool.ready), 1)
+      self.assertEqual(len(self.pool.building), 1)
+      # adopted servers come back without adminPass, so it is reset
+      srv = self.pool.get("web1")
+    self.assertEqual(servers.calls['change_password'], 1)
+    self.assertTrue(srv.adminPass)
+    self.assertEqual(sorted(i['name'] for i in servers.backend.values()),
+                     ["pool-b", "pool-d", "web", "web1"])
+
+  def test_adopted_servers_age_from_creation(self):
+    old = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(time.time() - 600))
+    servers = self.cs.servers
+    servers.create("pool-new", "img", 2, status='ACTIVE')
+    servers.create("pool-old", "img", 2, status='ACTIVE', created=old)
+    self.pool.ttl = 300
+    self.pool.adopt()
+    self.assertEqual([srv.name for since, srv in self.pool.ready],
+                     ["pool-old", "pool-new"])
+    self.pool.check()
+    self.assertEqual([srv.name for since, srv in self.pool.ready],
+                     ["pool-new"])
+
+  def test_boot_from_volume_servers_are_not_ours(self):
+    srv = self.cs.servers.create("pool-a", "img", 2, status='ACTIVE')
+    self.cs.servers.backend[srv.id]['image'] = ""
+    self.assertEqual(self.pool.adopt(), 0)
+
+  def test_building_server_deleted_elsewhere(self):
+    with stubs.quiet():
+      self.pool.refill()
+      gone = self.pool.building.values()[0]
+      del self.cs.servers.backend[gone.id]
+      self.pool.check()
+      self.assertFalse(gone.id in self.pool.building)
+      self.assertEqual(len(self.pool.building), 1)
+      # and the pool is topped back up
+      self.assertEqual(len(self.pool.refill()), 1)
+
+  def test_ready_server_deleted_elsewhere(self):
+    self.fill()
+    gone = self.pool.ready[0][1]
+    del self.cs.servers.backend[gone.id]
+    with stubs.quiet():
+      srv = self.pool.get("web1")
+    self.assertNotEqual(srv.id, gone.id)
+    self.assertEqual(srv.name, "web1")
+    self.assertEqual(len(self.pool.ready), 0)
+
+  def test_drain(self):
+    self.fill()
+    with stubs.quiet():
+      self.pool.stop(drain=True)
+    self.assertEqual(self.cs.servers.backend, {})
+
+class RandomPasswordTest(unittest.TestCase):
+  def test_length(self):
+    self.assertEqual(len(serverpool.random_password(20)), 20)
+    self.assertNotEqual(serverpool.random_password(),
+                        serverpool.random_password())
+
+if __name__ == "__main__":
+  unittest.main()
+
+# vim: ts=2 sw=2 tw=78 expandtab
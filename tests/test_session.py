@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+# Tests for session - the cached authentication and shared connections.
+
+# Copyright 2013 Scott Gilbert
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+import json
+import time
+import calendar
+import unittest
+import stubs
+import session
+
+class ExpiryTimeTest(unittest.TestCase):
+  def test_offsets(self):
+    utc = calendar.timegm((2013, 8, 14, 22, 34, 39, 0, 0, 0))
+    for expires in ("2013-08-14T22:34:39Z", "2013-08-14T22:34:39.000Z",
+                    "2013-08-14T17:34:39.000-05:00",
+                    "2013-08-15T04:04:39+05:30", "2013-08-14T22:34:39",
+                    "2013-08-14T23:34:39.123+0100"):
+      self.assertEqual(session.expiry_time(expires), utc, expires)
+
+  def test_not_an_expiry_time(self):
+    for expires in (None, 1376519679.0, "", "tomorrow",
+                    "2013-08-14 22:34:39"):
+      self.assertEqual(session.expiry_time(expires), None)
+
+class SessionTest(stubs.IdentityService, unittest.TestCase):
+  def set_credential_file(self):
+    session.set_credential_file(self.credentialFile, cacheFile=self.cacheFile)
+
+  def test_second_run_uses_cache(self):
+    self.set_credential_file()
+    self.new_run()
+    self.set_credential_file()
+    for i in xrange(3):
+      self.assertEqual(stubs.pyrax.identity.get("/servers"), 200)
+    self.assertEqual(self.server.authCalls, 1)
+    self.assertEqual(stubs.pyrax.identity.token, "token-1")
+    # one authentication and three API calls, all over one connection
+    self.assertEqual(session.connection_stats(), (1, 4))
+
+  def test_cache_holds_expiry_as_given(self):
+    self.set_credential_file()
+    with open(self.cacheFile) as f:
+      cached = json.load(f)
+    self.assertTrue(cached['expires'].endswith("-05:00"))
+    expires = session.expiry_time(cached['expires'])
+    self.assertTrue(abs(expires - (time.time() + 3600)) < 60)
+
+  def test_expiring_token_not_used(self):
+    self.server.lifetime = session.EXPIRY_MARGIN - 60
+    self.set_credential_file()
+    self.new_run()
+    self.set_credential_file()
+    self.assertEqual(self.server.authCalls, 2)
+
+  def test_old_cache_format_ignored(self):
+    self.set_credential_file()
+    with open(self.cacheFile) as f:
+      cached = json.load(f)
+    cached['expires'] = time.time() + 3600
+    with open(self.cacheFile, 'w') as f:
+      json.dump(cached, f)
+    self.new_run()
+    self.set_credential_file()
+    self.assertEqual(self.server.authCalls, 2)
+
+  def test_refused_cached_token_reauthenticates(self):
+    self.set_credential_file()
+    self.server.revoke("token-1")
+    self.new_run()
+    self.set_credential_file()
+    self.assertEqual(stubs.pyrax.identity.get("/servers"), 200)
+    self.assertEqual(stubs.pyrax.identity.get("/servers"), 200)
+    self.assertEqual(self.server.authCalls, 2)
+    self.assertEqual(stubs.pyrax.identity.token, "token-2")
+    # the new token is what gets cached
+    self.new_run()
+    self.set_credential_file()
+    self.assertEqual(stubs.pyrax.identity.token, "token-2")
+    self.assertEqual(self.server.authCalls, 2)
+
+  def test_refused_fresh_token_stands(self):
+    self.set_credential_file()
+    self.server.revoke("token-1")
+    self.assertEqual(stubs.pyrax.identity.get("/servers"), 401)
+    self.assertEqual(self.server.authCalls, 1)
+
+if __name__ == "__main__":
+  unittest.main()
+
+# vim: ts=2 sw=2 tw=78 expandtab
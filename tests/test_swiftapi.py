@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+# Tests for swiftapi - listings, bulk delete and uploads against an
+# in-memory Swift.
+
+# Copyright 2013 Scott Gilbert
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+import os
+import hashlib
+import tempfile
+import itertools
+import unittest
+import stubs
+import session
+import swiftapi
+
+_accounts = itertools.count(1)
+
+class SwiftTestCase(unittest.TestCase):
+  def setUp(self):
+    self.swift = stubs.FakeSwift()
+    # a storage URL of its own, so each test gets an empty account
+    self.url = "http://swift.test/v1/AUTH_%d" % next(_accounts)
+    self.swift.mount(session.http_session(), self.url)
+    self.token = "token"
+
+  def fill(self, container, names):
+    for name in names:
+      swiftapi.put_object(self.url, self.token, container, name,
+                          name.encode("utf-8"))
+
+  def requests_made(self, method):
+    return [r for r in self.swift.requests if r[0] == method]
+
+class ListingTest(SwiftTestCase):
+  def test_pages_with_marker(self):
+    names = ["obj%03d" % i for i in xrange(25)]
+    self.fill("c", names)
+    listed = [o['name'] for o in swiftapi.iter_objects(self.url, self.token,
+                                                        "c", limit=10)]
+    self.assertEqual(listed, names)
+    gets = self.requests_made('GET')
+    self.assertEqual(len(gets), 3)
+    self.assertEqual(gets[1][2]['marker'], "obj009")
+
+  def test_prefix(self):
+    self.fill("c", ["a/1", "a/2", "b/1"])
+    listed = [o['name'] for o in swiftapi.iter_objects(self.url, self.token,
+                                                        "c", prefix="a/")]
+    self.assertEqual(listed, ["a/1", "a/2"])
+
+  def test_empty_container(self):
+    swiftapi._request('PUT', self.url + "/empty", self.token)
+    self.assertEqual(list(swiftapi.iter_objects(self.url, self.token,
+                                                "empty")), [])
+
+  def test_containers(self):
+    self.fill("one", ["x"])
+    self.fill("two", ["y"])
+    self.assertEqual([c['name'] for c in
+                      swiftapi.iter_containers(self.url, self.token,
+                                               limit=1)], ["one", "two"])
+
+  def test_unicode_names(self):
+    name = u"caf\xe9"
+    self.fill(u"c\xe9", [name])
+    listed = list(swiftapi.iter_objects(self.url, self.token, u"c\xe9"))
+    self.assertEqual(listed[0]['name'], name)
+
+class DeleteTest(SwiftTestCase):
+  def test_bulk_delete(self):
+    self.fill("c", ["a", "b"])
+    deleted, notFound, errors = swiftapi.bulk_delete(self.url, self.token,
+                                                     ["c/a", "c/b", "c/zz"])
+    self.assertEqual((deleted, notFound, errors), (2, 1, []))
+
+  def test_bulk_delete_limit(self):
+    self.assertRaises(ValueError, swiftapi.bulk_delete, self.url, self.token,
+                      ["c/%d" % i
+                       for i in xrange(swiftapi.BULK_DELETE_MAX + 1)])
+
+  def test_delete_container_objects(self):
+    self.fill("c", ["obj%03d" % i for i in xrange(25)])
+    progress = []
+    deleted, errors = swiftapi.delete_container_objects(
+        self.url, self.token, "c", batch=10,
+        progress=lambda c, n, rate: progress.append(n))
+    self.assertEqual((deleted, errors), (25, []))
+    self.assertEqual(progress, [10, 20, 25])
+    self.assertEqual(len(self.requests_made('POST')), 3)
+    swiftapi.delete_container(self.url, self.token, "c")
+    self.assertFalse("c" in self.swift.containers)
+
+class PutTest(SwiftTestCase):
+  def test_put_object_returns_etag(self):
+    etag = swiftapi.put_object(self.url, self.token, "c", "o", "data")
+    self.assertEqual(etag, hashlib.md5("data").hexdigest())
+
+class LargeObjectTest(SwiftTestCase):
+  def setUp(self):
+    SwiftTestCase.setUp(self)
+    fd, self.path = tempfile.mkstemp()
+    os.close(fd)
+
+  def tearDown(self):
+    os.remove(self.path)
+
+  def write(self, data):
+    with open(self.path, 'wb') as f:
+      f.write(data)
+
+  def put(self, **kwargs):
+    with stubs.quiet():
+      return swiftapi.put_file(self.url, self.token, "c", u"big\xe9",
+                               self.path, segmentSize=10, **kwargs)
+
+  def segments(self):
+    return sorted(self.swift.containers.get("c_segments", {}))
+
+  def test_segment_size_for(self):
+    self.assertEqual(swiftapi.segment_size_for(10, 100), 100)
+    self.assertEqual(swiftapi.segment_size_for(
+        swiftapi.SLO_MAX_SEGMENTS * 100 + 1, 100), 101)
+
+  def test_small_file_is_one_object(self):
+    self.write("small")
+    etag = self.put()
+    self.assertEqual(etag, hashlib.md5("small").hexdigest())
+    self.assertEqual(etag, swiftapi.file_etag(self.path, 10))
+    self.assertEqual(self.segments(), [])
+
+  def test_segments_and_etag(self):
+    data = "".join(chr(i) for i in xrange(35))
+    self.write(data)
+    etag = self.put()
+    names = [u"big\xe9/%08d" % i for i in xrange(4)]
+    self.assertEqual(self.segments(), [n.encode('utf-8') for n in names])
+    manifest = self.swift.containers["c"][u"big\xe9".encode('utf-8')]
+    self.assertEqual([s['size_bytes'] for s in manifest['manifest']],
+                     [10, 10, 10, 5])
+    # the etag sync compares against is the MD5 of the segment MD5s, and
+    # the one the listing shows
+    self.assertEqual(etag, swiftapi.file_etag(self.path, 10))
+    self.assertNotEqual(etag, hashlib.md5(data).hexdigest())
+    listed = list(swiftapi.iter_objects(self.url, self.token, "c"))
+    self.assertEqual(listed[0]['hash'], etag)
+
+  def test_timings(self):
+    self.write("x" * 25)
+    timings = {}
+    self.put(timings=timings)
+    self.assertEqual(sorted(timings), ['hash', 'put', 'read'])
+
+  def test_shrinking_deletes_unused_segments(self):
+    self.write("x" * 35)
+    self.put()
+    self.write("y" * 15)
+    etag = self.put()
+    self.assertEqual(self.segments(), [u"big\xe9/%08d".encode('utf-8') % i
+                                       for i in xrange(2)])
+    self.assertEqual(etag, swiftapi.file_etag(self.path, 10))
+
+  def test_replacing_with_small_file_deletes_segments(self):
+    self.write("x" * 35)
+    self.put()
+    self.write("tiny")
+    self.put()
+    self.assertEqual(self.segments(), [])
+
+  def test_new_object_skips_the_check(self):
+    self.write("x" * 35)
+    self.put(checkExisting=False)
+    self.assertEqual(self.requests_made('HEAD'), [])
+    self.put()
+    self.assertEqual(len(self.requests_made('HEAD')), 1)
+    # same number of segments: nothing to clean up
+    self.assertEqual(self.requests_made('POST'), [])
+    self.assertEqual(len(self.segments()), 4)
+
+if __name__ == "__main__":
+  unittest.main()
+
+# vim: ts=2 sw=2 tw=78 expandtab
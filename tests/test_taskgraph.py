@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+# Tests for taskgraph - running dependent tasks as early as possible.
+
+# Copyright 2013 Scott Gilbert
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+import time
+import threading
+import unittest
+import stubs
+import taskgraph
+
+class OrderTest(unittest.TestCase):
+  def test_topological_order(self):
+    deps = {'b': ['a'], 'c': ['a'], 'd': ['b', 'c']}
+    self.assertEqual(taskgraph.topological_order('abcd', deps),
+                     ['a', 'b', 'c', 'd'])
+
+  def test_unknown_dependencies_are_ignored(self):
+    self.assertEqual(taskgraph.topological_order('ab', {'b': ['zz']}),
+                     ['a', 'b'])
+
+  def test_circular(self):
+    self.assertRaises(ValueError, taskgraph.topological_order, 'ab',
+                      {'a': ['b'], 'b': ['a']})
+
+  def test_critical_path(self):
+    deps = {'b': ['a'], 'c': ['b'], 'd': ['a']}
+    self.assertEqual(taskgraph.critical_path('abcd', deps), ['a', 'b', 'c'])
+    cost = {'a': 1, 'b': 1, 'c': 1, 'd': 10}
+    self.assertEqual(taskgraph.critical_path('abcd', deps, cost.get),
+                     ['a', 'd'])
+
+class RunTest(unittest.TestCase):
+  def test_runs_after_dependencies(self):
+    finished = []
+    lock = threading.Lock()
+
+    def task(name):
+      def run():
+        with lock:
+          finished.append(name)
+        return name.upper()
+      return run
+
+    tasks = dict((name, task(name)) for name in 'abcd')
+    results = taskgraph.run_tasks(tasks, {'b': ['a'], 'c': ['b'],
+                                          'd': ['a']})
+    self.assertEqual(results['c'], ('done', 'C'))
+    self.assertTrue(finished.index('a') < finished.index('b') <
+                    finished.index('c'))
+    self.assertTrue(finished.index('a') < finished.index('d'))
+
+  def test_independent_tasks_overlap(self):
+    started = time.time()
+    tasks = dict((name, lambda: time.sleep(0.2)) for name in 'abcd')
+    taskgraph.run_tasks(tasks, {}, concurrency=4)
+    self.assertTrue(time.time() - started < 0.6)
+
+  def test_failure_skips_dependents(self):
+    def fail():
+      raise RuntimeError("nope")
+
+    tasks = {'a': fail, 'b': lambda: 1, 'c': lambda: 2, 'd': lambda: 3}
+    results = taskgraph.run_tasks(tasks, {'b': ['a'], 'c': ['b']})
+    self.assertEqual(results['a'][0], 'failed')
+    self.assertEqual(results['b'], ('skipped', 'a'))
+    self.assertEqual(results['c'], ('skipped', 'a'))
+    self.assertEqual(results['d'], ('done', 3))
+
+if __name__ == "__main__":
+  unittest.main()
+
+# vim: ts=2 sw=2 tw=78 expandtab
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+# Tests for waiter - the adaptive polling used by every status wait.
+
+# Copyright 2013 Scott Gilbert
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+import time
+import unittest
+import stubs
+import waiter
+
+class IntervalsTest(unittest.TestCase):
+  def test_backs_off_up_to_maximum(self):
+    delays = waiter.intervals(initial=1, maximum=4, factor=2, jitter=0)
+    self.assertEqual([next(delays) for i in xrange(5)], [1, 2, 4, 4, 4])
+
+  def test_jitter_stays_in_bounds(self):
+    delays = waiter.intervals(initial=10, maximum=10, jitter=0.25)
+    for i in xrange(200):
+      self.assertTrue(7.5 <= next(delays) <= 12.5)
+
+  def test_hint_goes_most_of_the_way_first(self):
+    delays = waiter.intervals(initial=1, jitter=0, hint=100)
+    self.assertEqual(next(delays), 90)
+    self.assertEqual(next(delays), 1)
+    self.assertEqual(next(waiter.intervals(hint=400)), 370)
+
+class WaitTest(stubs.FastWaits, unittest.TestCase):
+  def test_wait_until_returns_check_result(self):
+    calls = []
+
+    def check():
+      calls.append(1)
+      return len(calls) == 3 and "done"
+
+    self.assertEqual(waiter.wait_until(check), "done")
+    self.assertEqual(len(calls), 3)
+
+  def test_wait_until_deadline(self):
+    self.assertRaises(waiter.WaitTimeout, waiter.wait_until,
+                      lambda: False, deadline=0.01)
+
+  def test_wait_for_status_stops_on_terminal(self):
+    class Thing(object):
+      statuses = ['BUILD', 'BUILD', 'ERROR']
+      status = 'BUILD'
+
+      def get(self):
+        self.status = self.statuses.pop(0)
+
+    self.assertEqual(waiter.wait_for_status(Thing()), 'ERROR')
+
+if __name__ == "__main__":
+  unittest.main()
+
+# vim: ts=2 sw=2 tw=78 expandtab
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# uploadmeter - Keep track of how an upload is going: bytes and objects per
+# second, requests in flight, and how long each object spent being read from
+# disk, hashed and PUT.  Shown as a live status line, and optionally written
+# to a trace file (one JSON document per object) for later digging.
+
+# Copyright 2013 Scott Gilbert
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+import sys
+import time
+import json
+import threading
+import collections
+import buildhistory
+
+# phases each upload's time is split into
+PHASES = ('read', 'hash', 'put')
+
+# number of most recent uploads the latency percentiles are worked out from
+RECENT_UPLOADS = 1000
+
+# seconds of recent uploads the rates are worked out from
+RATE_WINDOW = 10
+
+def human_bytes(count):
+  """Return a byte count as a short string, ie: 12.3MB"""
+  for unit in ('B', 'KB', 'MB', 'GB'):
+    if abs(count) < 1024:
+      return "%.1f%s" % (count, unit)
+    count /= 1024.0
+  return "%.1fTB" % count
+
+class UploadMeter(object):
+  """Collects timings for a batch of uploads.  Call begin() as each upload
+  starts and end() as it finishes (from any thread); status() describes
+  how things are going right now.
+  """
+  def __init__(self, traceFile=None, out=sys.stdout):
+    self.out = out
+    self.live = hasattr(out, 'isatty') and out.isatty()
+    self.trace = open(traceFile, 'a') if traceFile else None
+    self.lock = threading.Lock()
+    self.started = time.time()
+    self.inflight = 0
+    self.objects = 0
+    self.bytes = 0
+    self.failed = 0
+    self.recent = collections.deque()
+    self.latency = dict((phase, collections.deque(maxlen=RECENT_UPLOADS))
+                        for phase in PHASES + ('total',))
+
+  def begin(self):
+    """An upload has started"""
+    with self.lock:
+      self.inflight += 1
+
+  def end(self, objName, size, timings, elapsed, error=None):
+    """An upload of size bytes has finished after elapsed seconds.  timings
+    is a dict of phase -> seconds (see swiftapi.put_file).  error, if given,
+    is why it failed.
+    """
+    now = time.time()
+    with self.lock:
+      self.inflight -= 1
+      if error is None:
+        self.objects += 1
+        self.bytes += size
+        self.recent.append((now, size))
+        for phase in PHASES:
+          self.latency[phase].append(timings.get(phase, 0.0))
+        self.latency['total'].append(elapsed)
+      else:
+        self.failed += 1
+      if self.trace is not None:
+        entry = {"when": round(now, 3), "object": objName, "bytes": size,
+                 "total": round(elapsed, 4)}
+        for phase in PHASES:
+          entry[phase] = round(timings.get(phase, 0.0), 4)
+        if error is not None:
+          entry["error"] = str(error)
+        self.trace.write(json.dumps(entry) + "\n")
+
+  def rates(self):
+    """Return tuple (bytes per second, objects per second) over the last
+    RATE_WINDOW seconds.
+    """
+    now = time.time()
+    with self.lock:
+      while self.recent and self.recent[0][0] < now - RATE_WINDOW:
+        self.recent.popleft()
+      window = max(min(RATE_WINDOW, now - self.started), 0.001)
+      return (sum(size for when, size in self.recent) / window,
+              len(self.recent) / window)
+
+  def percentiles(self, phase):
+    """Return tuple of p50, p95 and p99 seconds for phase, over the last
+    RECENT_UPLOADS uploads.
+    """
+    with self.lock:
+      times = list(self.latency[phase])
+    return tuple(buildhistory.percentile(times, pct) or 0.0
+                 for pct in (50, 95, 99))
+
+  def status(self):
+    """Return a one line summary of the upload so far"""
+    bytesPerSec, objsPerSec = self.rates()
+    phases = " ".join("%s %s" % (phase, "/".join("%.0f" % (t * 1000) for t in
+                                                 self.percentiles(phase)))
+                      for phase in PHASES)
+    return "%d files %s/s %.1f obj/s %d in flight | ms p50/95/99 %s" % (
+            self.objects, human_bytes(bytesPerSec), objsPerSec, self.inflight,
+            phases)
+
+  def show(self, extra=""):
+    """Display the status line - rewritten in place on a terminal, or as
+    a new line otherwise.
+    """
+    line = self.status() + extra
+    if self.live:
+      self.out.write("\r%-79s" % line)
+      self.out.flush()
+    else:
+      print >>self.out, line
+
+  def finish(self):
+    """All done: end the live line, print the latency percentiles for each
+    phase and close the trace file.
+    """
+    if self.live:
+      self.out.write("\n")
+    elapsed = max(time.time() - self.started, 0.001)
+    print >>self.out, "Uploaded %d files (%s) in %.1f seconds:" % (
+            self.objects, human_bytes(self.bytes), elapsed),
+    print >>self.out, "%s/s, %.1f obj/s" % (human_bytes(self.bytes / elapsed),
+                                            self.objects / elapsed)
+    for phase in PHASES + ('total',) if self.objects else ():
+      print >>self.out, "  %-5s p50 %7.1fms  p95 %7.1fms  p99 %7.1fms" % (
+              (phase,) + tuple(t * 1000 for t in self.percentiles(phase)))
+    if self.trace is not None:
+      self.trace.close()
+      self.trace = None
+
+# vim: ts=2 sw=2 tw=78 expandtab
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# waiter - adaptive polling used by the challenge scripts while they wait for
+# cloud resources to finish building (or to free up).
+
+# Copyright 2013 Scott Gilbert
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+import time
+import random
+
+class WaitTimeout(Exception):
+  """Raised when the thing being waited on is still not done when the
+  deadline passes.
+  """
+  pass
+
+def intervals(initial=1, maximum=30, factor=1.5, jitter=0.25, hint=None):
+  """Generate the sleep intervals to use between status checks.
+
+  Checks start out quick (every initial seconds) and back off exponentially
+  by factor, up to maximum seconds apart.  Every interval is stretched or
+  shrunk at random by up to jitter (a fraction), so a bunch of waiters
+  started at the same moment do not all poll in lock step.
+
+  If hint is given (number of seconds the resource is expected to take,
+  ie: from previous builds) the first sleep goes most of the way there, and
+  the quick checks start from that point instead.
+  """
+  if hint:
+    yield max(hint * 0.9, hint - 30)
+  delay = initial
+  while True:
+    yield delay * random.uniform(1 - jitter, 1 + jitter)
+    delay = min(delay * factor, maximum)
+
+def wait_until(check, deadline=None, progress=None, **kwargs):
+  """Call check() until it returns something true, sleeping an adaptive
+  interval (see intervals) before each call.  progress, if given, is called
+  after every check - handy for printing a little activity indicator.
+
+  Returns whatever check() returned.  Raises WaitTimeout if deadline seconds
+  go by first.  Any other keyword arguments are passed on to intervals.
+  """
+  started = time.time()
+  for delay in intervals(**kwargs):
+    if deadline is not None:
+      delay = min(delay, max(0, started + deadline - time.time()))
+    time.sleep(delay)
+    result = check()
+    if progress is not None:
+      progress()
+    if result:
+      return result
+    if deadline is not None and time.time() - started >= deadline:
+      raise WaitTimeout("Still waiting after %d seconds" % deadline)
+
+def wait_for_status(obj, ready=('ACTIVE',), terminal=('ERROR',),
+                    attr='status', **kwargs):
+  """Given a pyrax object (server, image, database instance, loadbalancer,
+  volume...) refresh it with obj.get() until its status is in ready, or in
+  terminal (a state it is never coming back from, such as ERROR).
+
+  Returns the final status.  Keyword arguments are passed on to wait_until.
+  """
+  def check():
+    obj.get()
+    status = getattr(obj, attr)
+    if status in ready or status in terminal:
+      return status
+    return None
+  return wait_until(check, **kwargs)
+
+# vim: ts=2 sw=2 tw=78 expandtab